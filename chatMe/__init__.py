@@ -11,7 +11,7 @@ ChatMe - AI语音助手
 """
 from .version import __version__
 from .main import VoiceAssistant, ChatMe
-from .core.providers import AIProvider
+from .core.providers import AIProvider, AsyncAIProvider
 from .exceptions import (
     AssistantError,
     NetworkError,
@@ -32,6 +32,7 @@ __all__ = [
     'VoiceAssistant',
     'ChatMe',
     'AIProvider',
+    'AsyncAIProvider',
     '__version__',
     'AssistantError',
     'NetworkError',
@@ -219,8 +219,12 @@ def chat(config):
                 
             # 获取AI响应
             try:
-                response = chat_client.chat(user_input)
-                click.echo(f"AI: {response}")
+                click.echo("AI: ", nl=False)
+                chat_client.chat(
+                    user_input,
+                    on_token=lambda delta: click.echo(delta, nl=False)
+                )
+                click.echo()
             except Exception as e:
                 click.echo(f"错误: {str(e)}", err=True)
                 
@@ -23,6 +23,21 @@ class Config:
     # 音频配置
     MINIMUM_VOLUME = 100
     MAX_HISTORY = 10
+    MAX_CONTEXT_TOKENS = 3000
+    
+    # 语音识别配置
+    ENERGY_THRESHOLD = 300
+    AMBIENT_DURATION = 1
+    LISTEN_TIMEOUT = 5
+    PHRASE_TIMEOUT = 10
+    SAMPLE_RATE = 16000
+    VAD_FRAME_MS = 20
+    # 尾部静音达到该时长即判定说完
+    VAD_END_SILENCE_MS = 300
+    # 朗读期间打断所需的能量相对 ENERGY_THRESHOLD 的倍数
+    BARGE_IN_RATIO = 3.0
+    # 语音识别后端，格式同 RecognitionBackend.from_config
+    RECOGNITION_BACKEND = {"type": "google", "settings": {}}
     
     def __init__(self, **kwargs):
         # 允许通过kwargs覆盖默认配置
@@ -59,6 +74,27 @@ class AIConfig:
                         "max_tokens": 2000
                     }
                 },
+                "cache": {
+                    "enabled": True,
+                    "ttl": 600,
+                    "short_term_size": 100,
+                    "long_term_size": 1000,
+                    "persistent": False,
+                    "path": str(Path.home() / ".chatme" / "cache"),
+                    "max_disk_bytes": 64 * 1024 * 1024,
+                    "semantic": {
+                        "enabled": False,
+                        "threshold": 0.9
+                    }
+                },
+                "recognition": {
+                    "type": "google"
+                },
+                "tts_cache": {
+                    "enabled": True,
+                    "path": str(Path.home() / ".chatme" / "tts"),
+                    "max_bytes": 32 * 1024 * 1024
+                },
                 "language": "zh-CN",
                 "speech_rate": 150,
                 "volume": 0.8
@@ -81,6 +117,62 @@ class AIConfig:
         """获取指定提供者的配置"""
         return self.config.get("providers", {}).get(provider_name, {})
     
+    def build_provider_spec(self, provider_name: str,
+                            settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        构建 AIProvider.from_config 使用的提供者描述
+        
+        提供者配置中可以用 type 指定类型（默认与名称相同）；路由类提供者的
+        backends 中以 provider 引用的其他提供者会被展开为完整描述。配置既可以
+        直接写设置项，也可以使用 config_templates/providers.yaml 中的
+        type/settings 形式，此时 module_path 等其余字段保留在描述顶层。
+        
+        Args:
+            provider_name: 提供者名称
+            settings: 提供者配置，为None时从配置文件读取
+            
+        Returns:
+            Dict: 包含 type 和 settings 的提供者描述
+        """
+        settings = dict(self.get_provider_config(provider_name) if settings is None else settings)
+        provider_type = settings.pop('type', provider_name)
+        spec: Dict[str, Any] = {}
+        if isinstance(settings.get('settings'), dict):
+            spec = settings
+            settings = dict(spec.pop('settings'))
+        if 'backends' in settings:
+            settings['backends'] = [
+                self._resolve_backend(backend) for backend in settings['backends']
+            ]
+        return {**spec, "type": provider_type, "settings": settings}
+    
+    def _resolve_backend(self, backend: Dict[str, Any]) -> Dict[str, Any]:
+        """展开路由后端中对其他提供者的引用"""
+        backend = dict(backend)
+        name = backend.pop('provider', None)
+        if name is None:
+            return backend
+        spec = self.build_provider_spec(name)
+        spec.setdefault('name', name)
+        spec.update(backend)
+        return spec
+    
+    def build_recognition_spec(self) -> Dict[str, Any]:
+        """
+        构建 RecognitionBackend.from_config 使用的识别后端描述
+        
+        Returns:
+            Dict: 包含 type 和 settings 的后端描述，未配置时使用 Google 在线识别
+        """
+        settings = dict(self.config.get("recognition") or {})
+        spec = {"type": settings.pop('type', 'google')}
+        # 自定义后端的导入路径放在描述的顶层
+        for key in ('module_path', 'class_name'):
+            if key in settings:
+                spec[key] = settings.pop(key)
+        spec["settings"] = settings
+        return spec
+    
     def set_provider_config(self, provider_name: str, config: Dict[str, Any]):
         """设置提供者配置"""
         if "providers" not in self.config:
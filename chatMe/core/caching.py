@@ -0,0 +1,194 @@
+"""
+响应缓存提供者模块
+"""
+
+from typing import Optional, Dict, Any, Iterator, AsyncIterator
+import logging
+from .providers import AIProvider, ProviderWrapper
+from ..utils.cache import ResponseCache
+from ..utils.semantic_cache import SemanticCache
+
+def request_key(provider: AIProvider, prompt: Optional[str], kwargs: Dict[str, Any],
+                history_limit: Optional[int] = None) -> str:
+    """
+    计算请求的缓存键
+    
+    键覆盖提供者、模型、温度、系统提示词、消息历史及其他请求参数。
+    
+    Args:
+        provider: 提供者（包装器会解包到最内层的提供者）
+        prompt: 用户输入，为None时只计算上下文部分
+        kwargs: 生成参数
+        history_limit: 只包含最近的 history_limit 条历史消息，None表示包含全部
+    
+    Returns:
+        str: 缓存键
+    """
+    while isinstance(provider, ProviderWrapper):
+        provider = provider.provider
+    params = {**getattr(provider, 'kwargs', {}), **kwargs}
+    system_prompt = params.pop('system_prompt', None)
+    history = params.pop('history', None)
+    messages = list(history or [])
+    if history_limit is not None:
+        messages = messages[max(0, len(messages) - history_limit):]
+    temperature = params.pop('temperature', None)
+    # 调度参数不影响回复内容
+    params.pop('priority', None)
+    if prompt is not None:
+        messages.append({"role": "user", "content": prompt})
+    return ResponseCache.make_key(
+        provider=type(provider).__name__,
+        model=getattr(provider, 'model', None),
+        temperature=temperature,
+        system_prompt=system_prompt,
+        messages=messages,
+        params=params
+    )
+
+class CachedProvider(ProviderWrapper):
+    """
+    带响应缓存的提供者
+    
+    缓存键覆盖提供者、模型、温度、系统提示词、消息历史及其他请求参数，
+    命中时不发起任何API调用。
+    """
+    
+    def __init__(self, provider: AIProvider, cache: Optional[ResponseCache] = None):
+        super().__init__(provider)
+        self.cache = cache or ResponseCache()
+        self.logger = logging.getLogger(__name__)
+    
+    def cache_key(self, prompt: str, kwargs: Dict[str, Any]) -> str:
+        """计算请求的缓存键"""
+        return request_key(self.provider, prompt, kwargs)
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        # get_or_compute 自己先查缓存，这里不再单独查询，避免未命中被重复计数
+        return self.cache.get_or_compute(
+            self.cache_key(prompt, kwargs),
+            lambda: self.provider.generate_response(prompt, **kwargs)
+        )
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        key = self.cache_key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        for delta in self.provider.stream_response(prompt, **kwargs):
+            chunks.append(delta)
+            yield delta
+        if chunks:
+            self.cache.set(key, "".join(chunks))
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        key = self.cache_key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        response = await super().agenerate_response(prompt, **kwargs)
+        if response:
+            self.cache.set(key, response)
+        return response
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        key = self.cache_key(prompt, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        chunks = []
+        async for delta in self.provider.astream_response(prompt, **kwargs):
+            chunks.append(delta)
+            yield delta
+        if chunks:
+            self.cache.set(key, "".join(chunks))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        return self.cache.get_stats()
+
+
+class SemanticCachedProvider(ProviderWrapper):
+    """
+    带语义缓存的提供者
+    
+    在相同上下文（模型、温度、系统提示词及其他参数）内，输入与已缓存问题的相似度
+    达到阈值时直接返回缓存回复。命名空间只包含最近 context_messages 条历史消息：
+    完整历史每轮都在变化，会使换一种问法几乎不可能命中；完全不含历史则“那明天呢？”
+    这类依赖上文的追问会命中其他对话里生成的回复。
+    
+    Args:
+        provider: 被包装的提供者
+        cache: 语义缓存，为None时使用默认配置
+        context_messages: 命名空间包含的最近历史消息数，默认为上一轮问答
+    """
+    
+    def __init__(self, provider: AIProvider, cache: Optional[SemanticCache] = None,
+                 context_messages: int = 2):
+        super().__init__(provider)
+        self.cache = cache or SemanticCache()
+        self.context_messages = context_messages
+        self.logger = logging.getLogger(__name__)
+    
+    def _lookup(self, prompt: str, kwargs: Dict[str, Any]):
+        namespace = request_key(self.provider, None, kwargs, history_limit=self.context_messages)
+        match = self.cache.lookup(prompt, namespace)
+        if match is not None:
+            self.logger.debug(f"语义缓存命中({match.score:.3f}): {prompt} -> {match.prompt}")
+        return namespace, match
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        namespace, match = self._lookup(prompt, kwargs)
+        if match is not None:
+            return match.response
+        
+        response = self.provider.generate_response(prompt, **kwargs)
+        if response:
+            self.cache.add(prompt, response, namespace)
+        return response
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        namespace, match = self._lookup(prompt, kwargs)
+        if match is not None:
+            yield match.response
+            return
+        
+        chunks = []
+        for delta in self.provider.stream_response(prompt, **kwargs):
+            chunks.append(delta)
+            yield delta
+        if chunks:
+            self.cache.add(prompt, "".join(chunks), namespace)
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        namespace, match = self._lookup(prompt, kwargs)
+        if match is not None:
+            return match.response
+        
+        response = await super().agenerate_response(prompt, **kwargs)
+        if response:
+            self.cache.add(prompt, response, namespace)
+        return response
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        namespace, match = self._lookup(prompt, kwargs)
+        if match is not None:
+            yield match.response
+            return
+        
+        chunks = []
+        async for delta in self.provider.astream_response(prompt, **kwargs):
+            chunks.append(delta)
+            yield delta
+        if chunks:
+            self.cache.add(prompt, "".join(chunks), namespace)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取语义缓存统计"""
+        return self.cache.get_stats()
@@ -0,0 +1,293 @@
+"""
+请求合并模块
+
+相同的请求同时在途时只向上游发起一次调用，其余调用方共享同一个结果。
+"""
+
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Iterator, AsyncIterator, Tuple
+import asyncio
+import logging
+import threading
+from .providers import AIProvider, ProviderWrapper
+from ..exceptions import APIError
+from .caching import request_key
+
+class _StreamBroadcast:
+    """
+    把一路上游流式输出广播给多个订阅者，晚加入的订阅者从头回放
+    
+    订阅者通过 join() 登记，读取结束或提前关闭时注销；全部订阅者离开后广播被取消，
+    生产者停止读取上游，后续的相同请求会重新发起。
+    """
+    
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+        self.error: Optional[Exception] = None
+        self._cond = threading.Condition()
+    
+    def join(self) -> bool:
+        """登记一个订阅者，广播已被取消时返回False"""
+        with self._cond:
+            if self.cancelled:
+                return False
+            self.subscribers += 1
+            return True
+    
+    def _leave(self):
+        with self._cond:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.cancelled = True
+    
+    def publish(self, delta: str) -> bool:
+        """发布一个增量，广播已被取消时返回False"""
+        with self._cond:
+            self.chunks.append(delta)
+            self._cond.notify_all()
+            return not self.cancelled
+    
+    def finish(self, error: Optional[Exception] = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+    
+    def subscribe(self) -> Iterator[str]:
+        """读取广播，调用前需已通过 join() 登记"""
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position >= len(self.chunks) and not self.done:
+                        self._cond.wait()
+                    pending = self.chunks[position:]
+                    finished = self.done
+                    error = self.error
+                position += len(pending)
+                yield from pending
+                if finished and position >= len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave()
+
+class _AsyncStreamBroadcast:
+    """_StreamBroadcast 的事件循环版本，全部订阅者离开后直接取消生产者任务"""
+    
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+        self.error: Optional[Exception] = None
+        self.task: Optional[asyncio.Future] = None
+        self._cond = asyncio.Condition()
+    
+    def join(self) -> bool:
+        """登记一个订阅者，广播已被取消时返回False"""
+        if self.cancelled:
+            return False
+        self.subscribers += 1
+        return True
+    
+    def _leave(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            self.cancelled = True
+            if self.task is not None:
+                self.task.cancel()
+    
+    async def publish(self, delta: str):
+        async with self._cond:
+            self.chunks.append(delta)
+            self._cond.notify_all()
+    
+    async def finish(self, error: Optional[Exception] = None):
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+    
+    async def subscribe(self) -> AsyncIterator[str]:
+        """读取广播，调用前需已通过 join() 登记"""
+        position = 0
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: position < len(self.chunks) or self.done)
+                    pending = self.chunks[position:]
+                    finished = self.done
+                    error = self.error
+                position += len(pending)
+                for delta in pending:
+                    yield delta
+                if finished and position >= len(self.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave()
+
+class CoalescingProvider(ProviderWrapper):
+    """
+    合并相同在途请求的提供者
+    
+    以与响应缓存相同的键识别相同请求。同步调用由首个调用方执行，其余调用方等待
+    同一个 Future；异步调用共享同一个任务；流式调用由后台生产者读取上游，
+    所有订阅者（包括晚加入者）收到相同的增量序列。所有订阅者都停止读取后生产者
+    关闭上游流，不再为被打断的回复继续付费。
+    """
+    
+    def __init__(self, provider: AIProvider):
+        super().__init__(provider)
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+        self._streams: Dict[str, _StreamBroadcast] = {}
+        self._async_calls: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._async_streams: Dict[Tuple[int, str], _AsyncStreamBroadcast] = {}
+        
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+    
+    def _count(self, leader: bool):
+        with self._lock:
+            if leader:
+                self.upstream_calls += 1
+            else:
+                self.coalesced_calls += 1
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        key = request_key(self.provider, prompt, kwargs)
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        self._count(leader)
+        
+        if not leader:
+            return future.result()
+        
+        try:
+            future.set_result(self.provider.generate_response(prompt, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return future.result()
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        key = request_key(self.provider, prompt, kwargs)
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None or not broadcast.join()
+            if leader:
+                broadcast = _StreamBroadcast()
+                broadcast.join()
+                self._streams[key] = broadcast
+        self._count(leader)
+        
+        if leader:
+            def _pump():
+                error: Optional[Exception] = None
+                stream = None
+                try:
+                    stream = self.provider.stream_response(prompt, **kwargs)
+                    for delta in stream:
+                        if not broadcast.publish(delta):
+                            break
+                except Exception as e:
+                    error = e
+                except BaseException as e:
+                    # 中断类异常不直接抛给订阅者，但订阅者仍需结束等待
+                    error = APIError(f"流式请求已中断: {type(e).__name__}")
+                    raise
+                finally:
+                    try:
+                        # 提前结束时关闭上游，释放连接和路由后端
+                        close = getattr(stream, 'close', None)
+                        if close is not None:
+                            close()
+                    finally:
+                        broadcast.finish(error)
+                        with self._lock:
+                            if self._streams.get(key) is broadcast:
+                                del self._streams[key]
+            
+            threading.Thread(target=_pump, daemon=True).start()
+        return broadcast.subscribe()
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        key = (id(asyncio.get_running_loop()), request_key(self.provider, prompt, kwargs))
+        task = self._async_calls.get(key)
+        leader = task is None
+        self._count(leader)
+        
+        if leader:
+            task = asyncio.ensure_future(super().agenerate_response(prompt, **kwargs))
+            self._async_calls[key] = task
+            task.add_done_callback(lambda _: self._async_calls.pop(key, None))
+        # shield 保证单个调用方被取消时不影响其他等待者
+        return await asyncio.shield(task)
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        key = (id(asyncio.get_running_loop()), request_key(self.provider, prompt, kwargs))
+        broadcast = self._async_streams.get(key)
+        leader = broadcast is None or not broadcast.join()
+        self._count(leader)
+        
+        if leader:
+            broadcast = _AsyncStreamBroadcast()
+            broadcast.join()
+            self._async_streams[key] = broadcast
+            
+            async def _pump():
+                error: Optional[Exception] = None
+                stream = None
+                try:
+                    stream = self.provider.astream_response(prompt, **kwargs)
+                    async for delta in stream:
+                        await broadcast.publish(delta)
+                except Exception as e:
+                    error = e
+                except BaseException as e:
+                    # 全部订阅者离开时任务被取消，CancelledError 在这里结束生产者
+                    error = APIError(f"流式请求已中断: {type(e).__name__}")
+                    raise
+                finally:
+                    try:
+                        aclose = getattr(stream, 'aclose', None)
+                        if aclose is not None:
+                            await aclose()
+                    finally:
+                        await broadcast.finish(error)
+            
+            def _done(_):
+                # 任务可能在开始执行前就被取消，在回调中移除以免残留
+                if self._async_streams.get(key) is broadcast:
+                    del self._async_streams[key]
+            
+            # 保存任务引用，避免在完成前被回收
+            broadcast.task = asyncio.ensure_future(_pump())
+            broadcast.task.add_done_callback(_done)
+        
+        async for delta in broadcast.subscribe():
+            yield delta
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计"""
+        with self._lock:
+            total = self.upstream_calls + self.coalesced_calls
+            return {
+                'upstream_calls': self.upstream_calls,
+                'coalesced_calls': self.coalesced_calls,
+                'coalesce_rate': self.coalesced_calls / total if total else 0.0
+            }
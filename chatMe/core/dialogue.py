@@ -9,12 +9,22 @@ Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查
 """
 对话管理模块
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Sequence, Mapping, Set
 import logging
-from dataclasses import dataclass
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
 from ..exceptions import DialogueError
 from ..config import Config
+from ..utils.tokens import count_tokens, MESSAGE_OVERHEAD
+from .summarizer import DialogueSummarizer
+from .session_store import SessionStore, SessionRecord
+from .message import Message, HistoryView
 
 @dataclass
 class DialogueContext:
@@ -22,16 +32,53 @@ class DialogueContext:
     user_id: str
     session_id: str
     start_time: datetime
-    messages: List[Dict[str, str]]
+    messages: List[Message]
     metadata: Optional[Dict[str, Any]] = None
+    # token_prefix[i] 为前 i 条消息的token总数，添加消息时增量维护
+    token_prefix: List[int] = field(default_factory=lambda: [0])
+    # 前 summarized_upto 条消息已合并进 summary
+    summary: Optional[str] = None
+    summarized_upto: int = 0
 
 class DialogueManager:
-    """对话管理器"""
+    """
+    对话管理器
     
-    def __init__(self, config: Optional[Dict[str, Any]] = None):
+    线程安全。会话按ID散列到 shards 把分段锁之一，同一会话的消息追加、读取和摘要
+    更新在其分段锁内串行执行，保证顺序；不同分段的会话互不阻塞。会话表和用户索引
+    由一把全局锁保护，只在创建、恢复和清除会话时短暂持有。加锁顺序固定为先分段锁
+    后全局锁。
+    """
+    
+    # 摘要在上下文中的前缀
+    SUMMARY_PREFIX = "此前对话的摘要："
+    
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 token_counter: Optional[Callable[[str], int]] = None,
+                 summarizer: Optional[DialogueSummarizer] = None,
+                 store: Optional[SessionStore] = None,
+                 hot_messages: Optional[int] = 64,
+                 shards: int = 16):
         self.config = config or Config()
+        # 活跃会话的内存缓存；配置了 store 时会话持久化在 store 中，按需恢复
         self.contexts: Dict[str, DialogueContext] = {}
+        self.store = store
+        self._last_access: Dict[str, float] = {}
+        # 用户ID -> 按创建顺序排列的会话ID，以及会话ID -> 用户ID 的反向索引
+        self._user_sessions: Dict[str, "OrderedDict[str, None]"] = {}
+        self._session_users: Dict[str, str] = {}
+        # 每个会话最近 hot_messages 条消息保持原文，更早的长消息压缩存放；None表示不压缩
+        self.hot_messages = hot_messages
         self.logger = logging.getLogger(__name__)
+        self.token_counter = token_counter or count_tokens
+        # 系统提示词和摘要每轮都会计数，缓存最近使用的结果
+        self._count_cached = lru_cache(maxsize=32)(self.token_counter)
+        self.summarizer = summarizer
+        self._lock = threading.RLock()
+        self._shard_locks = [threading.Lock() for _ in range(max(1, shards))]
+        if store is not None:
+            # 存储清除过期会话时跳过仍在内存中的会话
+            store.held_sessions = self._held_sessions
         
     def create_session(self, user_id: str) -> str:
         """
@@ -44,13 +91,28 @@ class DialogueManager:
             session_id: 会话ID
         """
         try:
-            session_id = f"{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-            self.contexts[session_id] = DialogueContext(
+            # 随机后缀保证同一秒内、多个进程之间创建的会话也不会冲突
+            session_id = f"{user_id}_{uuid.uuid4().hex}"
+            context = DialogueContext(
                 user_id=user_id,
                 session_id=session_id,
                 start_time=datetime.now(),
                 messages=[]
             )
+            with self._lock:
+                # 先加载该用户已有的会话，再写入新会话，保证索引顺序
+                sessions = self._user_index(user_id)
+            if self.store is not None:
+                self.store.create_session(SessionRecord(
+                    session_id=session_id,
+                    user_id=user_id,
+                    start_time=context.start_time.timestamp()
+                ))
+            with self._lock:
+                self.contexts[session_id] = context
+                self._last_access[session_id] = time.monotonic()
+                sessions[session_id] = None
+                self._session_users[session_id] = user_id
             self.logger.info(f"创建新会话: {session_id}")
             return session_id
         except Exception as e:
@@ -69,18 +131,25 @@ class DialogueManager:
             DialogueError: 添加消息失败
         """
         try:
-            if session_id not in self.contexts:
-                raise ValueError(f"Session {session_id} not found")
-                
-            self.contexts[session_id].messages.append({
-                "role": role,
-                "content": content,
-                "timestamp": datetime.now().isoformat()
-            })
+            message = Message(role, content)
+            tokens = self.token_counter(content) + MESSAGE_OVERHEAD
+            with self._session_lock(session_id):
+                context = self.get_context(session_id)
+                context.messages.append(message)
+                if self.hot_messages is not None and len(context.messages) > self.hot_messages:
+                    context.messages[-self.hot_messages - 1].compress()
+                if self.store is not None:
+                    self.store.append_messages(session_id, [message])
+                context.token_prefix.append(context.token_prefix[-1] + tokens)
+                self._maybe_summarize(session_id, context)
             self.logger.debug(f"添加消息到会话 {session_id}: {role} - {content[:50]}...")
         except Exception as e:
             raise DialogueError(f"添加消息失败: {str(e)}")
         
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        """会话所在分段的锁"""
+        return self._shard_locks[hash(session_id) % len(self._shard_locks)]
+        
     def get_context(self, session_id: str) -> DialogueContext:
         """
         获取对话上下文
@@ -95,35 +164,229 @@ class DialogueManager:
             DialogueError: 获取上下文失败
         """
         try:
-            if session_id not in self.contexts:
-                raise ValueError(f"Session {session_id} not found")
-            return self.contexts[session_id]
+            context = self.contexts.get(session_id)
+            if context is None:
+                context = self._resume(session_id)
+            self._last_access[session_id] = time.monotonic()
+            return context
         except Exception as e:
             raise DialogueError(f"获取上下文失败: {str(e)}")
         
-    def get_history(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, str]]:
+    def _resume(self, session_id: str) -> DialogueContext:
+        """从会话存储恢复会话"""
+        record = self.store.load_session(session_id) if self.store is not None else None
+        if record is None:
+            raise ValueError(f"Session {session_id} not found")
+        
+        prefix = [0]
+        for message in record.messages:
+            prefix.append(prefix[-1] + self.token_counter(message["content"]) + MESSAGE_OVERHEAD)
+        context = DialogueContext(
+            user_id=record.user_id,
+            session_id=session_id,
+            start_time=datetime.fromtimestamp(record.start_time),
+            messages=[Message.from_dict(m) for m in record.messages],
+            metadata=record.metadata,
+            token_prefix=prefix,
+            summary=record.summary,
+            summarized_upto=record.summarized_upto
+        )
+        with self._lock:
+            context = self.contexts.setdefault(session_id, context)
+            self._user_index(record.user_id)
+        self.logger.info(f"从存储恢复会话: {session_id}")
+        return context
+        
+    def _user_index(self, user_id: str) -> "OrderedDict[str, None]":
+        """获取用户的会话索引，首次访问时从存储加载（调用方需持有锁）"""
+        sessions = self._user_sessions.get(user_id)
+        if sessions is None:
+            sessions = OrderedDict()
+            if self.store is not None:
+                for session_id in self.store.list_sessions(user_id):
+                    sessions[session_id] = None
+                    self._session_users[session_id] = user_id
+            self._user_sessions[user_id] = sessions
+        return sessions
+        
+    def _held_sessions(self) -> Set[str]:
+        """内存中的会话ID"""
+        with self._lock:
+            return set(self.contexts)
+        
+    def _unindex(self, session_id: str):
+        """从用户索引中移除会话（调用方需持有锁）"""
+        user_id = self._session_users.pop(session_id, None)
+        sessions = self._user_sessions.get(user_id)
+        if sessions is not None:
+            sessions.pop(session_id, None)
+            if not sessions:
+                del self._user_sessions[user_id]
+        
+    def list_sessions(self, user_id: str) -> List[str]:
+        """
+        列出用户的全部会话
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            List[str]: 按创建时间从早到晚排列的会话ID
+        """
+        with self._lock:
+            sessions = self._user_sessions.get(user_id)
+            if sessions is None and self.store is not None:
+                sessions = self._user_index(user_id)
+            return list(sessions) if sessions else []
+        
+    def latest_session(self, user_id: str) -> Optional[str]:
+        """
+        获取用户最近创建的会话
+        
+        Args:
+            user_id: 用户ID
+            
+        Returns:
+            Optional[str]: 会话ID，用户没有会话时返回None
+        """
+        with self._lock:
+            sessions = self._user_sessions.get(user_id)
+            if sessions is None and self.store is not None:
+                sessions = self._user_index(user_id)
+            return next(reversed(sessions), None) if sessions else None
+        
+    def get_history(self, session_id: str, limit: Optional[int] = None) -> Sequence[Mapping[str, str]]:
         """
         获取对话历史
         
+        返回的是消息列表的只读视图，元素可以按 dict 方式读取；需要普通字典时
+        调用 to_dicts()。
+        
         Args:
             session_id: 会话ID
             limit: 返回的最大消息数量
             
         Returns:
-            List[Dict]: 对话历史消息列表
+            Sequence: 对话历史消息
             
         Raises:
             DialogueError: 获取历史记录失败
         """
         try:
-            context = self.get_context(session_id)
-            messages = context.messages
-            if limit:
-                messages = messages[-limit:]
-            return messages
+            context = self.contexts.get(session_id)
+            if context is None and self.store is not None:
+                # 未加载的会话直接做范围读取，不恢复整个会话
+                messages = self.store.get_messages(session_id, limit)
+                if messages:
+                    return messages
+            with self._session_lock(session_id):
+                messages = self.get_context(session_id).messages
+                return HistoryView(messages, len(messages) - limit if limit else 0)
         except Exception as e:
             raise DialogueError(f"获取历史记录失败: {str(e)}")
         
+    def build_context(self, session_id: str, max_tokens: int,
+                      system_prompt: Optional[str] = None) -> List[Dict[str, str]]:
+        """
+        在token预算内构建发送给模型的上下文
+        
+        始终保留系统提示词和对话摘要，其余预算从最新的消息开始向前填充，已合并进
+        摘要的消息不再发送。每条消息的token数在添加时已计算并累加为前缀和，因此只需
+        二分查找起始位置，不会重新计数历史。
+        
+        Args:
+            session_id: 会话ID
+            max_tokens: token预算（包含系统提示词和摘要）
+            system_prompt: 系统提示词
+            
+        Returns:
+            List[Dict]: 只包含 role 和 content 的消息列表，系统提示词在最前
+            
+        Raises:
+            DialogueError: 构建上下文失败
+        """
+        try:
+            messages = []
+            budget = max_tokens
+            if system_prompt:
+                messages.append({"role": "system", "content": system_prompt})
+                budget -= self._count_cached(system_prompt) + MESSAGE_OVERHEAD
+            
+            with self._session_lock(session_id):
+                context = self.get_context(session_id)
+                summary = context.summary
+                summarized_upto = context.summarized_upto
+                # 只在锁内确定消息数：消息列表和前缀和都只追加，锁外读取前 n 项是安全的
+                history = HistoryView(context.messages)
+                n = len(history)
+            if summary:
+                content = self.SUMMARY_PREFIX + summary
+                messages.append({"role": "system", "content": content})
+                budget -= self._count_cached(content) + MESSAGE_OVERHEAD
+            
+            # 找到最早的起点 i，使 i 之后的消息总token数不超过预算
+            prefix = context.token_prefix
+            start = max(bisect_left(prefix, prefix[n] - budget, hi=n + 1), summarized_upto)
+            messages.extend(
+                {"role": m.role, "content": m.content}
+                for m in history[start:]
+            )
+            return messages
+        except Exception as e:
+            raise DialogueError(f"构建上下文失败: {str(e)}")
+        
+    def _maybe_summarize(self, session_id: str, context: DialogueContext):
+        """未摘要的较早消息超过阈值时提交后台摘要任务"""
+        if self.summarizer is None:
+            return
+        end = len(context.messages) - self.summarizer.keep_recent
+        if end <= context.summarized_upto:
+            return
+        pending = context.token_prefix[end] - context.token_prefix[context.summarized_upto]
+        if pending >= self.summarizer.trigger_tokens:
+            self.summarizer.submit(self, session_id)
+        
+    def get_summary_window(self, session_id: str,
+                           keep_recent: int) -> Tuple[Optional[str], int, int, List[Dict[str, str]]]:
+        """
+        获取待摘要的消息范围
+        
+        Args:
+            session_id: 会话ID
+            keep_recent: 保留原文的最近消息数
+            
+        Returns:
+            (已有摘要, 起始位置, 结束位置, 待摘要消息)
+        """
+        with self._session_lock(session_id):
+            context = self.get_context(session_id)
+            start = context.summarized_upto
+            end = max(start, len(context.messages) - keep_recent)
+            return context.summary, start, end, context.messages[start:end]
+        
+    def set_summary(self, session_id: str, summary: str, start: int, end: int) -> bool:
+        """
+        更新会话摘要
+        
+        Args:
+            session_id: 会话ID
+            summary: 覆盖前 end 条消息的新摘要
+            start: 生成摘要时的 summarized_upto，用于检测并发更新
+            end: 新摘要覆盖到的消息位置
+            
+        Returns:
+            bool: 是否已更新（会话已删除或摘要已被其他任务更新时返回False）
+        """
+        with self._session_lock(session_id):
+            context = self.contexts.get(session_id)
+            if context is None or context.summarized_upto != start:
+                return False
+            context.summary = summary
+            context.summarized_upto = end
+            if self.store is not None:
+                self.store.save_summary(session_id, summary, end)
+        return True
+        
     def clear_session(self, session_id: str) -> None:
         """
         清除会话数据
@@ -135,8 +398,64 @@ class DialogueManager:
             DialogueError: 清除会话失败
         """
         try:
-            if session_id in self.contexts:
-                del self.contexts[session_id]
-                self.logger.info(f"清除会话: {session_id}")
+            with self._session_lock(session_id):
+                with self._lock:
+                    if session_id in self.contexts:
+                        del self.contexts[session_id]
+                        self.logger.info(f"清除会话: {session_id}")
+                    self._last_access.pop(session_id, None)
+                    self._unindex(session_id)
+                if self.store is not None:
+                    self.store.delete_session(session_id)
         except Exception as e:
-            raise DialogueError(f"清除会话失败: {str(e)}")
\ No newline at end of file
+            raise DialogueError(f"清除会话失败: {str(e)}")
+        
+    def evict_idle(self, max_idle: float) -> int:
+        """
+        从内存中移出空闲的会话
+        
+        会话仍保留在存储中，下次访问时恢复；同时清除存储中超过TTL的会话。
+        不再有活跃会话的用户索引一并移出，下次查询时从存储重新加载。
+        未配置存储时不移出任何会话。
+        
+        Args:
+            max_idle: 最长空闲时间（秒）
+            
+        Returns:
+            int: 移出的会话数
+        """
+        if self.store is None:
+            return 0
+        self.store.flush()
+        deadline = time.monotonic() - max_idle
+        with self._lock:
+            # get_context 不持有全局锁，先复制一份再遍历
+            idle = [sid for sid, t in list(self._last_access.items()) if t < deadline]
+        evicted = 0
+        for session_id in idle:
+            # 按先分段锁后全局锁的顺序加锁，不与正在进行的追加和读取交错
+            with self._session_lock(session_id), self._lock:
+                last_access = self._last_access.get(session_id)
+                if last_access is None or last_access >= deadline:
+                    # 等待分段锁期间会话被访问过或已被清除
+                    continue
+                self.contexts.pop(session_id, None)
+                del self._last_access[session_id]
+                evicted += 1
+        with self._lock:
+            active_users = {context.user_id for context in self.contexts.values()}
+            for user_id in [u for u in self._user_sessions if u not in active_users]:
+                for session_id in self._user_sessions.pop(user_id):
+                    self._session_users.pop(session_id, None)
+        self.store.evict_expired(self._held_sessions())
+        return evicted
+        
+    def flush(self) -> None:
+        """把缓冲的会话写入落盘"""
+        if self.store is not None:
+            self.store.flush()
+        
+    def close(self) -> None:
+        """落盘并关闭会话存储"""
+        if self.store is not None:
+            self.store.close()
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+对话消息模块
+
+大量会话常驻内存时，每条消息一个 dict（外加ISO时间字符串）的开销远大于内容本身。
+Message 使用 __slots__、共享的角色枚举和浮点时间戳，较早的长消息还可以用zlib压缩。
+Message 实现了只读 Mapping 接口，原先按 dict 读取消息的代码无需修改。
+"""
+
+from collections.abc import Mapping, Sequence
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional, Union
+import sys
+import time
+import zlib
+
+class Role(str, Enum):
+    """消息角色"""
+    SYSTEM = "system"
+    USER = "user"
+    ASSISTANT = "assistant"
+    
+    @classmethod
+    def of(cls, role: Union[str, "Role"]) -> "Role":
+        """把字符串转换为角色枚举"""
+        try:
+            return cls(role)
+        except ValueError:
+            raise ValueError(f"未知的消息角色: {role}")
+
+class Message(Mapping):
+    """
+    紧凑的对话消息
+    
+    可以像 dict 一样读取 role、content、timestamp 三个键，其中 timestamp 返回
+    ISO格式字符串以兼容原有格式；created_at 属性为浮点时间戳。
+    
+    Args:
+        role: 发言角色
+        content: 消息内容
+        created_at: 创建时间戳，默认为当前时间
+    """
+    
+    __slots__ = ('_role', '_content', 'created_at')
+    
+    KEYS = ("role", "content", "timestamp")
+    
+    def __init__(self, role: Union[str, Role], content: str, created_at: Optional[float] = None):
+        self._role = Role.of(role)
+        self._content: Union[str, bytes] = content
+        self.created_at = time.time() if created_at is None else created_at
+    
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "Message":
+        """从消息字典创建，兼容ISO字符串或浮点数形式的 timestamp"""
+        if isinstance(data, Message):
+            return data
+        timestamp = data.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        return cls(data["role"], data["content"], timestamp)
+    
+    @property
+    def role(self) -> str:
+        return self._role.value
+    
+    @property
+    def content(self) -> str:
+        content = self._content
+        if isinstance(content, bytes):
+            return zlib.decompress(content).decode('utf-8')
+        return content
+    
+    @property
+    def compressed(self) -> bool:
+        return isinstance(self._content, bytes)
+    
+    def compress(self, min_length: int = 256) -> bool:
+        """
+        压缩消息内容
+        
+        只有内容不短于 min_length 个字符且压缩后确实更小时才会压缩。
+        
+        Returns:
+            bool: 是否已压缩
+        """
+        content = self._content
+        if isinstance(content, bytes):
+            return True
+        if len(content) < min_length:
+            return False
+        packed = zlib.compress(content.encode('utf-8'))
+        if sys.getsizeof(packed) >= sys.getsizeof(content):
+            return False
+        self._content = packed
+        return True
+    
+    def to_dict(self) -> Dict[str, str]:
+        """转换为消息字典"""
+        return {"role": self.role, "content": self.content, "timestamp": self["timestamp"]}
+    
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self._role.value
+        if key == "content":
+            return self.content
+        if key == "timestamp":
+            return datetime.fromtimestamp(self.created_at).isoformat()
+        raise KeyError(key)
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.KEYS)
+    
+    def __len__(self) -> int:
+        return len(self.KEYS)
+    
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Message):
+            return (self._role, self.content, self.created_at) == (other._role, other.content, other.created_at)
+        return Mapping.__eq__(self, other)
+    
+    __hash__ = None
+    
+    def __repr__(self) -> str:
+        return f"Message(role={self.role!r}, content={self.content[:30]!r})"
+
+class HistoryView(Sequence):
+    """
+    消息列表的只读视图
+    
+    不复制底层列表，视图范围在创建时确定，之后追加的消息不会出现在视图中。
+    元素为 Message；需要普通字典时使用 to_dicts()。
+    """
+    
+    __slots__ = ('_messages', '_start', '_stop')
+    
+    def __init__(self, messages: List[Message], start: int = 0, stop: Optional[int] = None):
+        self._messages = messages
+        self._stop = len(messages) if stop is None else stop
+        self._start = min(max(start, 0), self._stop)
+    
+    def __len__(self) -> int:
+        return self._stop - self._start
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return HistoryView(self._messages, self._start + start, self._start + max(start, stop))
+            return [self[i] for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self._messages[self._start + index]
+    
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+    
+    def to_dicts(self) -> List[Dict[str, str]]:
+        """转换为消息字典列表"""
+        return [message.to_dict() for message in self]
+    
+    def __repr__(self) -> str:
+        return f"HistoryView({len(self)} messages)"
@@ -7,10 +7,28 @@ FilePath: /ChatMe/chatMe/core/providers.py
 Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查看配置 进行设置: https://github.com/OBKoro1/koro1FileHeader/wiki/%E9%85%8D%E7%BD%AE
 '''
 from abc import ABC, abstractmethod
-from typing import Optional, Dict, Any, Type
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Type, Tuple, List, Iterator, AsyncIterator
+import asyncio
 import importlib
 import logging
+import threading
 from ..exceptions import ConfigError
+from ..utils.ratelimit import TokenBucket
+from ..utils.tokens import estimate_tokens
+
+@dataclass
+class BatchResult:
+    """批量生成中单个请求的结果"""
+    index: int
+    prompt: str
+    response: Optional[str] = None
+    error: Optional[Exception] = None
+    
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 class AIProvider(ABC):
     """AI提供者的抽象基类"""
@@ -22,8 +40,98 @@ class AIProvider(ABC):
         """生成AI回复"""
         pass
     
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        流式生成AI回复
+        
+        默认实现一次性返回完整回复，支持流式输出的提供者应覆盖此方法，
+        在收到增量内容时立即产出。
+        
+        Args:
+            prompt: 用户输入
+            **kwargs: 其他生成参数
+            
+        Yields:
+            str: 回复的增量文本
+        """
+        yield self.generate_response(prompt, **kwargs)
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """
+        异步流式生成AI回复
+        
+        默认实现在后台线程中消费 stream_response，并把增量转发到事件循环。
+        
+        Args:
+            prompt: 用户输入
+            **kwargs: 其他生成参数
+            
+        Yields:
+            str: 回复的增量文本
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        
+        def _produce():
+            try:
+                for delta in self.stream_response(prompt, **kwargs):
+                    loop.call_soon_threadsafe(queue.put_nowait, delta)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        threading.Thread(target=_produce, daemon=True).start()
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    
+    def generate_batch(self,
+                       prompts: List[str],
+                       max_concurrency: int = 8,
+                       requests_per_second: Optional[float] = None,
+                       tokens_per_minute: Optional[float] = None,
+                       **kwargs) -> List[BatchResult]:
+        """
+        并发批量生成AI回复
+        
+        Args:
+            prompts: 输入列表
+            max_concurrency: 最大并发请求数
+            requests_per_second: 每秒请求数上限，None表示不限制
+            tokens_per_minute: 每分钟token数上限（输入估算值加 max_tokens），None表示不限制
+            **kwargs: 其他生成参数
+            
+        Returns:
+            List[BatchResult]: 与输入顺序一致的结果列表，单个请求失败不影响其他请求
+        """
+        request_bucket = TokenBucket(requests_per_second) if requests_per_second else None
+        token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        max_tokens = kwargs.get('max_tokens') or getattr(self, 'kwargs', {}).get('max_tokens', 0)
+        
+        def _run(index: int, prompt: str) -> BatchResult:
+            if request_bucket:
+                request_bucket.acquire()
+            if token_bucket:
+                token_bucket.acquire(estimate_tokens(prompt) + max_tokens)
+            try:
+                return BatchResult(index, prompt, response=self.generate_response(prompt, **kwargs))
+            except Exception as e:
+                logging.warning(f"批量请求 #{index} 失败: {str(e)}")
+                return BatchResult(index, prompt, error=e)
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = [executor.submit(_run, i, prompt) for i, prompt in enumerate(prompts)]
+            return [future.result() for future in futures]
+    
+    @classmethod
     @abstractmethod
-    def validate_config(self, config: Dict[str, Any]) -> bool:
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
         """验证配置是否有效"""
         pass
     
@@ -64,58 +172,286 @@ class AIProvider(ABC):
         except Exception as e:
             raise ConfigError(f"初始化提供者失败: {str(e)}")
 
-class OpenAIProvider(AIProvider):
-    """OpenAI API实现"""
+class AsyncAIProvider(ABC):
+    """原生异步AI提供者接口
     
-    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo", **kwargs):
-        import openai
-        self.api_key = api_key
+    实现此接口的提供者在事件循环内直接发起请求，不占用额外线程，
+    单个事件循环即可同时处理大量会话。
+    """
+    
+    @abstractmethod
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        """异步生成AI回复"""
+        pass
+    
+    @abstractmethod
+    def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """异步流式生成AI回复"""
+        pass
+    
+    async def aclose(self) -> None:
+        """释放异步连接池"""
+        pass
+
+class ProviderWrapper(AIProvider, AsyncAIProvider):
+    """
+    提供者包装器基类
+    
+    将所有调用转发给被包装的提供者，子类只需覆盖需要增强的方法。
+    未定义的属性（如 model、kwargs）同样从被包装的提供者读取。
+    """
+    
+    def __init__(self, provider: AIProvider):
+        self.provider = provider
+    
+    def __getattr__(self, name: str) -> Any:
+        if name == 'provider':
+            raise AttributeError(name)
+        return getattr(self.provider, name)
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        return self.provider.generate_response(prompt, **kwargs)
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        return self.provider.stream_response(prompt, **kwargs)
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        if isinstance(self.provider, AsyncAIProvider):
+            return await self.provider.agenerate_response(prompt, **kwargs)
+        return await asyncio.to_thread(self.provider.generate_response, prompt, **kwargs)
+    
+    def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        return self.provider.astream_response(prompt, **kwargs)
+    
+    async def aclose(self) -> None:
+        if isinstance(self.provider, AsyncAIProvider):
+            await self.provider.aclose()
+    
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
+        return True
+
+def _create_http_clients(max_connections: int,
+                         max_keepalive_connections: int) -> Tuple[Any, Any]:
+    """创建同步/异步共享的HTTP连接池"""
+    import httpx
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections
+    )
+    return httpx.Client(limits=limits), httpx.AsyncClient(limits=limits)
+
+def _without_retries(client: Any) -> Any:
+    """返回关闭了SDK内部重试的客户端（与原客户端共享连接池）"""
+    with_options = getattr(client, 'with_options', None)
+    return client if with_options is None else with_options(max_retries=0)
+
+class ChatCompletionProvider(AIProvider, AsyncAIProvider):
+    """兼容OpenAI Chat Completions接口的提供者基类
+    
+    每个实例持有一个同步客户端和一个异步客户端，各自复用一个HTTP连接池。
+    """
+    
+    # 日志中使用的提供者名称
+    provider_label = "OpenAI"
+    # 限流调度器，设置后从响应头同步限流额度
+    rate_limit_scheduler = None
+    
+    def __init__(self, client: Any, model: str,
+                 async_client: Optional[Any] = None, **kwargs):
+        self.client = client
+        self.async_client = async_client
         self.model = model
-        self.client = openai.OpenAI(api_key=api_key)
         self.kwargs = kwargs
+    
+    def use_rate_limit_scheduler(self, scheduler: Any) -> None:
+        """
+        由限流调度器管理额度和429重试
+        
+        SDK客户端默认会自行退避重试429，调度器看到错误时额度信息已经过时，请求也会
+        被重试两层，因此同时关闭客户端的内部重试，每次调度只发出一次请求。
         
+        Args:
+            scheduler: 限流调度器
+        """
+        self.rate_limit_scheduler = scheduler
+        self.client = _without_retries(self.client)
+        if self.async_client is not None:
+            self.async_client = _without_retries(self.async_client)
+    
+    @property
+    def rate_limit_key(self) -> Tuple[str, str]:
+        """限流调度使用的键: (提供者, 模型)"""
+        return self.provider_label.lower(), self.model
+    
+    def _create_completion(self, **request) -> Any:
+        """发起请求，配置了限流调度器时读取 x-ratelimit-* 响应头"""
+        completions = self.client.chat.completions
+        if self.rate_limit_scheduler is None:
+            return completions.create(**request)
+        raw = completions.with_raw_response.create(**request)
+        self.rate_limit_scheduler.update_from_headers(self.rate_limit_key, raw.headers)
+        return raw.parse()
+    
+    async def _acreate_completion(self, **request) -> Any:
+        """_create_completion 的异步版本"""
+        completions = self._require_async_client().chat.completions
+        if self.rate_limit_scheduler is None:
+            return await completions.create(**request)
+        raw = await completions.with_raw_response.create(**request)
+        self.rate_limit_scheduler.update_from_headers(self.rate_limit_key, raw.headers)
+        return raw.parse()
+    
+    def _prepare_request(self, prompt: str, kwargs: Dict[str, Any]) -> Tuple[list, Dict[str, Any]]:
+        """
+        构建请求消息列表和请求参数
+        
+        kwargs 中的 system_prompt 和 history 用于构建消息列表，其余参数原样发送。
+        """
+        params = {**self.kwargs, **kwargs}
+        system_prompt = params.pop('system_prompt', None)
+        history = params.pop('history', None) or []
+        
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.extend({"role": m["role"], "content": m["content"]} for m in history)
+        messages.append({"role": "user", "content": prompt})
+        return messages, params
+    
     def generate_response(self, prompt: str, **kwargs) -> str:
+        messages, params = self._prepare_request(prompt, kwargs)
         try:
-            response = self.client.chat.completions.create(
+            response = self._create_completion(
                 model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                **{**self.kwargs, **kwargs}
+                messages=messages,
+                **params
             )
             return response.choices[0].message.content
         except Exception as e:
-            logging.error(f"OpenAI API调用失败: {str(e)}")
+            logging.error(f"{self.provider_label} API调用失败: {str(e)}")
             raise
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        messages, params = self._prepare_request(prompt, kwargs)
+        try:
+            stream = self._create_completion(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                **params
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            logging.error(f"{self.provider_label} 流式API调用失败: {str(e)}")
+            raise
+
+    def _require_async_client(self) -> Any:
+        if self.async_client is None:
+            raise ConfigError(f"{self.provider_label} 提供者未配置异步客户端")
+        return self.async_client
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        messages, params = self._prepare_request(prompt, kwargs)
+        try:
+            response = await self._acreate_completion(
+                model=self.model,
+                messages=messages,
+                **params
+            )
+            return response.choices[0].message.content
+        except Exception as e:
+            logging.error(f"{self.provider_label} 异步API调用失败: {str(e)}")
+            raise
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        if self.async_client is None:
+            async for delta in super().astream_response(prompt, **kwargs):
+                yield delta
+            return
         
-    def validate_config(self, config: Dict[str, Any]) -> bool:
+        messages, params = self._prepare_request(prompt, kwargs)
+        try:
+            stream = await self._acreate_completion(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                **params
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            logging.error(f"{self.provider_label} 异步流式API调用失败: {str(e)}")
+            raise
+    
+    async def aclose(self) -> None:
+        if self.async_client is not None:
+            await self.async_client.close()
+
+class OpenAIProvider(ChatCompletionProvider):
+    """OpenAI API实现"""
+    
+    def __init__(self, api_key: str, model: str = "gpt-3.5-turbo",
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20, **kwargs):
+        import openai
+        self.api_key = api_key
+        http_client, async_http_client = _create_http_clients(
+            max_connections, max_keepalive_connections
+        )
+        super().__init__(
+            openai.OpenAI(api_key=api_key, http_client=http_client),
+            model,
+            async_client=openai.AsyncOpenAI(
+                api_key=api_key,
+                http_client=async_http_client
+            ),
+            **kwargs
+        )
+    
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
         settings = config.get('settings', {})
         return all(k in settings for k in ['api_key', 'model'])
 
-class AzureProvider(AIProvider):
+class AzureProvider(ChatCompletionProvider):
     """Azure OpenAI实现"""
     
-    def __init__(self, api_key: str, endpoint: str, deployment_name: str, **kwargs):
+    provider_label = "Azure"
+    
+    def __init__(self, api_key: str, endpoint: str, deployment_name: str,
+                 max_connections: int = 100,
+                 max_keepalive_connections: int = 20, **kwargs):
         import openai
-        self.client = openai.AzureOpenAI(
+        http_client, async_http_client = _create_http_clients(
+            max_connections, max_keepalive_connections
+        )
+        client = openai.AzureOpenAI(
+            api_key=api_key,
+            azure_endpoint=endpoint,
+            api_version="2023-05-15",
+            http_client=http_client
+        )
+        async_client = openai.AsyncAzureOpenAI(
             api_key=api_key,
             azure_endpoint=endpoint,
-            api_version="2023-05-15"
+            api_version="2023-05-15",
+            http_client=async_http_client
         )
         self.deployment_name = deployment_name
-        self.kwargs = kwargs
-        
-    def generate_response(self, prompt: str, **kwargs) -> str:
-        try:
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[{"role": "user", "content": prompt}],
-                **{**self.kwargs, **kwargs}
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            logging.error(f"Azure API调用失败: {str(e)}")
-            raise
-            
-    def validate_config(self, config: Dict[str, Any]) -> bool:
+        super().__init__(client, deployment_name, async_client=async_client, **kwargs)
+    
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
         settings = config.get('settings', {})
         return all(k in settings for k in ['api_key', 'endpoint', 'deployment_name'])
 
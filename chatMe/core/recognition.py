@@ -10,40 +10,101 @@ Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查
 语音识别模块
 """
 
-import speech_recognition as sr
 import numpy as np
-from typing import Optional, Dict, Any
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Iterator
 import logging
 from ..exceptions import RecognitionError, AudioDeviceError
 from ..config import Config
+from ..utils.vad import (
+    EnergyVAD, NoiseFloorEstimator, PlaybackGate, UtteranceSegmenter, Utterance, VADEventType,
+    MicrophoneFrameSource
+)
+from ..utils.audio import CaptureStream
+from .recognition_backends import RecognitionBackend
+
+@dataclass
+class RecognitionResult:
+    """流式识别的一条结果，final 为False时是说话过程中的部分结果"""
+    text: Optional[str]
+    final: bool
+    utterance: Optional[Utterance] = None
 
 class SpeechRecognizer:
-    def __init__(self, config: Optional[Dict[str, Any]] = None):
+    """
+    语音识别器
+    
+    录音由语音活动检测逐帧完成：尾部静音达到 VAD_END_SILENCE_MS 即结束录音并开始
+    识别。frame_source 可以传入 WavFrameSource 等帧来源代替麦克风。
+    
+    录音流在第一次监听时打开并保持到 close()，每次监听从上一句结束的位置继续读取，
+    两次监听之间录到的音频不会丢失。能量阈值由 NoiseFloorEstimator 在录音线程中
+    持续更新，监听前不再单独校准环境噪音。
+    
+    与语音合成共用扬声器时，把 stream.set_playback 注册为 TTSWorker 的监听器：
+    朗读期间只有足以打断朗读的音量才判为说话，朗读结束后从结束处继续监听，
+    不会把录到的朗读声当作用户的话。
+    
+    识别由 backend 完成，默认按 RECOGNITION_BACKEND 配置创建并在初始化时预加载。
+    listen_stream() 在说话过程中就把音频逐帧送入后端，边说边产出部分结果。
+    """
+    
+    def __init__(self, config: Optional[Dict[str, Any]] = None, frame_source=None,
+                 backend: Optional[RecognitionBackend] = None):
         self.config = config or Config()
-        self.recognizer = sr.Recognizer()
         self.logger = logging.getLogger(__name__)
         
-        # 配置识别器参数
-        self.recognizer.energy_threshold = self.config.ENERGY_THRESHOLD
-        self.recognizer.dynamic_energy_threshold = True
-        self.recognizer.pause_threshold = 0.8
+        self.backend = backend or RecognitionBackend.from_config(self.config.RECOGNITION_BACKEND)
+        self.backend.load()
+        self.vad = EnergyVAD(self.config.ENERGY_THRESHOLD)
+        self.noise = NoiseFloorEstimator(self.vad)
         
-        self._setup_microphone()
-    
-    def _setup_microphone(self):
-        """初始化麦克风"""
-        try:
-            self.microphone = sr.Microphone()
-            with self.microphone as source:
-                self.recognizer.adjust_for_ambient_noise(source)
-        except Exception as e:
-            raise AudioDeviceError(f"麦克风初始化失败: {str(e)}")
+        self.frame_source = frame_source
+        self.stream = CaptureStream(
+            frame_source or MicrophoneFrameSource(self.config.SAMPLE_RATE, self.config.VAD_FRAME_MS)
+        )
+        self.stream.add_listener(self.noise.update)
+        self.gate = PlaybackGate(self.vad, lambda: self.stream.playback, self.config.BARGE_IN_RATIO)
     
     def _check_volume(self, audio_data: np.ndarray) -> bool:
         """检查音量是否足够"""
-        rms = np.sqrt(np.mean(np.square(audio_data)))
+        rms = np.sqrt(np.mean(np.square(audio_data, dtype=np.float64)))
         return rms > self.config.MINIMUM_VOLUME
     
+    def capture(self) -> Optional[Utterance]:
+        """
+        录下一句话
+        
+        Returns:
+            Optional[Utterance]: 录到的语音，LISTEN_TIMEOUT 内没有开始说话时返回None
+        """
+        for event in self._events():
+            if event.type is VADEventType.END:
+                return event.utterance
+        return None
+    
+    def _events(self):
+        """从上一句结束的位置开始录音，逐帧产出分句事件"""
+        self.stream.start()
+        segmenter = UtteranceSegmenter(
+            self.gate,
+            self.stream.sample_rate,
+            self.stream.frame_samples,
+            end_silence_ms=self.config.VAD_END_SILENCE_MS,
+            max_utterance_ms=self.config.PHRASE_TIMEOUT * 1000,
+            keep_audio=False
+        )
+        return self.stream.events(
+            segmenter,
+            start=max(self.stream.cursor, self.stream.ring.oldest, self.stream.playback_end),
+            timeout=self.config.LISTEN_TIMEOUT
+        )
+    
+    def close(self):
+        """关闭录音流并释放识别后端"""
+        self.stream.stop()
+        self.backend.close()
+    
     def listen(self) -> Optional[str]:
         """
         监听并识别语音
@@ -55,49 +116,84 @@ class SpeechRecognizer:
             RecognitionError: 识别过程出错
             AudioDeviceError: 音频设备错误
         """
+        for result in self.listen_stream():
+            if result.final:
+                return result.text
+        return None
+    
+    def listen_stream(self) -> Iterator[RecognitionResult]:
+        """
+        流式监听并识别语音
+        
+        开始说话时即创建后端的识别会话，预录音和之后的每一帧录到就送入后端；
+        支持流式的后端在说话过程中产出部分结果，说完后最终结果几乎不需要等待。
+        
+        Yields:
+            RecognitionResult: 若干部分结果，最后是一条最终结果；超时没有开始说话时
+            不产出结果，音量太小或无法识别时最终结果的 text 为None
+        
+        Raises:
+            RecognitionError: 识别过程出错
+            AudioDeviceError: 音频设备错误
+        """
+        session = None
         try:
-            with self.microphone as source:
-                self.logger.info("正在监听...")
-                audio = self.recognizer.listen(
-                    source,
-                    timeout=self.config.LISTEN_TIMEOUT,
-                    phrase_time_limit=self.config.PHRASE_TIMEOUT
-                )
-                
-                # 检查音量
-                if not self._check_volume(np.frombuffer(audio.frame_data, np.int16)):
-                    self.logger.warning("音量太小")
-                    return None
-                
-                self.logger.info("正在识别...")
-                text = self.recognizer.recognize_google(
-                    audio,
-                    language=self.config.SPEECH_LANGUAGE,
-                    show_all=False
-                )
-                
-                self.logger.info(f"识别结果: {text}")
-                return text
-                
-        except sr.WaitTimeoutError:
+            self.logger.info("正在监听...")
+            for event in self._events():
+                if event.type is VADEventType.START:
+                    session = self.backend.start_stream(self.stream.sample_rate, self.config.SPEECH_LANGUAGE)
+                    partial = session.accept(event.audio)
+                elif event.type is VADEventType.SPEECH:
+                    partial = session.accept(event.audio)
+                else:
+                    yield RecognitionResult(self._finish(session, event.utterance), True, event.utterance)
+                    return
+                if partial:
+                    yield RecognitionResult(partial, False)
             self.logger.warning("监听超时")
+            
+        except (RecognitionError, AudioDeviceError):
+            raise
+        except Exception as e:
+            raise RecognitionError(f"识别过程出错: {str(e)}")
+        finally:
+            # 调用方提前停止迭代、音量太小或出错时同样释放识别会话
+            if session is not None:
+                session.close()
+    
+    def _finish(self, session, utterance: Utterance) -> Optional[str]:
+        """结束识别会话，返回最终结果"""
+        # 检查音量
+        if not self._check_volume(utterance.audio):
+            self.logger.warning("音量太小")
             return None
-        except sr.UnknownValueError:
+        
+        self.logger.info("正在识别...")
+        text = session.finish(utterance.audio)
+        if text is None:
             self.logger.warning("无法识别语音")
             return None
-        except sr.RequestError as e:
-            raise RecognitionError(f"语音识别服务错误: {str(e)}")
-        except Exception as e:
-            raise RecognitionError(f"识别过程出错: {str(e)}")
+        
+        self.logger.info(f"识别结果: {text}")
+        return text
     
-    def adjust_for_ambient_noise(self):
-        """调整环境噪音"""
-        try:
-            with self.microphone as source:
-                self.logger.info("正在调整环境噪音...")
-                self.recognizer.adjust_for_ambient_noise(
-                    source,
-                    duration=self.config.AMBIENT_DURATION
-                )
-        except Exception as e:
-            raise AudioDeviceError(f"环境噪音调整失败: {str(e)}")
\ No newline at end of file
+    def adjust_for_ambient_noise(self) -> Optional[float]:
+        """
+        用录音流中最近 AMBIENT_DURATION 秒的音频立即重设噪音基底
+        
+        阈值平时由后台估计持续更新，只有环境突然变化时才需要调用；不会等待录音。
+        
+        Returns:
+            Optional[float]: 新的能量阈值
+        
+        Raises:
+            AudioDeviceError: 打开录音设备失败
+        """
+        self.stream.start()
+        return self.noise.seed(self.stream.recent_frames(self.config.AMBIENT_DURATION))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取录音统计，包括当前噪音基底和输入电平"""
+        stats = self.noise.get_stats()
+        stats['level'] = self.stream.level
+        return stats
\ No newline at end of file
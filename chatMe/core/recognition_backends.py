@@ -0,0 +1,337 @@
+"""
+语音识别后端模块
+
+SpeechRecognizer 只负责录音和分句，识别交给可替换的后端：Google 在线识别、
+本地 Vosk 模型，以及用于测试的确定性后端。后端按配置创建，与 AI 提供者一样
+通过注册表查找，也可以用 module_path/class_name 加载自定义实现。
+模型较大的本地后端在启动时调用 load() 预加载，第一次识别不再等待加载。
+
+流式识别通过 start_stream() 为每句话创建一个 RecognitionStream，录音过程中
+逐块送入音频并取得部分识别结果。不支持流式的后端使用默认实现：不产出部分结果，
+结束时整句识别。
+"""
+
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, Type, List
+import importlib
+import json
+import logging
+import threading
+import numpy as np
+import speech_recognition as sr
+from ..exceptions import ConfigError, RecognitionError
+
+class RecognitionStream:
+    """
+    一句话的流式识别会话
+    
+    默认实现不产出部分结果，finish() 时对整句调用 backend.recognize。
+    无论是否调用过 finish()，调用方都应在用完后调用 close() 释放会话占用的资源。
+    
+    Args:
+        backend: 识别后端
+        sample_rate: 采样率
+        language: 识别语言
+    """
+    
+    def __init__(self, backend: 'RecognitionBackend', sample_rate: int, language: str):
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.language = language
+        self.closed = False
+    
+    def accept(self, chunk: np.ndarray) -> Optional[str]:
+        """
+        送入一段音频
+        
+        Args:
+            chunk: 单声道 int16 采样，调用返回后可能被覆盖，需要保留时自行复制
+        
+        Returns:
+            Optional[str]: 部分识别结果有变化时返回新的结果，否则返回None
+        """
+        return None
+    
+    def finish(self, audio: np.ndarray) -> Optional[str]:
+        """
+        结束这句话并返回最终结果
+        
+        Args:
+            audio: 整句音频；逐块识别的后端可以忽略
+        
+        Returns:
+            Optional[str]: 识别的文本，没有识别出内容时返回None
+        
+        Raises:
+            RecognitionError: 识别服务或模型出错
+        """
+        return self.backend.recognize(audio, self.sample_rate, self.language)
+    
+    def close(self) -> None:
+        """释放会话资源，可重复调用"""
+        self.closed = True
+
+class RecognitionBackend(ABC):
+    """语音识别后端的抽象基类"""
+    
+    def load(self) -> None:
+        """预加载模型等资源，默认无操作"""
+        pass
+    
+    @abstractmethod
+    def recognize(self, audio: np.ndarray, sample_rate: int, language: str) -> Optional[str]:
+        """
+        识别一句话
+        
+        Args:
+            audio: 单声道 int16 采样
+            sample_rate: 采样率
+            language: 识别语言，如 zh-CN
+        
+        Returns:
+            Optional[str]: 识别的文本，没有识别出内容时返回None
+        
+        Raises:
+            RecognitionError: 识别服务或模型出错
+        """
+        pass
+    
+    def start_stream(self, sample_rate: int, language: str) -> RecognitionStream:
+        """
+        开始一句话的流式识别
+        
+        Args:
+            sample_rate: 采样率
+            language: 识别语言
+        
+        Returns:
+            RecognitionStream: 流式识别会话
+        """
+        return RecognitionStream(self, sample_rate, language)
+    
+    def close(self) -> None:
+        """释放资源"""
+        pass
+    
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
+        """验证配置是否有效"""
+        return True
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'RecognitionBackend':
+        """从配置创建识别后端"""
+        backend_type = config.get('type', '').lower()
+        if not backend_type:
+            raise ConfigError("未指定语音识别后端类型")
+        
+        backend_class = RECOGNITION_BACKEND_REGISTRY.get(backend_type)
+        if not backend_class:
+            # 尝试动态导入自定义后端
+            try:
+                module_path = config.get('module_path', '')
+                class_name = config.get('class_name', '')
+                if not (module_path and class_name):
+                    raise ConfigError(f"未知的语音识别后端: {backend_type}")
+                
+                module = importlib.import_module(module_path)
+                backend_class = getattr(module, class_name)
+                
+                if not issubclass(backend_class, RecognitionBackend):
+                    raise ConfigError(f"识别后端类 {class_name} 必须继承 RecognitionBackend")
+            
+            except Exception as e:
+                raise ConfigError(f"加载语音识别后端失败: {str(e)}")
+        
+        if not backend_class.validate_config(config):
+            raise ConfigError(f"语音识别后端 {backend_type} 配置无效")
+        
+        try:
+            return backend_class(**config.get('settings', {}))
+        except Exception as e:
+            raise ConfigError(f"初始化语音识别后端失败: {str(e)}")
+
+class GoogleBackend(RecognitionBackend):
+    """
+    Google 在线语音识别
+    
+    Args:
+        key: API密钥，None表示使用 speech_recognition 内置的密钥
+    """
+    
+    def __init__(self, key: Optional[str] = None):
+        self.key = key
+        self.recognizer = sr.Recognizer()
+    
+    def recognize(self, audio: np.ndarray, sample_rate: int, language: str) -> Optional[str]:
+        data = sr.AudioData(np.ascontiguousarray(audio, dtype=np.int16).tobytes(), sample_rate, 2)
+        try:
+            return self.recognizer.recognize_google(data, key=self.key, language=language)
+        except sr.UnknownValueError:
+            return None
+        except sr.RequestError as e:
+            raise RecognitionError(f"语音识别服务错误: {str(e)}")
+
+class VoskBackend(RecognitionBackend):
+    """
+    本地 Vosk 模型识别，不需要网络
+    
+    需要安装 vosk 并下载对应语言的模型。中文模型输出的词之间带空格，
+    识别语言为中文时会去掉空格。支持流式识别，说话过程中即完成大部分解码，
+    说完后几乎不需要再等待。
+    
+    Args:
+        model_path: 模型目录
+    """
+    
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self.logger = logging.getLogger(__name__)
+        self._model = None
+        self._lock = threading.Lock()
+    
+    def load(self) -> None:
+        with self._lock:
+            if self._model is not None:
+                return
+            try:
+                import vosk
+            except ImportError:
+                raise ConfigError("使用本地语音识别需要安装 vosk")
+            try:
+                vosk.SetLogLevel(-1)
+                self.logger.info(f"正在加载语音识别模型: {self.model_path}")
+                self._model = vosk.Model(self.model_path)
+            except Exception as e:
+                raise RecognitionError(f"加载语音识别模型失败: {str(e)}")
+    
+    def recognize(self, audio: np.ndarray, sample_rate: int, language: str) -> Optional[str]:
+        self.load()
+        import vosk
+        try:
+            recognizer = vosk.KaldiRecognizer(self._model, sample_rate)
+            recognizer.AcceptWaveform(np.ascontiguousarray(audio, dtype=np.int16).tobytes())
+            text = json.loads(recognizer.FinalResult()).get('text', '')
+        except Exception as e:
+            raise RecognitionError(f"本地语音识别出错: {str(e)}")
+        return self._clean(text, language)
+    
+    def start_stream(self, sample_rate: int, language: str) -> RecognitionStream:
+        self.load()
+        return VoskStream(self, sample_rate, language)
+    
+    @staticmethod
+    def _clean(text: str, language: str) -> Optional[str]:
+        if language.lower().startswith('zh'):
+            text = text.replace(' ', '')
+        return text.strip() or None
+    
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
+        return 'model_path' in config.get('settings', {})
+
+class VoskStream(RecognitionStream):
+    """Vosk 流式识别会话，逐块解码"""
+    
+    def __init__(self, backend: VoskBackend, sample_rate: int, language: str):
+        super().__init__(backend, sample_rate, language)
+        import vosk
+        try:
+            self._recognizer = vosk.KaldiRecognizer(backend._model, sample_rate)
+        except Exception as e:
+            raise RecognitionError(f"创建本地识别会话失败: {str(e)}")
+        # Vosk 在句中停顿处给出的已确定片段
+        self._segments: List[str] = []
+        self._partial = ""
+    
+    def accept(self, chunk: np.ndarray) -> Optional[str]:
+        try:
+            if self._recognizer.AcceptWaveform(np.ascontiguousarray(chunk, dtype=np.int16).tobytes()):
+                self._segments.append(json.loads(self._recognizer.Result()).get('text', ''))
+                current = ''
+            else:
+                current = json.loads(self._recognizer.PartialResult()).get('partial', '')
+        except Exception as e:
+            raise RecognitionError(f"本地语音识别出错: {str(e)}")
+        partial = VoskBackend._clean(' '.join(self._segments + [current]), self.language) or ""
+        if partial == self._partial:
+            return None
+        self._partial = partial
+        return partial or None
+    
+    def finish(self, audio: np.ndarray) -> Optional[str]:
+        try:
+            self._segments.append(json.loads(self._recognizer.FinalResult()).get('text', ''))
+        except Exception as e:
+            raise RecognitionError(f"本地语音识别出错: {str(e)}")
+        return VoskBackend._clean(' '.join(self._segments), self.language)
+    
+    def close(self) -> None:
+        # KaldiRecognizer 持有解码器状态，会话结束后不再保留
+        self._recognizer = None
+        super().close()
+
+class ScriptedBackend(RecognitionBackend):
+    """
+    按预设脚本返回结果的确定性后端，用于测试和离线演示
+    
+    依次返回 responses 中的文本，用完后返回 default。每次调用的音频时长记录在
+    calls 中。流式识别时每送入 chunks_per_char 块音频，部分结果多出一个字。
+    
+    Args:
+        responses: 依次返回的识别结果，None表示没有识别出内容
+        default: 脚本用完后返回的结果
+        chunks_per_char: 流式识别时部分结果每个字对应的音频块数
+    """
+    
+    def __init__(self, responses: Optional[List[Optional[str]]] = None, default: Optional[str] = None,
+                 chunks_per_char: int = 5):
+        self.responses = list(responses or [])
+        self.default = default
+        self.chunks_per_char = chunks_per_char
+        self.calls: List[float] = []
+        self.streams: List['ScriptedStream'] = []
+        self._lock = threading.Lock()
+    
+    def _next(self) -> Optional[str]:
+        with self._lock:
+            if self.responses:
+                return self.responses.pop(0)
+            return self.default
+    
+    def recognize(self, audio: np.ndarray, sample_rate: int, language: str) -> Optional[str]:
+        self.calls.append(len(audio) / sample_rate)
+        return self._next()
+    
+    def start_stream(self, sample_rate: int, language: str) -> RecognitionStream:
+        stream = ScriptedStream(self, sample_rate, language)
+        self.streams.append(stream)
+        return stream
+
+class ScriptedStream(RecognitionStream):
+    """ScriptedBackend 的流式会话，按送入的块数逐字给出部分结果"""
+    
+    def __init__(self, backend: ScriptedBackend, sample_rate: int, language: str):
+        super().__init__(backend, sample_rate, language)
+        self.text = backend._next()
+        self._chunks = 0
+        self._chars = 0
+    
+    def accept(self, chunk: np.ndarray) -> Optional[str]:
+        self._chunks += 1
+        chars = min(self._chunks // self.backend.chunks_per_char, len(self.text or ""))
+        if chars == self._chars:
+            return None
+        self._chars = chars
+        return self.text[:chars]
+    
+    def finish(self, audio: np.ndarray) -> Optional[str]:
+        self.backend.calls.append(len(audio) / self.sample_rate)
+        return self.text
+
+# 注册内置识别后端
+RECOGNITION_BACKEND_REGISTRY: Dict[str, Type[RecognitionBackend]] = {
+    'google': GoogleBackend,
+    'vosk': VoskBackend,
+    'scripted': ScriptedBackend
+}
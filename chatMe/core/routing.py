@@ -0,0 +1,542 @@
+"""
+多提供者路由模块
+
+把请求分发到多个后端提供者，支持加权轮询、最少在途请求和EWMA延迟三种策略，
+用熔断器隔离故障后端，并在失败时换到健康的后端重试；HedgedProvider 在请求
+超过近期延迟分位数时发出备份请求以削减长尾延迟。
+"""
+
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from typing import Optional, Dict, Any, List, Type, Iterator, AsyncIterator
+import asyncio
+import logging
+import threading
+import time
+from .providers import AIProvider, AsyncAIProvider, ProviderWrapper, PROVIDER_REGISTRY
+from ..exceptions import APIError, ConfigError
+
+class CircuitBreaker:
+    """
+    熔断器
+    
+    连续失败 failure_threshold 次后打开，打开期间不再向该后端发送请求；
+    recovery_timeout 秒后进入半开状态，放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = 3, recovery_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def allow_request(self) -> bool:
+        """是否允许发送请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+    
+    def is_available(self) -> bool:
+        """是否可以被选中（不占用半开状态的探测名额）"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.recovery_timeout
+            return not self._probing
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+    
+    def release(self):
+        """请求被放弃、没有结果时归还半开状态的探测名额"""
+        with self._lock:
+            self._probing = False
+
+class Backend:
+    """路由后端及其运行时统计"""
+    
+    def __init__(self, name: str, provider: AIProvider, weight: float = 1.0,
+                 breaker: Optional[CircuitBreaker] = None, ewma_alpha: float = 0.3):
+        self.name = name
+        self.provider = provider
+        self.weight = weight
+        self.breaker = breaker or CircuitBreaker()
+        self.ewma_alpha = ewma_alpha
+        self.ewma_latency: Optional[float] = None
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        # 平滑加权轮询的当前权重
+        self.current_weight = 0.0
+        self._lock = threading.Lock()
+    
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+            self.requests += 1
+    
+    def end(self, latency: Optional[float], success: Optional[bool]):
+        """结束一次请求，success 为None表示请求被调用方放弃（如取消），不计成败"""
+        with self._lock:
+            self.outstanding -= 1
+            if success and latency is not None:
+                if self.ewma_latency is None:
+                    self.ewma_latency = latency
+                else:
+                    self.ewma_latency += self.ewma_alpha * (latency - self.ewma_latency)
+            if success is False:
+                self.failures += 1
+        if success:
+            self.breaker.record_success()
+        elif success is False:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'weight': self.weight,
+            'state': self.breaker.state,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'ewma_latency': self.ewma_latency
+        }
+
+class RoutingStrategy(ABC):
+    """后端选择策略"""
+    
+    @abstractmethod
+    def select(self, backends: List[Backend]) -> Backend:
+        """从可用后端中选择一个"""
+        pass
+
+class WeightedRoundRobinStrategy(RoutingStrategy):
+    """平滑加权轮询"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+    
+    def select(self, backends: List[Backend]) -> Backend:
+        with self._lock:
+            total = sum(b.weight for b in backends)
+            for backend in backends:
+                backend.current_weight += backend.weight
+            chosen = max(backends, key=lambda b: b.current_weight)
+            chosen.current_weight -= total
+            return chosen
+
+class LeastOutstandingStrategy(RoutingStrategy):
+    """选择在途请求数（按权重折算）最少的后端"""
+    
+    def select(self, backends: List[Backend]) -> Backend:
+        return min(backends, key=lambda b: (b.outstanding + 1) / b.weight)
+
+class EWMALatencyStrategy(RoutingStrategy):
+    """
+    选择预期延迟最低的后端
+    
+    预期延迟 = EWMA延迟 × (在途请求数 + 1)，尚无延迟数据的后端优先被探测。
+    """
+    
+    def select(self, backends: List[Backend]) -> Backend:
+        unmeasured = [b for b in backends if b.ewma_latency is None]
+        if unmeasured:
+            return min(unmeasured, key=lambda b: b.outstanding)
+        return min(backends, key=lambda b: b.ewma_latency * (b.outstanding + 1) / b.weight)
+
+ROUTING_STRATEGIES: Dict[str, Type[RoutingStrategy]] = {
+    'round_robin': WeightedRoundRobinStrategy,
+    'least_outstanding': LeastOutstandingStrategy,
+    'ewma': EWMALatencyStrategy
+}
+
+class RouterProvider(AIProvider, AsyncAIProvider):
+    """
+    多提供者路由
+    
+    Args:
+        backends: 后端描述列表，每项包含 type、settings，可选 name、weight
+        strategy: 选择策略，见 ROUTING_STRATEGIES
+        failure_threshold: 熔断前允许的连续失败次数
+        recovery_timeout: 熔断后进入半开状态的等待时间（秒）
+        max_attempts: 单个请求最多尝试的后端数，默认尝试所有后端
+    """
+    
+    def __init__(self,
+                 backends: List[Dict[str, Any]],
+                 strategy: str = 'round_robin',
+                 failure_threshold: int = 3,
+                 recovery_timeout: float = 30,
+                 max_attempts: Optional[int] = None,
+                 ewma_alpha: float = 0.3):
+        strategy_class = ROUTING_STRATEGIES.get(strategy)
+        if strategy_class is None:
+            raise ConfigError(f"未知的路由策略: {strategy}")
+        self.strategy = strategy_class()
+        self.logger = logging.getLogger(__name__)
+        self.backends: List[Backend] = []
+        for i, spec in enumerate(backends):
+            if isinstance(spec, Backend):
+                self.backends.append(spec)
+                continue
+            provider = AIProvider.from_config(spec)
+            self.backends.append(Backend(
+                name=spec.get('name') or f"{spec.get('type', 'backend')}#{i}",
+                provider=provider,
+                weight=float(spec.get('weight', 1.0)),
+                breaker=CircuitBreaker(failure_threshold, recovery_timeout),
+                ewma_alpha=ewma_alpha
+            ))
+        if not self.backends:
+            raise ConfigError("路由至少需要一个后端")
+        self.max_attempts = max_attempts or len(self.backends)
+    
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
+        settings = config.get('settings', {})
+        return bool(settings.get('backends'))
+    
+    def _choose(self, tried: List[Backend]) -> Optional[Backend]:
+        """选择一个未尝试过的健康后端，全部熔断时退回到未尝试的任意后端"""
+        candidates = [b for b in self.backends if b not in tried]
+        if not candidates:
+            return None
+        healthy = [b for b in candidates if b.breaker.is_available()]
+        while healthy:
+            backend = self.strategy.select(healthy)
+            if backend.breaker.allow_request():
+                return backend
+            healthy.remove(backend)
+        # 所有后端都已熔断，仍然尝试一个，避免请求直接失败
+        return self.strategy.select(candidates)
+    
+    def _attempts(self) -> Iterator[Backend]:
+        tried: List[Backend] = []
+        while len(tried) < self.max_attempts:
+            backend = self._choose(tried)
+            if backend is None:
+                return
+            tried.append(backend)
+            yield backend
+    
+    def _failed(self, backend: Backend, error: Exception):
+        self.logger.warning(f"后端 {backend.name} 调用失败，尝试其他后端: {str(error)}")
+    
+    # 每次尝试都在 finally 中调用 backend.end()：成功、出错、调用方提前关闭流
+    # 或取消时都会归还在途计数和熔断器的探测名额。success 保持None表示请求被放弃。
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        last_error: Optional[Exception] = None
+        for backend in self._attempts():
+            backend.begin()
+            start = time.monotonic()
+            success = None
+            try:
+                response = backend.provider.generate_response(prompt, **kwargs)
+                success = True
+            except Exception as e:
+                success = False
+                self._failed(backend, e)
+                last_error = e
+            finally:
+                backend.end(time.monotonic() - start, success)
+            if success:
+                return response
+        raise APIError(f"所有后端均调用失败: {str(last_error)}")
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        last_error: Optional[Exception] = None
+        for backend in self._attempts():
+            backend.begin()
+            start = time.monotonic()
+            latency = None
+            success = None
+            try:
+                for delta in backend.provider.stream_response(prompt, **kwargs):
+                    if latency is None:
+                        # 以首个增量的到达时间作为延迟样本
+                        latency = time.monotonic() - start
+                    yield delta
+                success = True
+            except Exception as e:
+                success = False
+                if latency is not None:
+                    # 已经输出了部分内容，无法透明地切换后端
+                    raise
+                self._failed(backend, e)
+                last_error = e
+            finally:
+                if success is None and latency is not None:
+                    # 调用方读到内容后提前关闭，后端本身是正常的
+                    success = True
+                backend.end(time.monotonic() - start if latency is None else latency, success)
+            if success:
+                return
+        raise APIError(f"所有后端均调用失败: {str(last_error)}")
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        last_error: Optional[Exception] = None
+        for backend in self._attempts():
+            backend.begin()
+            start = time.monotonic()
+            success = None
+            try:
+                if isinstance(backend.provider, AsyncAIProvider):
+                    response = await backend.provider.agenerate_response(prompt, **kwargs)
+                else:
+                    response = await ProviderWrapper(backend.provider).agenerate_response(prompt, **kwargs)
+                success = True
+            except Exception as e:
+                success = False
+                self._failed(backend, e)
+                last_error = e
+            finally:
+                backend.end(time.monotonic() - start, success)
+            if success:
+                return response
+        raise APIError(f"所有后端均调用失败: {str(last_error)}")
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        last_error: Optional[Exception] = None
+        for backend in self._attempts():
+            backend.begin()
+            start = time.monotonic()
+            latency = None
+            success = None
+            try:
+                async for delta in backend.provider.astream_response(prompt, **kwargs):
+                    if latency is None:
+                        latency = time.monotonic() - start
+                    yield delta
+                success = True
+            except Exception as e:
+                success = False
+                if latency is not None:
+                    raise
+                self._failed(backend, e)
+                last_error = e
+            finally:
+                if success is None and latency is not None:
+                    success = True
+                backend.end(time.monotonic() - start if latency is None else latency, success)
+            if success:
+                return
+        raise APIError(f"所有后端均调用失败: {str(last_error)}")
+    
+    async def aclose(self) -> None:
+        for backend in self.backends:
+            if isinstance(backend.provider, AsyncAIProvider):
+                await backend.provider.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各后端的路由统计"""
+        return {backend.name: backend.get_stats() for backend in self.backends}
+
+class HedgedProvider(ProviderWrapper):
+    """
+    对冲请求提供者
+    
+    请求耗时超过近期延迟的 percentile 分位数仍未返回时，向备份提供者（默认为
+    同一提供者）再发一次相同请求，采用先完成的结果并取消另一个。同步调用无法
+    中断已在执行的HTTP请求，落败请求只会被丢弃；异步调用会取消落败的任务。
+    
+    延迟样本是主请求从自身发出起的耗时，与哪个请求胜出无关：同步调用中落败的
+    主请求完成时照常记录；异步调用中被取消的主请求记录取消时已等待的时长
+    （真实延迟的下界）。只记录胜出者的延迟会让慢请求从样本中消失，分位数偏低，
+    对冲越来越频繁。
+    
+    Args:
+        provider: 主提供者
+        backup: 备份提供者，为None时使用主提供者
+        percentile: 触发对冲的延迟分位数
+        min_samples: 开始对冲前需要的最少延迟样本数
+        window: 保留的最近延迟样本数
+        max_hedge_ratio: 对冲请求占总请求数的上限，用于控制额外开销
+        max_concurrency: 预期的最大同步并发调用数，每个调用最多同时占用主请求和
+            对冲请求两个线程，线程池按其两倍创建，避免请求在池中排队
+    """
+    
+    def __init__(self,
+                 provider: AIProvider,
+                 backup: Optional[AIProvider] = None,
+                 percentile: float = 95,
+                 min_samples: int = 20,
+                 window: int = 500,
+                 max_hedge_ratio: float = 0.1,
+                 max_concurrency: int = 16):
+        super().__init__(provider)
+        self.backup = backup or provider
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.logger = logging.getLogger(__name__)
+        self._latencies = deque(maxlen=window)
+        self._executor = ThreadPoolExecutor(max_workers=2 * max(1, max_concurrency), thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        
+        self.requests = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self.cancelled_requests = 0
+    
+    def hedge_delay(self) -> Optional[float]:
+        """
+        当前的对冲等待时间
+        
+        Returns:
+            float: 近期延迟的分位数，样本不足时返回None（不对冲）
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            samples = sorted(self._latencies)
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index]
+    
+    def _start(self) -> Optional[float]:
+        delay = self.hedge_delay()
+        with self._lock:
+            self.requests += 1
+        return delay
+    
+    def _take_budget(self) -> bool:
+        """在对冲预算内时占用一次对冲名额"""
+        with self._lock:
+            if self.hedged_requests + 1 > self.max_hedge_ratio * self.requests:
+                return False
+            self.hedged_requests += 1
+            return True
+    
+    def _record_latency(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+    
+    def _record_primary(self, start: float, future: Future):
+        """主请求成功完成时记录其延迟，包括已被对冲请求抢先的"""
+        if not future.cancelled() and future.exception() is None:
+            self._record_latency(time.monotonic() - start)
+    
+    def _observe(self, backup_won: bool, cancelled: int = 0):
+        with self._lock:
+            if backup_won:
+                self.hedge_wins += 1
+            self.cancelled_requests += cancelled
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        delay = self._start()
+        start = time.monotonic()
+        if delay is None:
+            response = self.provider.generate_response(prompt, **kwargs)
+            self._record_latency(time.monotonic() - start)
+            return response
+        
+        primary = self._executor.submit(self.provider.generate_response, prompt, **kwargs)
+        primary.add_done_callback(partial(self._record_primary, start))
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_budget():
+            return primary.result()
+        
+        self.logger.debug(f"请求超过 {delay:.3f}s 未返回，发送对冲请求")
+        backup = self._executor.submit(self.backup.generate_response, prompt, **kwargs)
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 已在执行的请求无法取消，只统计真正取消成功的
+                    cancelled = sum(1 for loser in pending if loser.cancel())
+                    self._observe(future is backup, cancelled)
+                    return future.result()
+                error = future.exception()
+        raise error
+    
+    async def _acall(self, provider: AIProvider, prompt: str, kwargs: Dict[str, Any]) -> str:
+        if isinstance(provider, AsyncAIProvider):
+            return await provider.agenerate_response(prompt, **kwargs)
+        return await asyncio.to_thread(provider.generate_response, prompt, **kwargs)
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        delay = self._start()
+        start = time.monotonic()
+        primary = asyncio.ensure_future(self._acall(self.provider, prompt, kwargs))
+        pending = {primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+            if delay is None or done or not self._take_budget():
+                response = await primary
+                self._record_latency(time.monotonic() - start)
+                return response
+            
+            self.logger.debug(f"请求超过 {delay:.3f}s 未返回，发送对冲请求")
+            backup = asyncio.ensure_future(self._acall(self.backup, prompt, kwargs))
+            pending.add(backup)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        # 主请求胜出时记录其延迟；落败时它至少已等待到现在
+                        if task is primary or primary in pending:
+                            self._record_latency(time.monotonic() - start)
+                        cancelled = sum(1 for loser in pending if loser.cancel())
+                        pending = set()
+                        self._observe(task is backup, cancelled)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 取消落败或被调用方放弃的请求
+            for task in pending:
+                task.cancel()
+    
+    async def aclose(self) -> None:
+        await super().aclose()
+        if self.backup is not self.provider and isinstance(self.backup, AsyncAIProvider):
+            await self.backup.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取对冲统计，hedge_rate 即额外请求占总请求的比例"""
+        delay = self.hedge_delay()
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hedged_requests': self.hedged_requests,
+                'hedge_rate': self.hedged_requests / self.requests if self.requests else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'cancelled_requests': self.cancelled_requests,
+                'hedge_delay': delay
+            }
+
+# 注册路由提供者
+PROVIDER_REGISTRY['router'] = RouterProvider
@@ -0,0 +1,131 @@
+"""
+限流调度提供者模块
+"""
+
+from typing import Optional, Dict, Any, Iterator, AsyncIterator, Mapping
+import logging
+from .providers import AIProvider, ProviderWrapper, ChatCompletionProvider
+from ..utils.ratelimit import RateLimitScheduler, get_default_scheduler
+from ..utils.tokens import estimate_tokens
+
+def _is_rate_limited(error: Exception) -> bool:
+    """是否为429限流错误"""
+    return getattr(error, 'status_code', None) == 429
+
+def _error_headers(error: Exception) -> Optional[Mapping[str, str]]:
+    return getattr(getattr(error, 'response', None), 'headers', None)
+
+class RateLimitedProvider(ProviderWrapper):
+    """
+    经限流调度器排队的提供者
+    
+    每次调用前向调度器申请一次请求和预计token数的额度，收到429时通知调度器退避
+    并重新排队。调用时可传入 priority 参数（数值越小越优先），该参数不会发送给API。
+    
+    Args:
+        provider: 被包装的提供者
+        scheduler: 限流调度器，默认使用进程内共享的调度器
+        priority: 默认优先级
+        max_retries: 429后的最大重试次数
+    """
+    
+    def __init__(self,
+                 provider: AIProvider,
+                 scheduler: Optional[RateLimitScheduler] = None,
+                 priority: int = 0,
+                 max_retries: int = 3):
+        super().__init__(provider)
+        self.scheduler = scheduler or get_default_scheduler()
+        self.priority = priority
+        self.max_retries = max_retries
+        self.logger = logging.getLogger(__name__)
+        
+        inner = provider
+        while isinstance(inner, ProviderWrapper):
+            inner = inner.provider
+        if isinstance(inner, ChatCompletionProvider):
+            inner.use_rate_limit_scheduler(self.scheduler)
+            self.key = inner.rate_limit_key
+        else:
+            self.key = (type(inner).__name__.lower(), str(getattr(inner, 'model', '') or ''))
+    
+    def _estimate(self, prompt: str, kwargs: Dict[str, Any]) -> int:
+        """估算请求消耗的token数：输入（含系统提示词和历史）加上 max_tokens"""
+        params = {**getattr(self.provider, 'kwargs', {}), **kwargs}
+        tokens = estimate_tokens(prompt) + estimate_tokens(params.get('system_prompt') or '')
+        for message in params.get('history') or []:
+            tokens += estimate_tokens(message.get('content', ''))
+        return tokens + int(params.get('max_tokens') or 0)
+    
+    def _backoff(self, error: Exception, attempt: int) -> bool:
+        """处理调用错误，需要重试时返回True"""
+        if not _is_rate_limited(error) or attempt >= self.max_retries:
+            return False
+        delay = self.scheduler.record_rate_limited(self.key, _error_headers(error))
+        self.logger.warning(f"{self.key[0]}/{self.key[1]} 触发限流，{delay:.2f}s 后重试")
+        return True
+    
+    def generate_response(self, prompt: str, **kwargs) -> str:
+        priority = kwargs.pop('priority', self.priority)
+        tokens = self._estimate(prompt, kwargs)
+        attempt = 0
+        while True:
+            self.scheduler.acquire(self.key, tokens, priority)
+            try:
+                return self.provider.generate_response(prompt, **kwargs)
+            except Exception as e:
+                if not self._backoff(e, attempt):
+                    raise
+            attempt += 1
+    
+    def stream_response(self, prompt: str, **kwargs) -> Iterator[str]:
+        priority = kwargs.pop('priority', self.priority)
+        tokens = self._estimate(prompt, kwargs)
+        attempt = 0
+        while True:
+            self.scheduler.acquire(self.key, tokens, priority)
+            started = False
+            try:
+                for delta in self.provider.stream_response(prompt, **kwargs):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                # 已输出部分内容时不能重试
+                if started or not self._backoff(e, attempt):
+                    raise
+            attempt += 1
+    
+    async def agenerate_response(self, prompt: str, **kwargs) -> str:
+        priority = kwargs.pop('priority', self.priority)
+        tokens = self._estimate(prompt, kwargs)
+        attempt = 0
+        while True:
+            await self.scheduler.aacquire(self.key, tokens, priority)
+            try:
+                return await super().agenerate_response(prompt, **kwargs)
+            except Exception as e:
+                if not self._backoff(e, attempt):
+                    raise
+            attempt += 1
+    
+    async def astream_response(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        priority = kwargs.pop('priority', self.priority)
+        tokens = self._estimate(prompt, kwargs)
+        attempt = 0
+        while True:
+            await self.scheduler.aacquire(self.key, tokens, priority)
+            started = False
+            try:
+                async for delta in self.provider.astream_response(prompt, **kwargs):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                if started or not self._backoff(e, attempt):
+                    raise
+            attempt += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流调度统计"""
+        return self.scheduler.get_stats()
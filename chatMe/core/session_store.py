@@ -0,0 +1,438 @@
+"""
+会话存储模块
+
+DialogueManager 的持久化后端。内存后端用于单进程和测试，SQLite后端（WAL模式）
+使会话在进程重启后可以恢复，并可在同一台机器上的多个工作进程之间共享。
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, Callable, Collection, Iterator
+import json
+import logging
+import sqlite3
+import threading
+import time
+from ..exceptions import DialogueError
+
+@dataclass
+class SessionRecord:
+    """存储中的会话数据"""
+    session_id: str
+    user_id: str
+    start_time: float
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    metadata: Optional[Dict[str, Any]] = None
+    summary: Optional[str] = None
+    summarized_upto: int = 0
+    updated_at: float = 0.0
+
+class SessionStore(ABC):
+    """
+    会话存储接口
+    
+    Args:
+        ttl: 会话空闲多少秒后被清除，None表示不清除
+    """
+    
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        # 返回正在内存中使用的会话ID，后台清除时跳过这些会话；由 DialogueManager 设置
+        self.held_sessions: Callable[[], Collection[str]] = tuple
+    
+    @abstractmethod
+    def create_session(self, record: SessionRecord) -> None:
+        """保存新会话"""
+        pass
+    
+    @abstractmethod
+    def append_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        """追加消息（实现可以批量延迟写入）"""
+        pass
+    
+    @abstractmethod
+    def load_session(self, session_id: str) -> Optional[SessionRecord]:
+        """加载完整会话，不存在时返回None"""
+        pass
+    
+    @abstractmethod
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """获取会话最近的 limit 条消息，limit 为None时返回全部"""
+        pass
+    
+    @abstractmethod
+    def save_summary(self, session_id: str, summary: str, summarized_upto: int) -> None:
+        """保存会话摘要"""
+        pass
+    
+    @abstractmethod
+    def delete_session(self, session_id: str) -> None:
+        """删除会话"""
+        pass
+    
+    @abstractmethod
+    def list_sessions(self, user_id: str) -> List[str]:
+        """按创建时间从早到晚列出用户的会话ID"""
+        pass
+    
+    @abstractmethod
+    def evict_expired(self, keep: Collection[str] = ()) -> int:
+        """
+        清除空闲超过 ttl 的会话
+        
+        Args:
+            keep: 不清除的会话ID，如仍在内存中使用的会话
+        
+        Returns:
+            int: 清除的会话数
+        """
+        pass
+    
+    def flush(self) -> None:
+        """把缓冲的写入落盘"""
+        pass
+    
+    def close(self) -> None:
+        """关闭存储"""
+        self.flush()
+
+class MemorySessionStore(SessionStore):
+    """进程内的会话存储"""
+    
+    def __init__(self, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self._sessions: Dict[str, SessionRecord] = {}
+        self._lock = threading.Lock()
+    
+    def create_session(self, record: SessionRecord) -> None:
+        with self._lock:
+            record.updated_at = time.time()
+            self._sessions[record.session_id] = record
+    
+    def append_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                raise DialogueError(f"会话不存在: {session_id}")
+            # 消息对象不可变，直接共享引用
+            record.messages.extend(messages)
+            record.updated_at = time.time()
+    
+    def load_session(self, session_id: str) -> Optional[SessionRecord]:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return None
+            return SessionRecord(
+                session_id=record.session_id,
+                user_id=record.user_id,
+                start_time=record.start_time,
+                messages=list(record.messages),
+                metadata=record.metadata,
+                summary=record.summary,
+                summarized_upto=record.summarized_upto,
+                updated_at=record.updated_at
+            )
+    
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                return []
+            return record.messages[-limit:] if limit else list(record.messages)
+    
+    def save_summary(self, session_id: str, summary: str, summarized_upto: int) -> None:
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record.summary = summary
+                record.summarized_upto = summarized_upto
+    
+    def delete_session(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+    
+    def list_sessions(self, user_id: str) -> List[str]:
+        with self._lock:
+            # dict 保持插入顺序，即创建顺序
+            return [sid for sid, r in self._sessions.items() if r.user_id == user_id]
+    
+    def evict_expired(self, keep: Collection[str] = ()) -> int:
+        if self.ttl is None:
+            return 0
+        deadline = time.time() - self.ttl
+        with self._lock:
+            expired = [sid for sid, r in self._sessions.items() if r.updated_at < deadline and sid not in keep]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return len(expired)
+
+class SQLiteSessionStore(SessionStore):
+    """
+    基于SQLite的会话存储
+    
+    数据库使用WAL模式，读写互不阻塞，多个进程可以同时打开同一个数据库文件。
+    消息以 (session_id, seq) 为主键存储，恢复会话和读取最近N条消息都是一次索引
+    范围查询。追加的消息先进入内存缓冲，缓冲达到 batch_size 或每隔
+    flush_interval 秒由后台线程在一个事务中批量写入；读取前会先写入缓冲。
+    序号在写事务内按数据库中的最大序号分配，多个进程向同一会话追加消息时不会
+    互相覆盖。
+    
+    Args:
+        path: 数据库文件路径
+        ttl: 会话空闲多少秒后被清除，None表示不清除
+        batch_size: 触发立即写入的缓冲消息数
+        flush_interval: 后台写入间隔（秒），为0时不启动后台线程
+        busy_timeout: 等待其他连接释放数据库锁的最长时间（秒）
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            start_time REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            metadata TEXT,
+            summary TEXT,
+            summarized_upto INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at);
+        CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id, start_time);
+        CREATE TABLE IF NOT EXISTS messages (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT,
+            PRIMARY KEY (session_id, seq)
+        ) WITHOUT ROWID;
+    """
+    
+    def __init__(self,
+                 path: str = str(Path.home() / ".chatme" / "sessions.db"),
+                 ttl: Optional[float] = None,
+                 batch_size: int = 64,
+                 flush_interval: float = 1.0,
+                 busy_timeout: float = 5.0):
+        super().__init__(ttl)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger(__name__)
+        
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+            self._conn.executescript(self.SCHEMA)
+        except sqlite3.Error as e:
+            raise DialogueError(f"打开会话数据库失败: {str(e)}")
+        
+        self._lock = threading.RLock()
+        # 待写入的消息: (session_id, role, content, timestamp)，序号在写入时分配
+        self._pending: List[Tuple[str, str, str, Optional[str]]] = []
+        self._touched: Dict[str, float] = {}
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-flusher", daemon=True)
+            self._flusher.start()
+    
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+                # 在持有存储锁之前取得使用中的会话，避免与 DialogueManager 的锁交叉
+                self.evict_expired(self.held_sessions())
+            except Exception as e:
+                self.logger.warning(f"会话写入失败: {str(e)}")
+    
+    @contextmanager
+    def _transaction(self, action: str) -> Iterator[None]:
+        """
+        写事务，调用方需持有 self._lock
+        
+        BEGIN IMMEDIATE 本身也可能失败（如其他进程持有写锁超时），只有事务已经开始时
+        才回滚，保证连接不会停留在事务中。
+        
+        Args:
+            action: 出错时错误信息中的操作描述
+        
+        Raises:
+            DialogueError: 数据库操作失败
+        """
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            yield
+            self._conn.execute("COMMIT")
+        except BaseException as e:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            if isinstance(e, sqlite3.Error):
+                raise DialogueError(f"{action}失败: {str(e)}")
+            raise
+    
+    def _assign_sequences(self, pending: List[Tuple[str, str, str, Optional[str]]]
+                          ) -> List[Tuple[str, int, str, str, Optional[str]]]:
+        """为待写入的消息分配序号（调用方需处于写事务中）"""
+        next_seq: Dict[str, int] = {}
+        rows = []
+        for session_id, role, content, timestamp in pending:
+            seq = next_seq.get(session_id)
+            if seq is None:
+                seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE session_id = ?",
+                    (session_id,)
+                ).fetchone()[0]
+            rows.append((session_id, seq, role, content, timestamp))
+            next_seq[session_id] = seq + 1
+        return rows
+    
+    def create_session(self, record: SessionRecord) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(session_id, user_id, start_time, updated_at, metadata, summary, summarized_upto) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record.session_id, record.user_id, record.start_time, now,
+                 json.dumps(record.metadata, ensure_ascii=False) if record.metadata else None,
+                 record.summary, record.summarized_upto)
+            )
+        if record.messages:
+            self.append_messages(record.session_id, record.messages)
+    
+    def append_messages(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        with self._lock:
+            for message in messages:
+                self._pending.append((
+                    session_id, message["role"], message["content"], message.get("timestamp")
+                ))
+            self._touched[session_id] = time.time()
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+    
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending and not self._touched:
+                return
+            pending, self._pending = self._pending, []
+            touched, self._touched = self._touched, {}
+            committed = False
+            try:
+                # BEGIN IMMEDIATE 取得数据库写锁，事务内读到的最大序号不会被其他进程改变
+                with self._transaction("写入会话"):
+                    self._conn.executemany(
+                        "INSERT INTO messages (session_id, seq, role, content, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        self._assign_sequences(pending)
+                    )
+                    self._conn.executemany(
+                        "UPDATE sessions SET updated_at = ? WHERE session_id = ?",
+                        [(t, sid) for sid, t in touched.items()]
+                    )
+                committed = True
+            finally:
+                if not committed:
+                    # 无论事务在哪一步失败，都保留未写入的数据，等待下次重试
+                    self._pending = pending + self._pending
+                    touched.update(self._touched)
+                    self._touched = touched
+    
+    def load_session(self, session_id: str) -> Optional[SessionRecord]:
+        with self._lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT s.user_id, s.start_time, s.updated_at, s.metadata, s.summary, s.summarized_upto, "
+                "m.role, m.content, m.timestamp "
+                "FROM sessions s LEFT JOIN messages m ON m.session_id = s.session_id "
+                "WHERE s.session_id = ? ORDER BY m.seq",
+                (session_id,)
+            ).fetchall()
+        if not rows:
+            return None
+        user_id, start_time, updated_at, metadata, summary, summarized_upto = rows[0][:6]
+        return SessionRecord(
+            session_id=session_id,
+            user_id=user_id,
+            start_time=start_time,
+            messages=[
+                {"role": role, "content": content, "timestamp": timestamp}
+                for *_, role, content, timestamp in rows if role is not None
+            ],
+            metadata=json.loads(metadata) if metadata else None,
+            summary=summary,
+            summarized_upto=summarized_upto,
+            updated_at=updated_at
+        )
+    
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        with self._lock:
+            self.flush()
+            if limit:
+                rows = self._conn.execute(
+                    "SELECT role, content, timestamp FROM messages WHERE session_id = ? "
+                    "ORDER BY seq DESC LIMIT ?",
+                    (session_id, limit)
+                ).fetchall()
+                rows.reverse()
+            else:
+                rows = self._conn.execute(
+                    "SELECT role, content, timestamp FROM messages WHERE session_id = ? ORDER BY seq",
+                    (session_id,)
+                ).fetchall()
+        return [{"role": role, "content": content, "timestamp": ts} for role, content, ts in rows]
+    
+    def save_summary(self, session_id: str, summary: str, summarized_upto: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE sessions SET summary = ?, summarized_upto = ? WHERE session_id = ?",
+                (summary, summarized_upto, session_id)
+            )
+    
+    def delete_session(self, session_id: str) -> None:
+        with self._lock:
+            with self._transaction("删除会话"):
+                self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            # 删除成功后再丢弃缓冲，删除失败时缓冲的消息仍会写入
+            self._pending = [p for p in self._pending if p[0] != session_id]
+            self._touched.pop(session_id, None)
+    
+    def list_sessions(self, user_id: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id FROM sessions WHERE user_id = ? ORDER BY start_time, rowid",
+                (user_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def evict_expired(self, keep: Collection[str] = ()) -> int:
+        if self.ttl is None:
+            return 0
+        deadline = time.time() - self.ttl
+        with self._lock:
+            self.flush()
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT session_id FROM sessions WHERE updated_at < ?", (deadline,)
+            ) if row[0] not in keep]
+            if not expired:
+                return 0
+            with self._transaction("清除过期会话"):
+                self._conn.executemany("DELETE FROM messages WHERE session_id = ?", [(s,) for s in expired])
+                self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", [(s,) for s in expired])
+        self.logger.info(f"清除 {len(expired)} 个过期会话")
+        return len(expired)
+    
+    def close(self) -> None:
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            self.flush()
+            self._conn.close()
@@ -0,0 +1,120 @@
+"""
+对话摘要模块
+
+在后台线程中把较早的对话轮次压缩为滚动摘要，使每轮请求的上下文大小
+不随会话长度增长。
+"""
+
+from typing import Optional, Set, TYPE_CHECKING
+import logging
+import queue
+import threading
+from .providers import AIProvider
+
+if TYPE_CHECKING:
+    from .dialogue import DialogueManager
+
+class DialogueSummarizer:
+    """
+    后台对话摘要器
+    
+    会话中未摘要的较早消息（最近 keep_recent 条之外）累计超过 trigger_tokens 时，
+    由工作线程调用提供者把它们与已有摘要合并为新的摘要。摘要不在请求路径上生成，
+    生成期间请求照常使用旧摘要和完整的近期消息。
+    
+    Args:
+        provider: 用于生成摘要的AI提供者
+        keep_recent: 始终保留原文的最近消息数
+        trigger_tokens: 触发摘要的未摘要消息token数
+        max_summary_chars: 摘要的建议最大字数
+    """
+    
+    SUMMARY_PROMPT = (
+        "请把下面的对话压缩为一段简洁的摘要，保留用户的关键信息、偏好、已做出的决定"
+        "和尚未完成的事项，不超过{max_chars}字。只输出摘要内容。"
+    )
+    ROLE_NAMES = {"user": "用户", "assistant": "助手", "system": "系统"}
+    
+    def __init__(self,
+                 provider: AIProvider,
+                 keep_recent: int = 6,
+                 trigger_tokens: int = 1000,
+                 max_summary_chars: int = 300):
+        self.provider = provider
+        self.keep_recent = keep_recent
+        self.trigger_tokens = trigger_tokens
+        self.max_summary_chars = max_summary_chars
+        self.logger = logging.getLogger(__name__)
+        
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        
+        self.summaries = 0
+        self.failures = 0
+    
+    def submit(self, manager: "DialogueManager", session_id: str):
+        """提交会话摘要任务，同一会话已在队列中时忽略"""
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="dialogue-summarizer", daemon=True)
+                self._worker.start()
+        self._queue.put((manager, session_id))
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                manager, session_id = item
+                with self._lock:
+                    self._pending.discard(session_id)
+                self.summarize(manager, session_id)
+            except Exception as e:
+                self.failures += 1
+                self.logger.warning(f"生成对话摘要失败: {str(e)}")
+            finally:
+                self._queue.task_done()
+    
+    def summarize(self, manager: "DialogueManager", session_id: str) -> bool:
+        """
+        把会话中较早的消息合并进摘要
+        
+        Returns:
+            bool: 是否更新了摘要
+        """
+        summary, start, end, messages = manager.get_summary_window(session_id, self.keep_recent)
+        if not messages:
+            return False
+        
+        transcript = "\n".join(
+            f"{self.ROLE_NAMES.get(m['role'], m['role'])}: {m['content']}" for m in messages
+        )
+        prompt = f"已有摘要：{summary}\n\n新的对话：\n{transcript}" if summary else transcript
+        new_summary = self.provider.generate_response(
+            prompt,
+            system_prompt=self.SUMMARY_PROMPT.format(max_chars=self.max_summary_chars)
+        )
+        if not new_summary:
+            return False
+        
+        updated = manager.set_summary(session_id, new_summary.strip(), start, end)
+        if updated:
+            self.summaries += 1
+            self.logger.debug(f"会话 {session_id} 的前 {end} 条消息已合并为摘要")
+        return updated
+    
+    def join(self):
+        """等待队列中的摘要任务全部完成"""
+        self._queue.join()
+    
+    def close(self):
+        """停止工作线程"""
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
@@ -11,25 +11,355 @@ Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查
 """
 
 import pyttsx3
-from typing import Optional, Dict, Any
+from concurrent.futures import Future, CancelledError
+from functools import partial
+from typing import Optional, Dict, Any, Callable, Iterable, List, Tuple
+import heapq
+import itertools
 import logging
+import threading
 from ..exceptions import SynthesisError
 from ..config import Config
+from ..utils.text import SentenceSplitter
+from ..utils.audio import AudioProcessor
+from ..utils.audio_cache import AudioCache
+
+class TTSWorker:
+    """
+    语音合成工作线程
+    
+    pyttsx3 的 runAndWait() 会阻塞调用线程，而且引擎只应在创建它的线程中使用。
+    工作线程创建并独占引擎，按优先级朗读队列中的文本（数值越小越优先，同优先级
+    先进先出）。调用方只负责入队，朗读期间主循环可以继续录音。
+    
+    配置了 audio_cache 时，已缓存的文本直接播放缓存的WAV文件，不再经引擎合成。
+    
+    listener 在每句开始朗读时以 True、朗读结束时以 False 在工作线程中调用，
+    录音端据此区分用户的声音和扬声器的声音。
+    
+    Args:
+        engine_factory: 创建并配置语音引擎的函数，在工作线程中调用
+        audio_cache: 合成语音缓存
+        player: 播放WAV文件的函数 player(filename, stop_event)，默认使用 AudioProcessor
+        
+    Raises:
+        SynthesisError: 语音引擎初始化失败
+    """
+    
+    # 提示音（如“声音太小”）优先于排队中的回复
+    PRIORITY_SYSTEM = 0
+    PRIORITY_REPLY = 10
+    # 预热缓存等后台任务不应推迟任何朗读
+    PRIORITY_BACKGROUND = 100
+    
+    def __init__(self,
+                 engine_factory: Callable[[], Any] = pyttsx3.init,
+                 audio_cache: Optional[AudioCache] = None,
+                 player: Optional[Callable[[str, threading.Event], Any]] = None):
+        self.engine_factory = engine_factory
+        self.engine = None
+        self.audio_cache = audio_cache
+        self.player = player
+        self.logger = logging.getLogger(__name__)
+        
+        # (priority, seq, task, future)
+        self._heap: List[Tuple[int, int, Callable[[Any], Any], Future]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._current: Optional[Future] = None
+        self._closed = False
+        # 打断正在播放的缓存语音；引擎朗读由引擎线程内的回调停止
+        self._interrupted = threading.Event()
+        self._listeners: List[Callable[[bool], None]] = []
+        self.playing = False
+        
+        self._ready = threading.Event()
+        self._init_error: Optional[Exception] = None
+        self._thread = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._init_error is not None:
+            raise SynthesisError(f"语音引擎初始化失败: {str(self._init_error)}")
+    
+    def _run(self):
+        try:
+            self.engine = self.engine_factory()
+            # pyttsx3 的 stop() 只能在引擎自己的线程中调用，每读一个词检查一次打断
+            if hasattr(self.engine, 'connect'):
+                self.engine.connect('started-word', self._on_word)
+        except Exception as e:
+            self._init_error = e
+            return
+        finally:
+            self._ready.set()
+        
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                _, _, task, future = heapq.heappop(self._heap)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._current = future
+                self._interrupted.clear()
+            try:
+                future.set_result(task(self.engine))
+            except Exception as e:
+                self.logger.error(f"语音合成失败: {str(e)}")
+                future.set_exception(SynthesisError(f"语音合成失败: {str(e)}"))
+            finally:
+                with self._cond:
+                    self._current = None
+                    self._cond.notify_all()
+    
+    def _on_word(self, *args):
+        if self._interrupted.is_set():
+            self.engine.stop()
+    
+    def add_listener(self, listener: Callable[[bool], None]):
+        """添加朗读状态回调，参数为是否正在朗读"""
+        self._listeners.append(listener)
+    
+    def _set_playing(self, playing: bool):
+        self.playing = playing
+        for listener in list(self._listeners):
+            try:
+                listener(playing)
+            except Exception as e:
+                self.logger.error(f"朗读状态监听器出错: {str(e)}")
+    
+    def _cache_key(self, engine: Any, text: str) -> str:
+        return AudioCache.make_key(
+            text,
+            engine.getProperty('voice'),
+            engine.getProperty('rate'),
+            engine.getProperty('volume')
+        )
+    
+    def _render(self, engine: Any, key: str, text: str):
+        """用引擎把文本合成到缓存"""
+        def render(filename):
+            engine.save_to_file(text, filename)
+            engine.runAndWait()
+        return self.audio_cache.put(key, render)
+    
+    def _play(self, filename: str) -> bool:
+        """播放缓存的语音，失败时返回False"""
+        try:
+            if self.player is None:
+                self.player = AudioProcessor().play_wav
+            self.player(filename, self._interrupted)
+            return True
+        except Exception as e:
+            self.logger.warning(f"播放缓存语音失败: {str(e)}")
+            return False
+    
+    def _say(self, text: str, cache: bool, engine: Any):
+        path = None
+        if self.audio_cache is not None:
+            key = self._cache_key(engine, text)
+            path = self.audio_cache.get(key)
+            if path is None and cache:
+                path = self._render(engine, key, text)
+        self._set_playing(True)
+        try:
+            if path is not None and self._play(str(path)):
+                return
+            engine.say(text)
+            engine.runAndWait()
+        finally:
+            self._set_playing(False)
+    
+    def _prewarm(self, text: str, engine: Any):
+        key = self._cache_key(engine, text)
+        if key not in self.audio_cache:
+            self._render(engine, key, text)
+    
+    def call(self, task: Callable[[Any], Any], priority: int = PRIORITY_REPLY) -> Future:
+        """
+        在工作线程中用引擎执行任务
+        
+        Args:
+            task: 接收引擎作为参数的函数
+            priority: 优先级，数值越小越优先
+            
+        Returns:
+            Future: 任务结果
+            
+        Raises:
+            SynthesisError: 工作线程已关闭
+        """
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise SynthesisError("语音合成线程已关闭")
+            heapq.heappush(self._heap, (priority, next(self._seq), task, future))
+            self._cond.notify_all()
+        return future
+    
+    def enqueue(self, text: str, priority: int = PRIORITY_REPLY, cache: bool = False) -> Future:
+        """
+        把文本加入朗读队列，立即返回
+        
+        Args:
+            text: 要朗读的文本
+            priority: 优先级，数值越小越优先
+            cache: 未缓存时是否先合成到缓存再播放，适用于会重复朗读的固定文本
+            
+        Returns:
+            Future: 朗读完成时结束
+        """
+        return self.call(partial(self._say, text, cache), priority)
+    
+    def prewarm(self, phrases: Iterable[str]) -> List[Future]:
+        """
+        在后台把固定文本合成到缓存，之后朗读时直接播放
+        
+        Args:
+            phrases: 要预热的文本
+            
+        Returns:
+            List[Future]: 各条文本的合成任务，未配置缓存时为空
+        """
+        if self.audio_cache is None:
+            return []
+        return [self.call(partial(self._prewarm, text), self.PRIORITY_BACKGROUND) for text in phrases]
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待队列中的任务全部完成
+        
+        Args:
+            timeout: 最长等待时间（秒），None表示一直等待
+            
+        Returns:
+            bool: 队列是否已清空
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._heap and self._current is None, timeout)
+    
+    def interrupt(self) -> int:
+        """
+        打断当前朗读并丢弃队列中的任务
+        
+        只设置打断标记：缓存语音的播放器和引擎的逐词回调都在工作线程中检查该标记，
+        不从调用线程操作引擎。
+        
+        Returns:
+            int: 丢弃的任务数
+        """
+        with self._cond:
+            dropped, self._heap = self._heap, []
+            busy = self._current is not None
+            if busy:
+                self._interrupted.set()
+        for *_, future in dropped:
+            future.cancel()
+        return len(dropped)
+    
+    def close(self):
+        """朗读完队列中的任务后停止工作线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+class SpeechPipeline:
+    """
+    流水线语音合成
+    
+    把回复按句切分后送入 TTSWorker：第一句完整后立即开始朗读，后续句子在朗读
+    期间继续生成和排队。用户等待的时间从“生成全文加合成全文”缩短为“生成第一句”。
+    
+    Args:
+        worker: 语音合成工作线程
+        priority: 句子的朗读优先级
+        min_chars: 句子的最少字符数
+        max_chars: 没有句末标点时的最大句长
+    """
+    
+    def __init__(self,
+                 worker: TTSWorker,
+                 priority: int = TTSWorker.PRIORITY_REPLY,
+                 min_chars: int = 2,
+                 max_chars: int = 80):
+        self.worker = worker
+        self.priority = priority
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+    
+    def say(self, text: str):
+        """把一句文本加入朗读队列，立即返回"""
+        if text:
+            self.worker.enqueue(text, self.priority)
+    
+    def speak(self, text: str, wait: bool = True):
+        """
+        分句朗读完整文本
+        
+        Args:
+            text: 要朗读的文本
+            wait: 是否等待朗读结束
+        """
+        for sentence in SentenceSplitter.split(text, min_chars=self.min_chars, max_chars=self.max_chars):
+            self.say(sentence)
+        if wait:
+            self.wait()
+    
+    def speak_stream(self, deltas: Iterable[str], wait: bool = True) -> str:
+        """
+        边生成边朗读流式文本
+        
+        Args:
+            deltas: 文本增量，例如提供者 stream_response 的输出
+            wait: 是否等待朗读结束
+            
+        Returns:
+            str: 完整文本
+        """
+        splitter = SentenceSplitter(self.min_chars, self.max_chars)
+        parts = []
+        for delta in deltas:
+            parts.append(delta)
+            for sentence in splitter.feed(delta):
+                self.say(sentence)
+        rest = splitter.flush()
+        if rest:
+            self.say(rest)
+        if wait:
+            self.wait()
+        return "".join(parts)
+    
+    def wait(self):
+        """等待已排队的句子全部朗读完"""
+        self.worker.flush()
 
 class SpeechSynthesizer:
-    def __init__(self, config: Optional[Dict[str, Any]] = None):
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 audio_cache: Optional[AudioCache] = None):
         self.config = config or Config()
         self.logger = logging.getLogger(__name__)
+        self.audio_cache = audio_cache
         self._init_engine()
+        self.pipeline = SpeechPipeline(self.worker)
     
     def _init_engine(self):
-        """初始化语音引擎"""
+        """启动语音合成线程，引擎在该线程中创建"""
         try:
-            self.engine = pyttsx3.init()
-            self._configure_engine()
+            self.worker = TTSWorker(self._create_engine, self.audio_cache)
+        except SynthesisError:
+            raise
         except Exception as e:
             raise SynthesisError(f"语音引擎初始化失败: {str(e)}")
     
+    def _create_engine(self):
+        """创建并配置语音引擎（在合成线程中调用）"""
+        self.engine = pyttsx3.init()
+        self._configure_engine()
+        return self.engine
+    
     def _configure_engine(self):
         """配置语音引擎参数"""
         self.engine.setProperty('rate', self.config.SPEECH_RATE)
@@ -42,12 +372,16 @@ class SpeechSynthesizer:
                 self.engine.setProperty('voice', voice.id)
                 break
     
-    def speak(self, text: str):
+    def speak(self, text: str, priority: int = TTSWorker.PRIORITY_REPLY, wait: bool = True,
+              cache: bool = False):
         """
         将文本转换为语音
         
         Args:
             text: 要转换的文本
+            priority: 朗读优先级，提示音使用 TTSWorker.PRIORITY_SYSTEM 以插到排队的回复之前
+            wait: 是否等待朗读结束；为False时立即返回，朗读在合成线程中进行
+            cache: 是否缓存合成结果，适用于会重复朗读的固定文本
             
         Raises:
             SynthesisError: 语音合成失败
@@ -55,12 +389,31 @@ class SpeechSynthesizer:
         if not text:
             return
             
-        try:
-            self.logger.info(f"正在合成语音: {text}")
-            self.engine.say(text)
-            self.engine.runAndWait()
-        except Exception as e:
-            raise SynthesisError(f"语音合成失败: {str(e)}")
+        self.logger.info(f"正在合成语音: {text}")
+        future = self.worker.enqueue(text, priority, cache)
+        if wait:
+            try:
+                future.result()
+            except CancelledError:
+                # 排队期间被 stop() 丢弃
+                pass
+    
+    def prewarm(self, phrases: Iterable[str]) -> List[Future]:
+        """在后台把固定文本合成到缓存"""
+        return self.worker.prewarm(phrases)
+    
+    def speak_stream(self, deltas: Iterable[str], wait: bool = True) -> str:
+        """
+        边生成边朗读流式文本，第一句完整后即开始播放
+        
+        Args:
+            deltas: 文本增量
+            wait: 是否等待朗读结束
+            
+        Returns:
+            str: 完整文本
+        """
+        return self.pipeline.speak_stream(deltas, wait)
     
     def save_to_file(self, text: str, filename: str):
         """
@@ -73,16 +426,23 @@ class SpeechSynthesizer:
         Raises:
             SynthesisError: 保存失败
         """
+        def render(engine):
+            engine.save_to_file(text, filename)
+            engine.runAndWait()
+        
         try:
             self.logger.info(f"正在保存语音到文件: {filename}")
-            self.engine.save_to_file(text, filename)
-            self.engine.runAndWait()
+            self.worker.call(render).result()
         except Exception as e:
             raise SynthesisError(f"语音保存失败: {str(e)}")
     
     def stop(self):
-        """停止当前语音输出"""
+        """停止当前语音输出，并丢弃排队中的语音"""
         try:
-            self.engine.stop()
+            self.worker.interrupt()
         except Exception as e:
-            self.logger.error(f"停止语音失败: {str(e)}")
\ No newline at end of file
+            self.logger.error(f"停止语音失败: {str(e)}")
+    
+    def close(self):
+        """朗读完排队中的语音后停止合成线程"""
+        self.worker.close()
\ No newline at end of file
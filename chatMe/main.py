@@ -1,23 +1,39 @@
-from speech_recognition import Recognizer, Microphone
+from speech_recognition import Microphone
 import pyttsx3
 import openai
 import requests
 import numpy as np
-from functools import lru_cache
 from pathlib import Path
 import time
+import asyncio
 import logging
 import os
 import sys
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable, Iterator
 import psutil
 
 from .config import Config, AIConfig
 from .utils import filter_sensitive_info
 from .utils.monitoring import performance_monitor
-import speech_recognition as sr
 from .models.assistant import AssistantState
-from .core.providers import AIProvider
+from .core.providers import AIProvider, AsyncAIProvider, BatchResult
+from .core.dialogue import DialogueManager
+from .core.summarizer import DialogueSummarizer
+from .core.caching import CachedProvider, SemanticCachedProvider
+from .core.coalescing import CoalescingProvider
+from .core.routing import HedgedProvider
+from .core.scheduling import RateLimitedProvider
+from .core.synthesis import SpeechPipeline, TTSWorker
+from .core.recognition_backends import RecognitionBackend
+from .utils.cache import ResponseCache
+from .utils.semantic_cache import SemanticCache
+from .utils.ratelimit import get_default_scheduler
+from .utils.tokens import count_tokens
+from .utils.audio_cache import AudioCache
+from .utils.vad import (
+    EnergyVAD, NoiseFloorEstimator, PlaybackGate, UtteranceSegmenter, VADEventType, MicrophoneFrameSource
+)
+from .utils.audio import CaptureStream
 from .exceptions import (
     AssistantError,
     NetworkError,
@@ -34,6 +50,73 @@ except ImportError:
     import wave as aifc
     logging.warning("使用 wave 模块替代 aifc")
 
+def create_provider(ai_config: AIConfig, provider_name: str,
+                    settings: Optional[Dict[str, Any]] = None) -> AIProvider:
+    """
+    按名称创建提供者
+    
+    Args:
+        ai_config: 配置对象
+        provider_name: 提供者名称
+        settings: 提供者配置，为None时从配置文件读取
+    
+    Returns:
+        AIProvider: 未经包装的提供者
+    
+    Raises:
+        ConfigError: 提供者初始化失败
+    """
+    try:
+        provider_config = ai_config.build_provider_spec(provider_name, settings)
+        return AIProvider.from_config(provider_config)
+    except Exception as e:
+        raise ConfigError(f"初始化AI提供者失败: {str(e)}")
+
+def wrap_provider(provider: AIProvider, config: Dict[str, Any],
+                  backup: Optional[AIProvider] = None) -> AIProvider:
+    """
+    按配置为提供者添加缓存、请求合并、对冲和限流调度
+    
+    调用顺序为: 精确缓存 -> 请求合并 -> 语义缓存 -> 对冲 -> 限流调度 -> 提供者
+    
+    Args:
+        provider: 原始提供者
+        config: 全局配置字典
+        backup: 对冲请求使用的备份提供者，为None时对冲到原提供者
+    
+    Returns:
+        AIProvider: 包装后的提供者
+    """
+    rate_limit_config = config.get('rate_limit', {})
+    if rate_limit_config.get('enabled', True):
+        scheduler = get_default_scheduler()
+        scheduler.set_limits(rate_limit_config.get('limits', {}))
+        provider = RateLimitedProvider(provider, scheduler)
+        if backup is not None:
+            backup = RateLimitedProvider(backup, scheduler)
+    hedging_config = config.get('hedging', {})
+    if hedging_config.get('enabled', False):
+        provider = HedgedProvider(
+            provider,
+            backup=backup,
+            percentile=hedging_config.get('percentile', 95),
+            min_samples=hedging_config.get('min_samples', 20),
+            max_hedge_ratio=hedging_config.get('max_hedge_ratio', 0.1),
+            max_concurrency=hedging_config.get('max_concurrency', 16)
+        )
+    cache_config = config.get('cache', {})
+    semantic_config = cache_config.get('semantic', {})
+    if semantic_config.get('enabled', False):
+        provider = SemanticCachedProvider(provider, SemanticCache(
+            threshold=semantic_config.get('threshold', 0.9),
+            max_entries=semantic_config.get('max_entries', 100_000)
+        ), context_messages=semantic_config.get('context_messages', 2))
+    if config.get('coalescing', {}).get('enabled', True):
+        provider = CoalescingProvider(provider)
+    if cache_config.get('enabled', True):
+        provider = CachedProvider(provider, ResponseCache.from_config(cache_config))
+    return provider
+
 class ChatMe:
     """简单的聊天接口类"""
     def __init__(self, 
@@ -62,23 +145,111 @@ class ChatMe:
     
     def _init_provider(self, provider_name: str, config: Dict[str, Any]) -> AIProvider:
         """初始化AI提供者"""
-        try:
-            provider_config = {
-                "type": provider_name,
-                "settings": config
-            }
-            return AIProvider.from_config(provider_config)
-        except Exception as e:
-            raise ConfigError(f"初始化AI提供者失败: {str(e)}")
+        provider = create_provider(self.config, provider_name, config)
+        
+        backup_name = self.config.config.get('hedging', {}).get('backup_provider')
+        backup = create_provider(self.config, backup_name) if backup_name else None
+        return wrap_provider(provider, self.config.config, backup)
     
-    def chat(self, message: str) -> str:
-        """与AI对话"""
+    def chat(self, message: str,
+             on_token: Optional[Callable[[str], None]] = None) -> str:
+        """与AI对话
+        
+        Args:
+            message: 用户消息
+            on_token: 增量回调，提供时以流式方式生成并在每个增量到达时调用
+            
+        Returns:
+            str: 完整的AI回复
+        """
         if not self.provider:
             raise ValueError("未设置AI提供者")
+        
+        if on_token is None:
+            return self.provider.generate_response(message)
+        
+        chunks = []
+        for delta in self.stream_chat(message):
+            chunks.append(delta)
+            on_token(delta)
+        return "".join(chunks)
+    
+    def stream_chat(self, message: str) -> Iterator[str]:
+        """与AI对话（流式），逐个产出回复增量"""
+        if not self.provider:
+            raise ValueError("未设置AI提供者")
+            
+        yield from self.provider.stream_response(message)
+    
+    def chat_many(self, prompts: List[str],
+                  max_concurrency: int = 8,
+                  requests_per_second: Optional[float] = None,
+                  tokens_per_minute: Optional[float] = None) -> List[BatchResult]:
+        """批量对话
+        
+        Args:
+            prompts: 用户消息列表
+            max_concurrency: 最大并发请求数
+            requests_per_second: 每秒请求数上限
+            tokens_per_minute: 每分钟token数上限
             
-        return self.provider.generate_response(message)
+        Returns:
+            List[BatchResult]: 与输入顺序一致的结果列表
+        """
+        if not self.provider:
+            raise ValueError("未设置AI提供者")
+        
+        return self.provider.generate_batch(
+            prompts,
+            max_concurrency=max_concurrency,
+            requests_per_second=requests_per_second,
+            tokens_per_minute=tokens_per_minute
+        )
+    
+    async def achat(self, message: str,
+                    on_token: Optional[Callable[[str], None]] = None) -> str:
+        """与AI异步对话
+        
+        提供者实现 AsyncAIProvider 时直接在事件循环内发起请求，
+        否则在线程池中执行同步调用。
+        
+        Args:
+            message: 用户消息
+            on_token: 增量回调，提供时以流式方式生成并在每个增量到达时调用
+            
+        Returns:
+            str: 完整的AI回复
+        """
+        if not self.provider:
+            raise ValueError("未设置AI提供者")
+        
+        if on_token is not None:
+            chunks = []
+            async for delta in self.provider.astream_response(message):
+                chunks.append(delta)
+                on_token(delta)
+            return "".join(chunks)
+        
+        if isinstance(self.provider, AsyncAIProvider):
+            return await self.provider.agenerate_response(message)
+        return await asyncio.to_thread(self.provider.generate_response, message)
+    
+    async def aclose(self) -> None:
+        """关闭提供者的异步连接池"""
+        if isinstance(self.provider, AsyncAIProvider):
+            await self.provider.aclose()
 
 class VoiceAssistant:
+    # 反复朗读的固定提示语，启动时预先合成到缓存
+    FIXED_PHRASES = (
+        "你好，我是AI语音助手，请说话。",
+        "再见！",
+        "抱歉，我没有听清，请再说一遍。",
+        "网络连接不稳定，正在重试...",
+        "声音太小，请说话声音大一点",
+        "发生错误，正在重试...",
+    )
+
     def __init__(self, config_path: Optional[str] = None):
         """初始化语音助手
         
@@ -93,9 +264,31 @@ class VoiceAssistant:
             self._check_environment()
         
         # 初始化组件
-        self.recognizer = Recognizer()
-        self.engine = pyttsx3.init()
-        self._setup_voice_engine()
+        # 识别后端按配置创建，本地模型在启动时加载好
+        self.recognition_backend = RecognitionBackend.from_config(self.config.build_recognition_spec())
+        self.recognition_backend.load()
+        self.vad = EnergyVAD(Config.ENERGY_THRESHOLD)
+        # 麦克风在第一次监听时打开，之后各轮对话共用同一个录音流
+        self.capture = CaptureStream(MicrophoneFrameSource(Config.SAMPLE_RATE, Config.VAD_FRAME_MS))
+        # 录音线程持续估计噪音基底并更新 VAD 阈值
+        self.noise = NoiseFloorEstimator(self.vad)
+        self.capture.add_listener(self.noise.update)
+        # 语音引擎由合成线程创建并独占，朗读不阻塞主循环
+        tts_cache_config = self.config.config.get('tts_cache', {})
+        audio_cache = None
+        if tts_cache_config.get('enabled', True):
+            audio_cache = AudioCache(
+                tts_cache_config.get('path'),
+                tts_cache_config.get('max_bytes', 32 * 1024 * 1024)
+            )
+        self.tts = TTSWorker(self._create_engine, audio_cache)
+        self.tts.prewarm(self.FIXED_PHRASES)
+        # 朗读时录音不停，麦克风会录到扬声器的声音：朗读期间提高判为说话的阈值，
+        # 只有比朗读声更大的声音才算用户打断
+        self.tts.add_listener(self.capture.set_playback)
+        self.gate = PlaybackGate(self.vad, lambda: self.capture.playback, Config.BARGE_IN_RATIO)
+        # 回复按句送入合成线程，边生成边播放
+        self.speech = SpeechPipeline(self.tts)
         
         # 初始化AI提供者
         provider_name = self.config.config.get('default_provider')
@@ -105,18 +298,24 @@ class VoiceAssistant:
         provider_config = self.config.get_provider_config(provider_name)
         self.provider = self._init_provider(provider_name, provider_config)
         
-        self.conversation_history = []
+        summary_config = self.config.config.get('summarization', {})
+        summarizer = None
+        if summary_config.get('enabled', True):
+            summarizer = DialogueSummarizer(
+                self.provider,
+                keep_recent=summary_config.get('keep_recent', 6),
+                trigger_tokens=summary_config.get('trigger_tokens', 1000)
+            )
+        self.dialogue = DialogueManager(summarizer=summarizer)
+        self.session_id = self.dialogue.create_session("voice")
     
     def _init_provider(self, provider_name: str, config: Dict[str, Any]) -> AIProvider:
         """初始化AI提供者"""
-        try:
-            provider_config = {
-                "type": provider_name,
-                "settings": config
-            }
-            return AIProvider.from_config(provider_config)
-        except Exception as e:
-            raise ConfigError(f"初始化AI提供者失败: {str(e)}")
+        provider = create_provider(self.config, provider_name, config)
+        
+        backup_name = self.config.config.get('hedging', {}).get('backup_provider')
+        backup = create_provider(self.config, backup_name) if backup_name else None
+        return wrap_provider(provider, self.config.config, backup)
     
     def _init_logging(self):
         """初始化日志系统"""
@@ -190,6 +389,12 @@ class VoiceAssistant:
             logging.error(f"麦克风检查失败: {str(e)}")
             raise AudioDeviceError("请确保麦克风已正确连接")
 
+    def _create_engine(self):
+        """创建并配置语音引擎（在合成线程中调用）"""
+        self.engine = pyttsx3.init()
+        self._setup_voice_engine()
+        return self.engine
+
     def _setup_voice_engine(self):
         """配置语音引擎"""
         try:
@@ -204,50 +409,84 @@ class VoiceAssistant:
             return False
         return True
 
-    @lru_cache(maxsize=100)
     def _cached_ai_response(self, user_input: str) -> str:
-        """缓存的AI响应"""
+        """缓存的AI响应（缓存由提供者的 ResponseCache 负责）"""
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": user_input}],
-                timeout=self.config.api_timeout
-            )
-            return response.choices[0].message.content
+            return self._get_ai_response_impl(user_input)
         except Exception as e:
-            raise APIError(f"OpenAI API调用失败: {str(e)}")
+            raise APIError(f"AI API调用失败: {str(e)}")
+
+    def _build_history(self, user_input: str) -> List[Dict[str, str]]:
+        """在 MAX_CONTEXT_TOKENS 预算内构建本轮请求的上下文（含系统提示词）"""
+        budget = Config.MAX_CONTEXT_TOKENS - count_tokens(user_input)
+        return self.dialogue.build_context(self.session_id, budget, Config.SYSTEM_PROMPT)
+
+    def _record_turn(self, user_input: str, response: str):
+        """记录一轮对话"""
+        self.dialogue.add_message(self.session_id, "user", user_input)
+        self.dialogue.add_message(self.session_id, "assistant", response)
 
     def listen(self):
         """增强的语音识别"""
         for attempt in range(Config.MAX_RETRIES):
             try:
-                with Microphone() as source:
-                    logging.info("正在听取用户输入...")
-                    self.recognizer.adjust_for_ambient_noise(source)
-                    audio = self.recognizer.listen(source)
+                self.capture.start()
+                logging.info("正在听取用户输入...")
+                logging.debug(f"噪音基底: {self.noise.noise_floor}, 能量阈值: {self.vad.threshold}")
+                # 逐帧检测，尾部静音达到 VAD_END_SILENCE_MS 即结束录音；
+                # 得到的音频是录音流环形缓冲区的视图
+                segmenter = UtteranceSegmenter(
+                    self.gate,
+                    self.capture.sample_rate,
+                    self.capture.frame_samples,
+                    end_silence_ms=Config.VAD_END_SILENCE_MS,
+                    keep_audio=False
+                )
+                # 开始说话即把音频逐帧送入识别后端，说完时只剩最后一点解码
+                session = None
+                try:
+                    utterance = None
+                    for event in self.capture.events(segmenter):
+                        if event.type is VADEventType.START:
+                            session = self.recognition_backend.start_stream(
+                                self.capture.sample_rate,
+                                Config.SPEECH_LANGUAGE
+                            )
+                            partial = session.accept(event.audio)
+                        elif event.type is VADEventType.SPEECH:
+                            partial = session.accept(event.audio)
+                        else:
+                            utterance = event.utterance
+                            break
+                        if partial:
+                            logging.debug(f"部分识别结果: {partial}")
+                    if utterance is None:
+                        continue
                     
                     # 检查音量
-                    if not self._check_volume(np.frombuffer(audio.frame_data, np.int16)):
-                        self.speak("声音太小，请说话声音大一点")
+                    if not self._check_volume(utterance.audio):
+                        self.speak("声音太小，请说话声音大一点", TTSWorker.PRIORITY_SYSTEM)
                         continue
                     
-                    text = self.recognizer.recognize_google(
-                        audio, 
-                        language=Config.SPEECH_LANGUAGE
-                    )
+                    text = session.finish(utterance.audio)
+                    if text is None:
+                        if attempt == Config.MAX_RETRIES - 1:
+                            logging.error("无法识别语音")
+                            return None
+                        time.sleep(Config.RETRY_DELAY)
+                        continue
                     
                     # 过滤敏感信息
                     text = filter_sensitive_info(text)
                     logging.info(f"识别到的文字: {text}")
                     return text
+                finally:
+                    # 提前结束（超时、音量太小、出错）时同样释放识别会话
+                    if session is not None:
+                        session.close()
                     
-            except sr.UnknownValueError:
-                if attempt == Config.MAX_RETRIES - 1:
-                    logging.error("无法识别语音")
-                    return None
-                time.sleep(Config.RETRY_DELAY)
-            except sr.RequestError as e:
-                logging.error(f"语音识别服务错误: {str(e)}")
+            except RecognitionError as e:
+                logging.error(f"语音识别错误: {str(e)}")
                 return None
 
     def get_ai_response(self, user_input):
@@ -267,38 +506,44 @@ class VoiceAssistant:
             logging.error(f"AI响应错误: {str(e)}")
             return "抱歉，我现在无法回答"
 
+    def stream_ai_response(self, user_input: str) -> Iterator[str]:
+        """
+        流式获取AI响应，逐个产出回复增量
+        
+        还没有产出内容就出错时以一句道歉代替回复；已经产出部分回复后出错则就此
+        结束，不在半句话后面接上道歉，这一轮也不写入对话历史。
+        """
+        chunks = []
+        try:
+            history = self._build_history(user_input)
+            for delta in self.provider.stream_response(user_input, history=history):
+                chunks.append(delta)
+                yield delta
+        except Exception as e:
+            logging.error(f"AI流式响应错误: {str(e)}")
+            if not chunks:
+                yield "抱歉，我现在无法回答"
+            return
+        self._record_turn(user_input, "".join(chunks))
+
     def _get_ai_response_impl(self, user_input):
         """实际的AI响应实现"""
-        self.conversation_history.append({"role": "user", "content": user_input})
-        
-        response = openai.ChatCompletion.create(
-            model=Config.AI_MODEL,
-            messages=[
-                {"role": "system", "content": Config.SYSTEM_PROMPT},
-                *self.conversation_history
-            ],
-            max_tokens=Config.MAX_TOKENS,
-            timeout=Config.RESPONSE_TIMEOUT
-        )
-        
-        ai_response = response.choices[0].message.content
-        self.conversation_history.append({"role": "assistant", "content": ai_response})
-        
-        if len(self.conversation_history) > Config.MAX_HISTORY:
-            self.conversation_history = self.conversation_history[-Config.MAX_HISTORY:]
-            
+        history = self._build_history(user_input)
+        ai_response = self.provider.generate_response(user_input, history=history)
+        self._record_turn(user_input, ai_response)
         return ai_response
 
-    def speak(self, text):
-        """改进的语音合成"""
+    def speak(self, text, priority: int = TTSWorker.PRIORITY_REPLY):
+        """加入朗读队列后立即返回；提示音使用 PRIORITY_SYSTEM 插到排队的回复之前"""
         try:
             logging.info(f"正在播放: {text}")
-            self.engine.say(text)
-            self.engine.runAndWait()
+            self.tts.enqueue(text, priority, cache=text in self.FIXED_PHRASES)
         except Exception as e:
             logging.error(f"语音合成错误: {str(e)}")
-            # 尝试使用备用声音引擎
-            self._fallback_speak(text)
+
+    def speak_stream(self, deltas: Iterator[str], wait: bool = True) -> str:
+        """流式朗读：第一句生成后立即开始播放，返回完整回复"""
+        return self.speech.speak_stream(deltas, wait)
 
     def run(self):
         """主循环"""
@@ -307,25 +552,30 @@ class VoiceAssistant:
         while True:
             try:
                 if not self._check_network():
-                    self.speak("网络连接不稳定，正在重试...")
+                    self.speak("网络连接不稳定，正在重试...", TTSWorker.PRIORITY_SYSTEM)
                     time.sleep(Config.RETRY_DELAY)
                     continue
                     
+                # 上一轮回复仍在朗读时即开始录音
                 user_input = self.listen()
                 if user_input is None:
-                    self.speak("抱歉，我没有听清，请再说一遍。")
+                    self.speak("抱歉，我没有听清，请再说一遍。", TTSWorker.PRIORITY_SYSTEM)
                     continue
                 
+                # 用户开口后不再朗读上一轮剩余的回复
+                self.tts.interrupt()
                 if "再见" in user_input or "退出" in user_input:
                     self.speak("再见！")
                     break
                 
-                response = self.get_ai_response(user_input)
-                self.speak(response)
+                self.speak_stream(self.stream_ai_response(user_input), wait=False)
                 
             except Exception as e:
                 logging.error(f"运行错误: {str(e)}")
-                self.speak("发生错误，正在重试...")
+                self.speak("发生错误，正在重试...", TTSWorker.PRIORITY_SYSTEM)
+        
+        self.tts.close()
+        self.capture.stop()
 
 def main_cli():
     """命令行入口点"""
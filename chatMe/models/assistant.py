@@ -8,8 +8,11 @@ from typing import Optional, List, Dict, Any
 import json
 import time
 from ..core.recognition import SpeechRecognizer
+from ..core.recognition_backends import RecognitionBackend
 from ..core.synthesis import SpeechSynthesizer
 from ..core.dialogue import DialogueManager
+from ..core.session_store import MemorySessionStore, SQLiteSessionStore
+from ..utils.audio_cache import AudioCache
 from ..utils.monitoring import PerformanceMonitor
 from ..exceptions import AssistantError
 from ..config import Config
@@ -33,6 +36,13 @@ class AssistantConfig:
     max_conversation_history: int = 10
     auto_adjust_noise: bool = True
     enable_performance_monitoring: bool = True
+    # 会话数据库路径，为None时会话只保存在内存中
+    session_store_path: Optional[str] = None
+    session_ttl: Optional[float] = None
+    # 合成语音缓存目录，为None时不缓存
+    tts_cache_path: Optional[str] = None
+    # 语音识别后端描述（type/settings），为None时使用 Config.RECOGNITION_BACKEND
+    recognition_backend: Optional[Dict[str, Any]] = None
     
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
@@ -43,7 +53,11 @@ class AssistantConfig:
             'wake_words': self.wake_words,
             'max_conversation_history': self.max_conversation_history,
             'auto_adjust_noise': self.auto_adjust_noise,
-            'enable_performance_monitoring': self.enable_performance_monitoring
+            'enable_performance_monitoring': self.enable_performance_monitoring,
+            'session_store_path': self.session_store_path,
+            'session_ttl': self.session_ttl,
+            'tts_cache_path': self.tts_cache_path,
+            'recognition_backend': self.recognition_backend
         }
     
     @classmethod
@@ -79,12 +93,28 @@ class Assistant:
         
         self.state = AssistantState.IDLE
     
+    @property
+    def greeting(self) -> str:
+        """启动时的问候语"""
+        return f"你好，我是{self.config.name}"
+    
     def _init_components(self):
         """初始化各个组件"""
         try:
-            self.recognizer = SpeechRecognizer()
-            self.synthesizer = SpeechSynthesizer()
-            self.dialogue_manager = DialogueManager()
+            backend = None
+            if self.config.recognition_backend:
+                backend = RecognitionBackend.from_config(self.config.recognition_backend)
+            self.recognizer = SpeechRecognizer(backend=backend)
+            audio_cache = AudioCache(self.config.tts_cache_path) if self.config.tts_cache_path else None
+            self.synthesizer = SpeechSynthesizer(audio_cache=audio_cache)
+            self.synthesizer.prewarm([self.greeting, "再见！"])
+            # 朗读期间录到的扬声器声音不当作用户说话
+            self.synthesizer.worker.add_listener(self.recognizer.stream.set_playback)
+            if self.config.session_store_path:
+                store = SQLiteSessionStore(self.config.session_store_path, ttl=self.config.session_ttl)
+            else:
+                store = MemorySessionStore(ttl=self.config.session_ttl)
+            self.dialogue_manager = DialogueManager(store=store)
         except Exception as e:
             self.state = AssistantState.ERROR
             raise AssistantError(f"组件初始化失败: {str(e)}")
@@ -92,7 +122,7 @@ class Assistant:
     def start(self):
         """启动助手"""
         try:
-            self.synthesizer.speak(f"你好，我是{self.config.name}")
+            self.synthesizer.speak(self.greeting, cache=True)
             
             while self.state != AssistantState.TERMINATED:
                 if self.config.enable_performance_monitoring:
@@ -112,7 +142,8 @@ class Assistant:
                 response = self.dialogue_manager.get_response(user_input)
                 
                 self.state = AssistantState.SPEAKING
-                self.synthesizer.speak(response)
+                # 朗读在合成线程中进行，不阻塞下一轮录音
+                self.synthesizer.speak(response, wait=False)
                 
                 self.state = AssistantState.IDLE
                 
@@ -123,7 +154,7 @@ class Assistant:
     def stop(self):
         """停止助手"""
         try:
-            self.synthesizer.speak("再见！")
+            self.synthesizer.speak("再见！", cache=True)
             self.state = AssistantState.TERMINATED
             
             # 清理资源
@@ -136,8 +167,10 @@ class Assistant:
     def cleanup(self):
         """清理资源"""
         try:
-            # 保存对话历史
-            self.save_conversation_history()
+            # 会话已增量写入存储，落盘缓冲并停止后台写入线程
+            self.dialogue_manager.close()
+            self.synthesizer.close()
+            self.recognizer.close()
             
             # 生成性能报告
             if self.config.enable_performance_monitoring:
@@ -150,7 +183,7 @@ class Assistant:
         """保存对话历史"""
         history = self.dialogue_manager.get_history()
         with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+            json.dump([dict(m) for m in history], f, ensure_ascii=False, indent=2)
     
     def save_performance_report(self, filename: str = "performance_report.json"):
         """保存性能报告"""
@@ -12,13 +12,16 @@ Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查
 from typing import Optional, Dict, Any, List
 
 from .audio import AudioProcessor
-from .cache import ResponseCache
+from .cache import ResponseCache, CacheBackend, MemoryBackend, RedisBackend
 from .network import NetworkManager
 from .monitoring import performance_monitor
 
 __all__ = [
     'AudioProcessor',
     'ResponseCache',
+    'CacheBackend',
+    'MemoryBackend',
+    'RedisBackend',
     'NetworkManager',
     'performance_monitor',
     'filter_sensitive_info'
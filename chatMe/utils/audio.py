@@ -6,10 +6,13 @@ import numpy as np
 import wave
 import pyaudio
 import audioop
-from typing import Optional, Tuple
+from dataclasses import replace
+from typing import Optional, Tuple, Callable, Iterator, List
 import logging
+import threading
 from ..exceptions import AudioDeviceError
 from ..config import Config
+from .vad import Utterance, UtteranceSegmenter, VADEvent, VADEventType, MicrophoneFrameSource, frame_features
 
 class AudioProcessor:
     def __init__(self, config: Optional[dict] = None):
@@ -101,6 +104,44 @@ class AudioProcessor:
         except Exception as e:
             raise AudioDeviceError(f"保存WAV文件失败: {str(e)}")
     
+    def play_wav(self, filename: str, stop_event: Optional[threading.Event] = None,
+                 chunk_frames: int = 1024) -> bool:
+        """
+        播放WAV文件
+        
+        Args:
+            filename: WAV文件名
+            stop_event: 设置后停止播放
+            chunk_frames: 每次写入的帧数
+            
+        Returns:
+            bool: 是否完整播放（被 stop_event 打断时返回False）
+            
+        Raises:
+            AudioDeviceError: 播放失败
+        """
+        try:
+            with wave.open(filename, 'rb') as wf:
+                stream = self.pyaudio.open(
+                    format=self.pyaudio.get_format_from_width(wf.getsampwidth()),
+                    channels=wf.getnchannels(),
+                    rate=wf.getframerate(),
+                    output=True
+                )
+                try:
+                    data = wf.readframes(chunk_frames)
+                    while data:
+                        if stop_event is not None and stop_event.is_set():
+                            return False
+                        stream.write(data)
+                        data = wf.readframes(chunk_frames)
+                    return True
+                finally:
+                    stream.stop_stream()
+                    stream.close()
+        except Exception as e:
+            raise AudioDeviceError(f"播放WAV文件失败: {str(e)}")
+    
     def detect_silence(self, audio_data: bytes, 
                       silence_threshold: int = 500) -> bool:
         """
@@ -114,4 +155,355 @@ class AudioProcessor:
             bool: 是否为静音
         """
         rms = audioop.rms(audio_data, 2)  # 2表示16位采样
-        return rms < silence_threshold
\ No newline at end of file
+        return rms < silence_threshold
+
+class RingBuffer:
+    """
+    预分配的环形采样缓冲区
+    
+    底层数组长度为容量的两倍，每个采样同时写入 i 和 i + capacity 两处，
+    因此任意不超过容量的连续区间都是底层数组上的一段连续切片，读取时直接返回
+    只读视图而不复制。写入不分配内存；bytes、memoryview 等缓冲区对象通过
+    np.frombuffer 零拷贝地转换后写入。
+    
+    视图在写入方绕回覆盖之前有效（即之后再写入 capacity 个采样之前），
+    需要长期保存时由调用方自行复制。
+    
+    Args:
+        capacity: 容量（采样数）
+        dtype: 采样类型
+    """
+    
+    def __init__(self, capacity: int, dtype=np.int16):
+        if capacity <= 0:
+            raise ValueError("容量必须大于0")
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self._buffer = np.zeros(capacity * 2, dtype=self.dtype)
+        # 已写入的采样总数，作为单调递增的采样序号
+        self.total = 0
+    
+    @property
+    def oldest(self) -> int:
+        """缓冲区中仍然有效的最早采样序号"""
+        return max(self.total - self.capacity, 0)
+    
+    def write(self, data) -> int:
+        """
+        写入采样
+        
+        Args:
+            data: numpy 数组或任意缓冲区对象
+        
+        Returns:
+            int: 写入的第一个采样的序号
+        """
+        if isinstance(data, np.ndarray):
+            samples = data.reshape(-1)
+        else:
+            samples = np.frombuffer(memoryview(data), dtype=self.dtype)
+        start = self.total
+        count = len(samples)
+        if count > self.capacity:
+            # 只保留能放下的最新部分
+            samples = samples[-self.capacity:]
+            self.total += count - self.capacity
+            count = self.capacity
+        
+        pos = self.total % self.capacity
+        first = min(count, self.capacity - pos)
+        buffer = self._buffer
+        buffer[pos:pos + first] = samples[:first]
+        buffer[pos + self.capacity:pos + self.capacity + first] = samples[:first]
+        rest = count - first
+        if rest:
+            buffer[:rest] = samples[first:]
+            buffer[self.capacity:self.capacity + rest] = samples[first:]
+        self.total += count
+        return start
+    
+    def view(self, start: int, count: int) -> np.ndarray:
+        """
+        读取一段采样的只读视图
+        
+        Args:
+            start: 起始采样序号
+            count: 采样数
+        
+        Returns:
+            np.ndarray: 不复制数据的只读视图
+        
+        Raises:
+            ValueError: 区间超出缓冲区中的有效数据
+        """
+        if count < 0 or start < self.oldest or start + count > self.total:
+            raise ValueError(f"采样区间 [{start}, {start + count}) 不在缓冲区内")
+        pos = start % self.capacity
+        view = self._buffer[pos:pos + count]
+        view.flags.writeable = False
+        return view
+    
+    def latest(self, count: int) -> np.ndarray:
+        """读取最近写入的 count 个采样（不足时返回全部有效数据）的视图"""
+        count = min(count, self.total - self.oldest)
+        return self.view(self.total - count, count)
+
+class FrameReader:
+    """
+    CaptureStream 上的一个读取游标
+    
+    逐帧产出环形缓冲区的视图。读取落后超过缓冲区容量时跳到最早的有效帧，
+    并在 overruns 中计数。
+    
+    Args:
+        stream: 录音流
+        start: 起始采样序号
+        timeout: 等待下一帧的最长时间（秒），超时后结束迭代
+    """
+    
+    def __init__(self, stream: "CaptureStream", start: int, timeout: Optional[float] = None):
+        self.stream = stream
+        self.cursor = start
+        self.timeout = timeout
+        self.overruns = 0
+    
+    def __iter__(self) -> Iterator[np.ndarray]:
+        return self
+    
+    def __next__(self) -> np.ndarray:
+        stream = self.stream
+        ring = stream.ring
+        size = stream.frame_samples
+        with stream._cond:
+            ready = stream._cond.wait_for(
+                lambda: ring.total >= self.cursor + size or not stream.running,
+                self.timeout
+            )
+            if not ready or ring.total < self.cursor + size:
+                raise StopIteration
+            if self.cursor < ring.oldest:
+                skipped = ring.oldest - self.cursor
+                self.cursor += -(-skipped // size) * size
+                self.overruns += 1
+                stream.logger.warning(f"读取落后，跳过 {skipped} 个采样")
+            frame = ring.view(self.cursor, size)
+        self.cursor += size
+        return frame
+
+class CaptureStream:
+    """
+    持续录音流
+    
+    后台线程从帧来源（默认为麦克风）读取音频并写入预分配的 RingBuffer，
+    设备在多轮对话之间保持打开，不再每次监听都重新打开设备。
+    VAD、电平表、识别器和录音等消费者通过 reader() 获得各自的游标，
+    读取的都是环形缓冲区的视图，不复制数据。
+    
+    listener 在录音线程中对每一帧调用，适合电平统计等轻量计算。
+    
+    Args:
+        source: 帧来源，需要提供 sample_rate、frame_samples 并支持上下文管理和迭代
+        buffer_seconds: 环形缓冲区可保存的时长（秒）
+    """
+    
+    def __init__(self, source=None, buffer_seconds: float = 30.0):
+        self.source = source or MicrophoneFrameSource(Config.SAMPLE_RATE, Config.VAD_FRAME_MS)
+        self.sample_rate = self.source.sample_rate
+        self.frame_samples = self.source.frame_samples
+        frames = max(int(buffer_seconds * self.sample_rate) // self.frame_samples, 1)
+        self.ring = RingBuffer(frames * self.frame_samples)
+        self.logger = logging.getLogger(__name__)
+        
+        # 最近一帧的均方根能量
+        self.level = 0.0
+        # 上一次 capture_utterance 读到的采样序号
+        self.cursor = 0
+        # 扬声器是否正在朗读，以及上一次朗读结束时的采样序号
+        self.playback = False
+        self.playback_end = 0
+        self.error: Optional[Exception] = None
+        self._listeners: List[Callable[[np.ndarray], None]] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self.running = False
+    
+    def start(self):
+        """
+        打开设备并开始录音
+        
+        已经在录音，或有限的帧来源（如WAV文件）已经读完时不做任何事；
+        录音线程出错退出后会重新打开设备。
+        
+        Raises:
+            AudioDeviceError: 打开设备失败
+        """
+        if self._thread is not None and (self.running or self.error is None):
+            return
+        try:
+            self.source.__enter__()
+        except AudioDeviceError:
+            raise
+        except Exception as e:
+            raise AudioDeviceError(f"打开录音设备失败: {str(e)}")
+        self.error = None
+        self._stop_event.clear()
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="audio-capture", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: Optional[float] = 1.0):
+        """停止录音并关闭设备"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def __enter__(self) -> "CaptureStream":
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+    
+    def _run(self):
+        try:
+            for frame in self.source:
+                if self._stop_event.is_set():
+                    break
+                start = self.ring.write(frame)
+                view = self.ring.view(start, len(frame))
+                self.level = float(frame_features(view)[0][0])
+                for listener in list(self._listeners):
+                    try:
+                        listener(view)
+                    except Exception as e:
+                        self.logger.error(f"录音监听器出错: {str(e)}")
+                with self._cond:
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+            self.logger.error(f"录音出错: {str(e)}")
+        finally:
+            try:
+                self.source.__exit__(None, None, None)
+            finally:
+                with self._cond:
+                    self.running = False
+                    self._cond.notify_all()
+    
+    def add_listener(self, listener: Callable[[np.ndarray], None]):
+        """添加逐帧回调，参数为该帧的只读视图"""
+        self._listeners.append(listener)
+    
+    def remove_listener(self, listener: Callable[[np.ndarray], None]):
+        """移除逐帧回调"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def set_playback(self, active: bool):
+        """
+        标记扬声器开始或结束朗读，可作为 TTSWorker 的监听器
+        
+        朗读结束时记录当前采样序号，从上一句结束处继续监听的调用方应跳过此前
+        录到的朗读声。
+        """
+        self.playback = active
+        if not active:
+            self.playback_end = self.ring.total
+    
+    def reader(self, start: Optional[int] = None, timeout: Optional[float] = None) -> FrameReader:
+        """
+        创建读取游标
+        
+        Args:
+            start: 起始采样序号，None表示从当前位置开始（只读取之后录到的音频）
+            timeout: 等待下一帧的最长时间（秒）
+        
+        Returns:
+            FrameReader: 逐帧产出视图的迭代器
+        """
+        return FrameReader(self, self.ring.total if start is None else start, timeout)
+    
+    def recent_frames(self, seconds: float) -> np.ndarray:
+        """
+        最近一段音频按帧排列的视图
+        
+        Returns:
+            np.ndarray: 形状为 (帧数, 每帧采样数) 的只读视图
+        """
+        frames = int(seconds * self.sample_rate) // self.frame_samples
+        frames = min(frames, (self.ring.total - self.ring.oldest) // self.frame_samples)
+        return self.ring.latest(frames * self.frame_samples).reshape(frames, self.frame_samples)
+    
+    def events(self, segmenter: UtteranceSegmenter, start: Optional[int] = None,
+               timeout: Optional[float] = None) -> Iterator[VADEvent]:
+        """
+        录音并逐帧产出分句事件，直到下一句话结束
+        
+        segmenter 应设置 keep_audio=False。START 事件的 audio 为预录音加起始帧，
+        END 事件的 audio 为整句，都是环形缓冲区的视图；utterance 的起止时间和
+        帧序号是相对录音流开始的位置。
+        
+        Args:
+            segmenter: 分句器
+            start: 起始采样序号，None表示从当前位置开始
+            timeout: 等待开始说话的最长时间（秒）
+        
+        Yields:
+            VADEvent: 分句事件
+        
+        Raises:
+            AudioDeviceError: 录音线程出错
+        """
+        segmenter.reset()
+        reader = self.reader(start)
+        for event in segmenter.events(reader, timeout):
+            self.cursor = reader.cursor
+            if event.type is VADEventType.START:
+                count = min(segmenter.utterance_frames * self.frame_samples, reader.cursor - self.ring.oldest)
+                event = replace(event, audio=self.ring.view(reader.cursor - count, count))
+            elif event.type is VADEventType.END:
+                utterance = self._locate(event.utterance, reader.cursor)
+                event = replace(event, audio=utterance.audio, utterance=utterance)
+            yield event
+        self.cursor = reader.cursor
+        if self.error is not None:
+            raise AudioDeviceError(f"录音出错: {str(self.error)}")
+    
+    def _locate(self, utterance: Utterance, end: int) -> Utterance:
+        """把结束于采样 end 的一句话换算为环形缓冲区上的视图和位置"""
+        count = min((utterance.end_frame - utterance.start_frame) * self.frame_samples, end - self.ring.oldest)
+        start = end - count
+        return replace(
+            utterance,
+            audio=self.ring.view(start, count),
+            start=start / self.sample_rate,
+            end=end / self.sample_rate,
+            start_frame=start // self.frame_samples,
+            end_frame=end // self.frame_samples
+        )
+    
+    def capture_utterance(self, segmenter: UtteranceSegmenter, start: Optional[int] = None,
+                          timeout: Optional[float] = None) -> Optional[Utterance]:
+        """
+        录下一句话
+        
+        segmenter 应设置 keep_audio=False；返回的 Utterance.audio 是环形缓冲区的视图，
+        起止时间和帧序号是相对录音流开始的位置。
+        
+        Args:
+            segmenter: 分句器
+            start: 起始采样序号，None表示从当前位置开始
+            timeout: 等待开始说话的最长时间（秒）
+        
+        Returns:
+            Optional[Utterance]: 录到的语音，超时或录音停止时返回None
+        
+        Raises:
+            AudioDeviceError: 录音线程出错
+        """
+        for event in self.events(segmenter, start, timeout):
+            if event.type is VADEventType.END:
+                return event.utterance
+        return None
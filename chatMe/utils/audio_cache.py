@@ -0,0 +1,180 @@
+"""
+合成语音缓存模块
+
+助手反复朗读的固定提示语（问候、告别、没听清等）每次都经 pyttsx3 重新合成。
+缓存把合成结果保存为WAV文件，再次朗读时直接播放。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import wave
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable
+from ..exceptions import CacheError
+
+class AudioCache:
+    """
+    合成语音的磁盘缓存
+    
+    以 (文本, 声音, 语速, 音量) 为键，每条语音保存为缓存目录中的一个WAV文件。
+    总大小超过 max_bytes 时按最近使用顺序淘汰；命中时更新文件的修改时间，
+    重启后按修改时间恢复LRU顺序。
+    
+    Args:
+        path: 缓存目录
+        max_bytes: 缓存文件的最大总字节数
+    """
+    
+    SUFFIX = ".wav"
+    TMP_SUFFIX = ".tmp"
+    
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 32 * 1024 * 1024):
+        self.path = Path(path or Path.home() / ".chatme" / "tts")
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # 键 -> 文件大小，按最近使用从旧到新排列
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._load()
+        except OSError as e:
+            raise CacheError(f"打开语音缓存失败: {str(e)}")
+    
+    def _load(self):
+        """扫描缓存目录，清理上次未完成的临时文件"""
+        files = []
+        for file in self.path.iterdir():
+            if file.name.endswith(self.TMP_SUFFIX + self.SUFFIX):
+                file.unlink(missing_ok=True)
+            elif file.suffix == self.SUFFIX:
+                stat = file.stat()
+                files.append((stat.st_mtime, file.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+    
+    @staticmethod
+    def make_key(text: str, voice: Optional[str], rate: Any, volume: Any) -> str:
+        """
+        生成缓存键
+        
+        Args:
+            text: 朗读的文本
+            voice: 声音ID
+            rate: 语速
+            volume: 音量
+        
+        Returns:
+            str: 可用作文件名的键
+        """
+        raw = json.dumps([text, voice, rate, volume], ensure_ascii=False, default=str)
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _file(self, key: str) -> Path:
+        return self.path / f"{key}{self.SUFFIX}"
+    
+    def get(self, key: str) -> Optional[Path]:
+        """
+        查询缓存
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            Optional[Path]: WAV文件路径，未命中时返回None
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            path = self._file(key)
+            try:
+                os.utime(path)
+            except OSError:
+                # 文件被外部删除
+                self._size -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return path
+    
+    def put(self, key: str, render: Callable[[str], None]) -> Optional[Path]:
+        """
+        合成并写入缓存
+        
+        render 把语音写入给定的文件名；写入临时文件并校验为有效的WAV后才原子替换到
+        缓存中。
+        
+        Args:
+            key: 缓存键
+            render: 把语音保存到指定文件的函数
+        
+        Returns:
+            Optional[Path]: WAV文件路径，合成失败或结果不是有效的WAV时返回None
+        """
+        tmp_path = self.path / f"{key}{self.TMP_SUFFIX}{self.SUFFIX}"
+        try:
+            render(str(tmp_path))
+            with wave.open(str(tmp_path), 'rb') as wf:
+                if wf.getnframes() == 0:
+                    raise ValueError("没有音频数据")
+            path = self._file(key)
+            os.replace(tmp_path, path)
+            size = path.stat().st_size
+        except Exception as e:
+            self.logger.warning(f"缓存合成语音失败: {str(e)}")
+            tmp_path.unlink(missing_ok=True)
+            return None
+        
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+        return path
+    
+    def _evict(self):
+        """淘汰最久未使用的文件直到不超过 max_bytes（至少保留一条）"""
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._file(key).unlink(missing_ok=True)
+            self._size -= size
+            self.evictions += 1
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            for key in self._entries:
+                self._file(key).unlink(missing_ok=True)
+            self._entries.clear()
+            self._size = 0
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions
+        }
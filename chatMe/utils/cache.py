@@ -1,14 +1,553 @@
+"""
+响应缓存工具模块
+"""
 
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List, Callable
 from cachetools import TTLCache, LRUCache
+from ..exceptions import CacheError
 
-class ResponseCache:
+class CacheBackend(ABC):
+    """
+    缓存后端接口
+    
+    ResponseCache 的内存两级缓存之后的共享存储层，可以是本地磁盘或Redis等外部存储。
+    """
+    
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中返回None"""
+        pass
+    
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """写入缓存"""
+        pass
+    
+    @abstractmethod
+    def delete(self, key: str):
+        """删除缓存项"""
+        pass
+    
+    @abstractmethod
+    def clear(self):
+        """清空缓存"""
+        pass
+    
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """批量查询缓存"""
+        return [self.get(key) for key in keys]
+    
+    def set_many(self, items: Dict[str, str], ttl: Optional[float] = None):
+        """批量写入缓存"""
+        for key, value in items.items():
+            self.set(key, value, ttl=ttl)
+    
+    def single_flight(self, key: str, compute: Callable[[], str],
+                      ttl: Optional[float] = None) -> str:
+        """
+        查询缓存，未命中时计算并写入
+        
+        支持跨进程锁的后端应覆盖此方法，保证同一个键同时只有一个调用方执行 compute。
+        
+        Args:
+            key: 缓存键
+            compute: 未命中时用于生成值的函数
+            ttl: 过期时间（秒）
+        
+        Returns:
+            str: 缓存或新计算的值
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value:
+                self.set(key, value, ttl=ttl)
+        return value
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取后端统计"""
+        return {}
+
+class MemoryBackend(CacheBackend):
+    """进程内缓存后端，单进程部署和测试使用"""
+    
     def __init__(self):
-        # 使用TTL缓存，10分钟过期
-        self.short_term = TTLCache(
-            maxsize=100, 
-            ttl=600
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            return value
+    
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else 0.0)
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def single_flight(self, key: str, compute: Callable[[], str],
+                      ttl: Optional[float] = None) -> str:
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                return super().single_flight(key, compute, ttl)
+        finally:
+            with self._lock:
+                if not key_lock.locked():
+                    self._key_locks.pop(key, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._data)}
+
+# 仅当锁仍由自己持有时才释放
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+else
+    return 0
+end
+"""
+
+class RedisBackend(CacheBackend):
+    """
+    Redis缓存后端，多节点共享缓存
+    
+    批量读写使用pipeline，超过 compress_threshold 字节的值用zlib压缩。
+    single_flight 通过 SET NX PX 实现分布式锁，多个节点同时请求同一个键时
+    只有持锁节点调用上游，其余节点等待结果写入。
+    
+    Args:
+        client: 已创建的Redis客户端，为None时根据url创建
+        url: Redis连接地址
+        prefix: 键前缀
+        compress_threshold: 压缩阈值（字节）
+        lock_timeout: 锁的自动过期时间（秒）
+        wait_timeout: 等待其他节点结果的最长时间（秒）
+        poll_interval: 等待结果时的轮询间隔（秒）
+    """
+    
+    def __init__(self,
+                 client: Optional[Any] = None,
+                 url: str = "redis://localhost:6379/0",
+                 prefix: str = "chatme:",
+                 compress_threshold: int = 512,
+                 lock_timeout: float = 30,
+                 wait_timeout: float = 30,
+                 poll_interval: float = 0.05):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise CacheError("使用Redis缓存需要安装redis: pip install redis")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.compress_threshold = compress_threshold
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+        
+        self.hits = 0
+        self.misses = 0
+        self.lock_acquired = 0
+        self.lock_waits = 0
+    
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+    
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}lock:{key}"
+    
+    def _encode(self, value: str) -> bytes:
+        raw = value.encode('utf-8')
+        if len(raw) >= self.compress_threshold:
+            return b'z' + zlib.compress(raw)
+        return b'r' + raw
+    
+    @staticmethod
+    def _decode(data: Optional[bytes]) -> Optional[str]:
+        if data is None:
+            return None
+        if data[:1] == b'z':
+            return zlib.decompress(data[1:]).decode('utf-8')
+        return data[1:].decode('utf-8')
+    
+    def _count(self, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._count(self._decode(self.client.get(self._key(key))))
+        except Exception as e:
+            raise CacheError(f"Redis读取失败: {str(e)}")
+    
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        try:
+            self.client.set(self._key(key), self._encode(value),
+                            px=int(ttl * 1000) if ttl else None)
+        except Exception as e:
+            raise CacheError(f"Redis写入失败: {str(e)}")
+    
+    def delete(self, key: str):
+        self.client.delete(self._key(key))
+    
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+    
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(self._key(key))
+            return [self._count(self._decode(data)) for data in pipe.execute()]
+        except Exception as e:
+            raise CacheError(f"Redis批量读取失败: {str(e)}")
+    
+    def set_many(self, items: Dict[str, str], ttl: Optional[float] = None):
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.set(self._key(key), self._encode(value),
+                         px=int(ttl * 1000) if ttl else None)
+            pipe.execute()
+        except Exception as e:
+            raise CacheError(f"Redis批量写入失败: {str(e)}")
+    
+    def _acquire(self, lock_key: str, token: str) -> bool:
+        return bool(self.client.set(lock_key, token, nx=True,
+                                    px=int(self.lock_timeout * 1000)))
+    
+    def _release(self, lock_key: str, token: str):
+        try:
+            self.client.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+        except Exception as e:
+            # 释放失败时锁会在 lock_timeout 后自动过期
+            self.logger.warning(f"释放Redis锁失败: {str(e)}")
+    
+    def single_flight(self, key: str, compute: Callable[[], str],
+                      ttl: Optional[float] = None) -> str:
+        value = self.get(key)
+        if value is not None:
+            return value
+        
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            if self._acquire(lock_key, token):
+                self.lock_acquired += 1
+                try:
+                    # 持锁后再查一次，避免重复计算刚被释放的结果
+                    value = self.get(key)
+                    if value is None:
+                        value = compute()
+                        if value:
+                            self.set(key, value, ttl=ttl)
+                    return value
+                finally:
+                    self._release(lock_key, token)
+            
+            if not waited:
+                self.lock_waits += 1
+                waited = True
+            time.sleep(self.poll_interval)
+            value = self.get(key)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                # 持锁节点迟迟没有结果，放弃等待自行计算
+                value = compute()
+                if value:
+                    self.set(key, value, ttl=ttl)
+                return value
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'lock_acquired': self.lock_acquired,
+            'lock_waits': self.lock_waits
+        }
+
+class _CountingTTLCache(TTLCache):
+    """统计淘汰和过期数量的TTL缓存"""
+    
+    def __init__(self, maxsize: int, ttl: float,
+                 on_evict: Callable[[], None], on_expire: Callable[[int], None]):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._on_evict = on_evict
+        self._on_expire = on_expire
+    
+    def popitem(self):
+        item = super().popitem()
+        self._on_evict()
+        return item
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        if expired:
+            self._on_expire(len(expired))
+        return expired
+
+class _CountingLRUCache(LRUCache):
+    """统计淘汰数量的LRU缓存"""
+    
+    def __init__(self, maxsize: int, on_evict: Callable[[], None]):
+        super().__init__(maxsize=maxsize)
+        self._on_evict = on_evict
+    
+    def popitem(self):
+        item = super().popitem()
+        self._on_evict()
+        return item
+
+class ResponseCache:
+    """
+    多级响应缓存
+    
+    新响应先写入带过期时间的短期缓存，在短期缓存中被命中 promote_after 次后
+    晋升到容量更大的LRU长期缓存。配置了持久化后端时，所有写入同时落到后端，
+    内存未命中时再查询后端，进程重启后依然可以命中。
+    """
+    
+    def __init__(self,
+                 short_term_size: int = 100,
+                 ttl: float = 600,
+                 long_term_size: int = 1000,
+                 promote_after: int = 2,
+                 backend: Optional[CacheBackend] = None,
+                 backend_ttl: Optional[float] = None):
+        self._lock = threading.RLock()
+        self.promote_after = promote_after
+        self.backend = backend
+        self.backend_ttl = backend_ttl
+        
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.promotions = 0
+        
+        # 使用TTL缓存，默认10分钟过期，值为 [响应, 命中次数]
+        self.short_term = _CountingTTLCache(
+            maxsize=short_term_size,
+            ttl=ttl,
+            on_evict=self._count_eviction,
+            on_expire=self._count_expiration
         )
         # 使用LRU缓存存储常用响应
-        self.long_term = LRUCache(
-            maxsize=1000
-        )
\ No newline at end of file
+        self.long_term = _CountingLRUCache(
+            maxsize=long_term_size,
+            on_evict=self._count_eviction
+        )
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'ResponseCache':
+        """从配置创建缓存"""
+        backend_type = config.get('backend') or ('disk' if config.get('persistent') else None)
+        if backend_type == 'disk':
+            from .disk_cache import DiskCache
+            backend = DiskCache(
+                path=config.get('path'),
+                max_bytes=config.get('max_disk_bytes', 64 * 1024 * 1024)
+            )
+        elif backend_type == 'redis':
+            backend = RedisBackend(
+                url=config.get('redis_url', "redis://localhost:6379/0"),
+                prefix=config.get('redis_prefix', "chatme:")
+            )
+        elif backend_type == 'memory':
+            backend = MemoryBackend()
+        elif backend_type is None:
+            backend = None
+        else:
+            raise CacheError(f"未知的缓存后端: {backend_type}")
+        return cls(
+            short_term_size=config.get('short_term_size', 100),
+            ttl=config.get('ttl', 600),
+            long_term_size=config.get('long_term_size', 1000),
+            promote_after=config.get('promote_after', 2),
+            backend=backend,
+            backend_ttl=config.get('backend_ttl')
+        )
+    
+    def _count_eviction(self):
+        self.evictions += 1
+    
+    def _count_expiration(self, count: int):
+        self.expirations += count
+    
+    @staticmethod
+    def make_key(provider: str,
+                 model: Optional[str],
+                 temperature: Optional[float],
+                 system_prompt: Optional[str],
+                 messages: List[Dict[str, str]],
+                 params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        生成缓存键
+        
+        Args:
+            provider: 提供者名称
+            model: 模型名称
+            temperature: 温度参数
+            system_prompt: 系统提示词
+            messages: 消息历史（含本次输入）
+            params: 其他影响输出的请求参数
+        
+        Returns:
+            str: 缓存键
+        """
+        payload = json.dumps(
+            {
+                'provider': provider,
+                'model': model,
+                'temperature': temperature,
+                'system_prompt': system_prompt,
+                'messages': [(m.get('role'), m.get('content')) for m in messages],
+                'params': params or {}
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            str: 缓存的响应，未命中返回None
+        """
+        with self._lock:
+            value = self.long_term.get(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            
+            entry = self.short_term.get(key)
+            if entry is None:
+                value = self.backend.get(key) if self.backend is not None else None
+                if value is None:
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                self.backend_hits += 1
+                self.short_term[key] = [value, 0]
+                return value
+            
+            self.hits += 1
+            entry[1] += 1
+            if entry[1] >= self.promote_after:
+                del self.short_term[key]
+                self.long_term[key] = entry[0]
+                self.promotions += 1
+            return entry[0]
+    
+    def set(self, key: str, value: str):
+        """写入缓存"""
+        with self._lock:
+            if key in self.long_term:
+                self.long_term[key] = value
+            else:
+                self.short_term[key] = [value, 0]
+            if self.backend is not None:
+                self.backend.set(key, value, ttl=self.backend_ttl)
+    
+    def get_or_compute(self, key: str, compute: Callable[[], str]) -> str:
+        """
+        查询缓存，未命中时计算并写入
+        
+        有共享后端时由后端的 single_flight 保证同一个键只计算一次。
+        
+        Args:
+            key: 缓存键
+            compute: 未命中时用于生成值的函数
+        
+        Returns:
+            str: 缓存或新计算的值
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        
+        if self.backend is None:
+            value = compute()
+            if value:
+                self.set(key, value)
+            return value
+        
+        value = self.backend.single_flight(key, compute, ttl=self.backend_ttl)
+        if value:
+            with self._lock:
+                if key not in self.long_term:
+                    self.short_term[key] = [value, 0]
+        return value
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self.short_term.clear()
+            self.long_term.clear()
+            if self.backend is not None:
+                self.backend.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取缓存统计
+        
+        Returns:
+            Dict: 命中、未命中、淘汰等计数
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'promotions': self.promotions,
+                'short_term_size': len(self.short_term),
+                'long_term_size': len(self.long_term)
+            }
+            if self.backend is not None:
+                stats['backend'] = self.backend.get_stats()
+            return stats
@@ -0,0 +1,532 @@
+"""
+磁盘持久化缓存模块
+
+存储由两个文件组成:
+    values.log  追加写入的值日志，每条记录带CRC校验
+    index.bin   通过mmap映射的开放寻址哈希索引，记录键哈希到日志偏移的映射
+
+查询只需一次索引探测和一次 pread，不涉及YAML/JSON解析。日志超过容量上限时
+把最新的有效记录压缩到新文件，再通过 os.replace 原子替换，进程在任意时刻
+崩溃都不会破坏已有数据。
+
+同一目录可以被多个进程共用（如同时运行 chatme chat 和 chatme start）：
+每次操作都持有目录中 lock 文件上的 flock 排他锁，并在加锁后检查日志和索引
+是否已被其他进程压缩或扩容替换，是则重新打开。不支持 fcntl 的平台上
+只有进程内的线程锁。
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+from ..exceptions import CacheError
+from .cache import CacheBackend
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_LOG_MAGIC = b'CMLG'
+_INDEX_MAGIC = b'CMIX'
+_VERSION = 1
+
+# 日志文件头: magic, version, generation
+_LOG_HEADER = struct.Struct('<4sIQ')
+# 日志记录头: crc32, key_hash, key_len, value_len, expires_at
+_RECORD_HEADER = struct.Struct('<IQIId')
+# 索引文件头: magic, version, generation, capacity, count, log_size
+_INDEX_HEADER = struct.Struct('<4sIQQQQ')
+# 索引槽位: key_hash, offset+1（0表示空槽）
+_SLOT = struct.Struct('<QQ')
+
+_TOMBSTONE = 0xFFFFFFFFFFFFFFFF
+_MAX_LOAD = 0.7
+
+def _hash_key(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+class DiskCache(CacheBackend):
+    """
+    磁盘持久化缓存
+    
+    Args:
+        path: 缓存目录
+        max_bytes: 值日志的最大字节数，超过后触发压缩
+        compact_ratio: 压缩后保留的数据量占 max_bytes 的比例
+        initial_capacity: 初始索引槽位数
+    """
+    
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 compact_ratio: float = 0.5,
+                 initial_capacity: int = 4096):
+        self.path = Path(path or Path.home() / ".chatme" / "cache")
+        self.max_bytes = max_bytes
+        self.compact_ratio = compact_ratio
+        self.initial_capacity = initial_capacity
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.compactions = 0
+        
+        self._log_fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._index_file = None
+        self._index: Optional[mmap.mmap] = None
+        
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._locked():
+                self._open()
+        except OSError as e:
+            raise CacheError(f"打开磁盘缓存失败: {str(e)}")
+    
+    @property
+    def log_path(self) -> Path:
+        return self.path / "values.log"
+    
+    @property
+    def index_path(self) -> Path:
+        return self.path / "index.bin"
+    
+    @property
+    def lock_path(self) -> Path:
+        return self.path / "lock"
+    
+    @contextmanager
+    def _locked(self):
+        """持有线程锁和跨进程文件锁，最外层加锁时同步其他进程的修改"""
+        with self._lock:
+            outermost = self._lock_depth == 0
+            if outermost and fcntl is not None:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                if outermost and self._log_fd is not None:
+                    self._sync()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if outermost and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+    
+    @staticmethod
+    def _same_file(path: Path, fd: int) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        current = os.fstat(fd)
+        return (stat.st_dev, stat.st_ino) == (current.st_dev, current.st_ino)
+    
+    def _sync(self):
+        """其他进程替换了日志（压缩、清空）或索引（扩容）时重新打开"""
+        if not self._same_file(self.log_path, self._log_fd):
+            self._close_files()
+            self._open()
+        elif self._index_file is None or not self._same_file(self.index_path, self._index_file.fileno()):
+            if not self._map_index():
+                self._create_index(self.index_path, self.initial_capacity, self.generation)
+                self._map_index()
+                self._replay(_LOG_HEADER.size)
+    
+    # ------------------------------------------------------------------
+    # 文件管理
+    # ------------------------------------------------------------------
+    
+    def _open(self):
+        """打开日志和索引，必要时从日志重建索引"""
+        if not self.log_path.exists() or self.log_path.stat().st_size < _LOG_HEADER.size:
+            self._write_log_header(self.log_path, time.time_ns())
+        self._log_fd = os.open(self.log_path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        magic, version, self.generation = _LOG_HEADER.unpack(
+            os.pread(self._log_fd, _LOG_HEADER.size, 0)
+        )
+        if magic != _LOG_MAGIC or version != _VERSION:
+            raise CacheError(f"无效的缓存日志文件: {self.log_path}")
+        
+        if not self._map_index():
+            self.logger.info("磁盘缓存索引失效，正在从日志重建")
+            self._create_index(self.index_path, self.initial_capacity, self.generation)
+            self._map_index()
+            self._replay(_LOG_HEADER.size)
+        else:
+            # 索引之后追加的记录（上次进程在更新索引前退出）
+            self._replay(self._header()[5])
+    
+    @staticmethod
+    def _write_log_header(path: Path, generation: int):
+        with open(path, 'wb') as f:
+            f.write(_LOG_HEADER.pack(_LOG_MAGIC, _VERSION, generation))
+            f.flush()
+            os.fsync(f.fileno())
+    
+    @staticmethod
+    def _create_index(path: Path, capacity: int, generation: int):
+        with open(path, 'wb') as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _VERSION, generation, capacity, 0, _LOG_HEADER.size))
+            f.truncate(_INDEX_HEADER.size + capacity * _SLOT.size)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _map_index(self) -> bool:
+        """映射索引文件，索引与当前日志不匹配时返回False"""
+        self._close_index()
+        if not self.index_path.exists():
+            return False
+        self._index_file = open(self.index_path, 'r+b')
+        try:
+            self._index = mmap.mmap(self._index_file.fileno(), 0)
+        except ValueError:
+            self._close_index()
+            return False
+        
+        magic, version, generation, capacity, _, log_size = self._header()
+        expected_size = _INDEX_HEADER.size + capacity * _SLOT.size
+        if (magic != _INDEX_MAGIC or version != _VERSION or generation != self.generation
+                or len(self._index) != expected_size
+                or log_size > os.fstat(self._log_fd).st_size):
+            self._close_index()
+            return False
+        return True
+    
+    def _close_index(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+    
+    def _close_files(self):
+        if self._index is not None:
+            self._index.flush()
+        self._close_index()
+        if self._log_fd is not None:
+            os.close(self._log_fd)
+            self._log_fd = None
+    
+    def close(self):
+        """关闭缓存文件"""
+        with self._lock:
+            self._close_files()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+    
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+    
+    # ------------------------------------------------------------------
+    # 索引操作
+    # ------------------------------------------------------------------
+    
+    def _header(self) -> Tuple[bytes, int, int, int, int, int]:
+        return _INDEX_HEADER.unpack_from(self._index, 0)
+    
+    def _set_header(self, count: int, log_size: int):
+        magic, version, generation, capacity, _, _ = self._header()
+        _INDEX_HEADER.pack_into(self._index, 0, magic, version, generation, capacity, count, log_size)
+    
+    def _slot(self, i: int) -> Tuple[int, int]:
+        return _SLOT.unpack_from(self._index, _INDEX_HEADER.size + i * _SLOT.size)
+    
+    def _set_slot(self, i: int, key_hash: int, offset: int):
+        _SLOT.pack_into(self._index, _INDEX_HEADER.size + i * _SLOT.size, key_hash, offset)
+    
+    def _probe(self, key_hash: int, key: bytes) -> Tuple[Optional[int], Optional[int]]:
+        """
+        查找键所在槽位
+        
+        Returns:
+            (命中槽位, 可插入槽位)
+        """
+        capacity = self._header()[3]
+        i = key_hash % capacity
+        insert_at = None
+        for _ in range(capacity):
+            slot_hash, slot_offset = self._slot(i)
+            if slot_offset == 0:
+                return None, insert_at if insert_at is not None else i
+            if slot_offset == _TOMBSTONE:
+                if insert_at is None:
+                    insert_at = i
+            elif slot_hash == key_hash:
+                record = self._read_record(slot_offset - 1)
+                if record is not None and record[0] == key:
+                    return i, i
+            i = (i + 1) % capacity
+        return None, insert_at
+    
+    def _index_put(self, key_hash: int, key: bytes, offset: int):
+        _, _, _, capacity, count, _ = self._header()
+        if (count + 1) > capacity * _MAX_LOAD:
+            self._resize(capacity * 2)
+        found, insert_at = self._probe(key_hash, key)
+        if found is None:
+            count += 1
+        self._set_slot(insert_at, key_hash, offset + 1)
+        self._set_header(count, self._header()[5])
+    
+    def _index_delete(self, slot: int):
+        self._set_slot(slot, 0, _TOMBSTONE)
+        _, _, _, _, count, log_size = self._header()
+        self._set_header(count - 1, log_size)
+    
+    def _live_offsets(self) -> List[int]:
+        capacity = self._header()[3]
+        offsets = []
+        for i in range(capacity):
+            _, offset = self._slot(i)
+            if offset not in (0, _TOMBSTONE):
+                offsets.append(offset - 1)
+        return offsets
+    
+    def _resize(self, capacity: int):
+        """扩容索引，新索引写入临时文件后原子替换"""
+        offsets = self._live_offsets()
+        log_size = self._header()[5]
+        self._build_index(offsets, capacity, self.generation, log_size)
+        self._map_index()
+    
+    def _build_index(self, offsets: List[int], capacity: int, generation: int,
+                     log_size: int, log_fd: Optional[int] = None):
+        """按给定记录偏移构建索引文件"""
+        tmp_path = self.index_path.with_suffix('.tmp')
+        self._create_index(tmp_path, capacity, generation)
+        with open(tmp_path, 'r+b') as f:
+            index = mmap.mmap(f.fileno(), 0)
+            try:
+                for offset in offsets:
+                    header = self._read_header(offset, log_fd)
+                    key_hash = header[1]
+                    i = key_hash % capacity
+                    while _SLOT.unpack_from(index, _INDEX_HEADER.size + i * _SLOT.size)[1] != 0:
+                        i = (i + 1) % capacity
+                    _SLOT.pack_into(index, _INDEX_HEADER.size + i * _SLOT.size, key_hash, offset + 1)
+                _INDEX_HEADER.pack_into(index, 0, _INDEX_MAGIC, _VERSION, generation,
+                                        capacity, len(offsets), log_size)
+                index.flush()
+            finally:
+                index.close()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+    
+    # ------------------------------------------------------------------
+    # 日志操作
+    # ------------------------------------------------------------------
+    
+    def _read_header(self, offset: int, fd: Optional[int] = None) -> Tuple[int, int, int, int, float]:
+        fd = self._log_fd if fd is None else fd
+        return _RECORD_HEADER.unpack(os.pread(fd, _RECORD_HEADER.size, offset))
+    
+    def _read_record(self, offset: int, fd: Optional[int] = None,
+                     verify: bool = False) -> Optional[Tuple[bytes, bytes, float]]:
+        """读取一条日志记录，返回 (key, value, expires_at)"""
+        fd = self._log_fd if fd is None else fd
+        raw_header = os.pread(fd, _RECORD_HEADER.size, offset)
+        if len(raw_header) < _RECORD_HEADER.size:
+            return None
+        crc, _, key_len, value_len, expires_at = _RECORD_HEADER.unpack(raw_header)
+        body = os.pread(fd, key_len + value_len, offset + _RECORD_HEADER.size)
+        if len(body) < key_len + value_len:
+            return None
+        if verify and zlib.crc32(raw_header[4:] + body) != crc:
+            return None
+        return body[:key_len], body[key_len:], expires_at
+    
+    @staticmethod
+    def _pack_record(key_hash: int, key: bytes, value: bytes, expires_at: float) -> bytes:
+        header_tail = _RECORD_HEADER.pack(0, key_hash, len(key), len(value), expires_at)[4:]
+        crc = zlib.crc32(header_tail + key + value)
+        return struct.pack('<I', crc) + header_tail + key + value
+    
+    def _replay(self, start: int):
+        """把日志中 start 之后的记录补充到索引，截断不完整的尾部记录"""
+        log_size = os.fstat(self._log_fd).st_size
+        offset = start
+        while offset < log_size:
+            record = self._read_record(offset, verify=True)
+            if record is None:
+                self.logger.warning(f"磁盘缓存日志在偏移 {offset} 处损坏，截断尾部")
+                os.ftruncate(self._log_fd, offset)
+                break
+            key, value, _ = record
+            key_hash = self._read_header(offset)[1]
+            if value:
+                self._index_put(key_hash, key, offset)
+            else:
+                found, _ = self._probe(key_hash, key)
+                if found is not None:
+                    self._index_delete(found)
+            offset += _RECORD_HEADER.size + len(key) + len(value)
+        self._set_header(self._header()[4], offset)
+    
+    def _append(self, record: bytes) -> int:
+        offset = os.fstat(self._log_fd).st_size
+        os.pwrite(self._log_fd, record, offset)
+        return offset
+    
+    # ------------------------------------------------------------------
+    # 公共接口
+    # ------------------------------------------------------------------
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存
+        
+        Args:
+            key: 缓存键
+        
+        Returns:
+            str: 缓存的值，未命中或已过期返回None
+        """
+        raw_key = key.encode('utf-8')
+        with self._locked():
+            found, _ = self._probe(_hash_key(raw_key), raw_key)
+            if found is None:
+                self.misses += 1
+                return None
+            _, value, expires_at = self._read_record(self._slot(found)[1] - 1)
+            if expires_at and expires_at < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value.decode('utf-8')
+    
+    def set(self, key: str, value: str, ttl: Optional[float] = None):
+        """
+        写入缓存
+        
+        Args:
+            key: 缓存键
+            value: 缓存值（不能为空字符串）
+            ttl: 过期时间（秒），None表示不过期
+        """
+        if not value:
+            return
+        raw_key = key.encode('utf-8')
+        raw_value = value.encode('utf-8')
+        key_hash = _hash_key(raw_key)
+        expires_at = time.time() + ttl if ttl else 0.0
+        with self._locked():
+            try:
+                offset = self._append(self._pack_record(key_hash, raw_key, raw_value, expires_at))
+                self._index_put(key_hash, raw_key, offset)
+                self._set_header(self._header()[4], offset + _RECORD_HEADER.size + len(raw_key) + len(raw_value))
+            except OSError as e:
+                raise CacheError(f"写入磁盘缓存失败: {str(e)}")
+            if os.fstat(self._log_fd).st_size > self.max_bytes:
+                self.compact()
+    
+    def delete(self, key: str):
+        """删除缓存项"""
+        raw_key = key.encode('utf-8')
+        key_hash = _hash_key(raw_key)
+        with self._locked():
+            found, _ = self._probe(key_hash, raw_key)
+            if found is None:
+                return
+            # 写入空值记录作为删除标记，保证重放日志时删除依然生效
+            offset = self._append(self._pack_record(key_hash, raw_key, b'', 0.0))
+            self._index_delete(found)
+            self._set_header(self._header()[4], offset + _RECORD_HEADER.size + len(raw_key))
+    
+    def compact(self):
+        """
+        压缩日志
+        
+        丢弃过期和被覆盖的记录，并按写入顺序从旧到新淘汰，
+        直到数据量不超过 max_bytes * compact_ratio。
+        """
+        with self._locked():
+            now = time.time()
+            budget = self.max_bytes * self.compact_ratio
+            live = []
+            offsets = self._live_offsets()
+            for offset in sorted(offsets, reverse=True):
+                key, value, expires_at = self._read_record(offset)
+                if expires_at and expires_at < now:
+                    continue
+                size = _RECORD_HEADER.size + len(key) + len(value)
+                if budget - size < 0:
+                    break
+                budget -= size
+                live.append((key, value, expires_at))
+            self.evictions += len(offsets) - len(live)
+            
+            generation = time.time_ns()
+            tmp_log = self.log_path.with_suffix('.tmp')
+            self._write_log_header(tmp_log, generation)
+            offsets = []
+            with open(tmp_log, 'r+b') as f:
+                f.seek(0, os.SEEK_END)
+                for key, value, expires_at in reversed(live):
+                    offsets.append(f.tell())
+                    f.write(self._pack_record(_hash_key(key), key, value, expires_at))
+                log_size = f.tell()
+                f.flush()
+                os.fsync(f.fileno())
+            
+            tmp_fd = os.open(tmp_log, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                capacity = max(self.initial_capacity, int(len(offsets) / _MAX_LOAD) + 1)
+                self._build_index(offsets, capacity, generation, log_size, log_fd=tmp_fd)
+            finally:
+                os.close(tmp_fd)
+            
+            # 新索引已先于日志落盘：若在两次替换之间崩溃，代号不匹配会触发从旧日志重建索引
+            self._close_index()
+            os.close(self._log_fd)
+            os.replace(tmp_log, self.log_path)
+            self._log_fd = os.open(self.log_path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+            self.generation = generation
+            if not self._map_index():
+                self._create_index(self.index_path, self.initial_capacity, self.generation)
+                self._map_index()
+                self._replay(_LOG_HEADER.size)
+            self.compactions += 1
+    
+    def clear(self):
+        """清空缓存"""
+        with self._locked():
+            self._close_files()
+            # 写入新文件再替换，其他进程据此发现日志已更换
+            tmp_log = self.log_path.with_suffix('.tmp')
+            self._write_log_header(tmp_log, time.time_ns())
+            self.index_path.unlink(missing_ok=True)
+            os.replace(tmp_log, self.log_path)
+            self._open()
+    
+    def __len__(self) -> int:
+        with self._locked():
+            return self._header()[4]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._locked():
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'compactions': self.compactions,
+                'entries': self._header()[4],
+                'size_bytes': os.fstat(self._log_fd).st_size
+            }
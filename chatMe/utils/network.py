@@ -9,6 +9,7 @@ from typing import Optional, Dict, Any
 import logging
 import time
 from ..exceptions import NetworkError
+from .ratelimit import backoff_delay, retry_after_from_headers
 from ..config import Config
 
 class NetworkManager:
@@ -44,11 +45,17 @@ class NetworkManager:
             self.logger.warning(f"网络连接检查失败: {str(e)}")
             return False
     
+    # 可以重试的HTTP状态码
+    RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+    
     def request_with_retry(self, method: str, url: str, 
                           max_retries: int = 3, **kwargs) -> requests.Response:
         """
         带重试的请求
         
+        只重试连接错误、超时和可重试的状态码（429、5xx等），等待时间为带抖动的
+        指数退避，服务端返回 Retry-After 时以其为下限。其他4xx错误直接失败。
+        
         Args:
             method: 请求方法
             url: 请求URL
@@ -67,9 +74,17 @@ class NetworkManager:
                 response.raise_for_status()
                 return response
             except requests.exceptions.RequestException as e:
-                if attempt == max_retries - 1:
+                response = getattr(e, 'response', None)
+                retryable = response is None or response.status_code in self.RETRYABLE_STATUS
+                if not retryable or attempt == max_retries - 1:
                     raise NetworkError(f"请求失败: {str(e)}")
-                time.sleep(self.config.RETRY_DELAY * (attempt + 1))
+                delay = backoff_delay(
+                    attempt,
+                    base=self.config.RETRY_DELAY,
+                    retry_after=retry_after_from_headers(response.headers) if response is not None else None
+                )
+                self.logger.warning(f"请求失败，{delay:.2f}s 后重试: {str(e)}")
+                time.sleep(delay)
     
     async def async_request(self, method: str, url: str, **kwargs) -> Dict:
         """
@@ -0,0 +1,422 @@
+"""
+速率限制工具模块
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Tuple, Mapping, List
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+    
+    每秒补充 rate 个令牌，最多累积 capacity 个。申请量超过当前余额时允许透支，
+    调用方按透支量等待，从而保证长期平均速率不超过 rate。
+    """
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("令牌补充速率必须大于0")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        elapsed = now - self.last_refill
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.last_refill = now
+    
+    def reserve(self, amount: float = 1) -> float:
+        """
+        预留令牌
+        
+        Args:
+            amount: 需要的令牌数
+        
+        Returns:
+            float: 调用方需要等待的秒数
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+    
+    def wait_time(self, amount: float = 1) -> float:
+        """
+        不消耗令牌，计算余额达到 amount 还需等待的秒数
+        
+        amount 超过桶容量时按桶满计算，多出的部分在获取时透支。
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = min(amount, self.capacity) - self.tokens
+            return missing / self.rate if missing > 0 else 0.0
+    
+    def update(self, rate: Optional[float] = None, capacity: Optional[float] = None,
+               tokens: Optional[float] = None):
+        """
+        调整速率、容量或当前余额
+        
+        Args:
+            rate: 新的补充速率
+            capacity: 新的容量
+            tokens: 当前余额上限（通常来自服务端返回的剩余额度）
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if rate is not None and rate > 0:
+                self.rate = rate
+            if capacity is not None and capacity > 0:
+                self.capacity = capacity
+                self.tokens = min(self.tokens, capacity)
+            if tokens is not None:
+                self.tokens = min(self.tokens, tokens)
+    
+    def acquire(self, amount: float = 1):
+        """阻塞直到获得令牌"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+    
+    def try_acquire(self, amount: float = 1) -> bool:
+        """尝试立即获取令牌，余额不足时不透支并返回False"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0,
+                  retry_after: Optional[float] = None) -> float:
+    """
+    计算带抖动的指数退避时间
+    
+    使用 full jitter：在 [0, min(cap, base * 2^attempt)] 中均匀取值，避免大量
+    调用方在同一时刻重试。服务端给出 Retry-After 时以其为下限。
+    
+    Args:
+        attempt: 已重试次数（从0开始）
+        base: 基础等待时间（秒）
+        cap: 最长等待时间（秒）
+        retry_after: 服务端要求的等待时间（秒）
+    
+    Returns:
+        float: 等待秒数
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after + random.uniform(0, base))
+    return delay
+
+_DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    解析限流响应头中的时间
+    
+    支持纯秒数（"20"、"0.5"）、OpenAI风格的时长（"6m0s"、"250ms"）和
+    Retry-After 的HTTP日期格式。
+    
+    Returns:
+        float: 秒数，无法解析时返回None
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if parts and ''.join(n + u for n, u in parts) == value:
+        return sum(float(n) * _DURATION_UNITS[u] for n, u in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_after_from_headers(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """从响应头读取建议的重试等待时间"""
+    if not headers:
+        return None
+    for name in ('retry-after-ms', 'retry-after'):
+        value = headers.get(name)
+        if value is not None:
+            seconds = parse_duration(value)
+            if seconds is not None:
+                return seconds / 1000 if name == 'retry-after-ms' else seconds
+    return None
+
+class _Quota:
+    """单个提供者/模型的请求数和token数额度"""
+    
+    def __init__(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float],
+                 headroom: float):
+        self.headroom = headroom
+        self.requests = self._bucket(requests_per_minute)
+        self.tokens = self._bucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.consecutive_limited = 0
+        self.waiters: List[Tuple[int, int, object]] = []
+    
+    def _bucket(self, per_minute: Optional[float]) -> Optional[TokenBucket]:
+        if not per_minute:
+            return None
+        rate = per_minute * self.headroom / 60
+        # 容量取一秒的额度，使请求均匀分布而不是在每分钟开头集中发出
+        return TokenBucket(rate, max(1.0, rate))
+    
+    def set_limit(self, name: str, per_minute: float):
+        bucket = getattr(self, name)
+        rate = per_minute * self.headroom / 60
+        if bucket is None:
+            setattr(self, name, TokenBucket(rate, max(1.0, rate)))
+        elif abs(bucket.rate - rate) > 1e-9:
+            bucket.update(rate=rate, capacity=max(1.0, rate))
+    
+    def wait_time(self, tokens: float) -> float:
+        wait = self.blocked_until - time.monotonic()
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+    
+    def consume(self, tokens: float):
+        if self.requests is not None:
+            self.requests.reserve(1)
+        if self.tokens is not None:
+            self.tokens.reserve(tokens)
+
+class RateLimitScheduler:
+    """
+    提供者调用的共享限流调度器
+    
+    按 (提供者, 模型) 维护每分钟请求数和token数两个令牌桶，额度按 headroom 留出余量，
+    使持续吞吐量稳定在配额之下。等待中的调用方按优先级（数值越小越优先）和到达顺序
+    排队，只有队首调用方可以消耗额度。额度可以预先配置，也可以从响应头
+    （x-ratelimit-*）中学习；收到429时整个键按带抖动的指数退避暂停。
+    
+    Args:
+        limits: 预配置的额度，键为 "提供者/模型" 或 "提供者"，
+                值包含 requests_per_minute、tokens_per_minute
+        headroom: 实际使用的额度比例
+        backoff_base: 429退避的基础时间（秒）
+        backoff_cap: 429退避的最长时间（秒）
+    """
+    
+    # 异步等待时重新检查队列的最长间隔
+    ASYNC_POLL_INTERVAL = 0.05
+    
+    def __init__(self,
+                 limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 headroom: float = 0.95,
+                 backoff_base: float = 1.0,
+                 backoff_cap: float = 60.0):
+        self.limits = limits or {}
+        self.headroom = headroom
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._quotas: Dict[Tuple[str, str], _Quota] = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        
+        self.granted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.total_wait = 0.0
+    
+    def _quota(self, key: Tuple[str, str]) -> _Quota:
+        quota = self._quotas.get(key)
+        if quota is None:
+            provider, model = key
+            limit = self.limits.get(f"{provider}/{model}") or self.limits.get(provider) or {}
+            quota = _Quota(
+                limit.get('requests_per_minute'),
+                limit.get('tokens_per_minute'),
+                self.headroom
+            )
+            self._quotas[key] = quota
+        return quota
+    
+    def set_limits(self, limits: Dict[str, Dict[str, float]]):
+        """
+        设置或更新预配置的额度
+        
+        Args:
+            limits: 键为 "提供者/模型" 或 "提供者"，值包含 requests_per_minute、tokens_per_minute
+        """
+        with self._cond:
+            self.limits.update(limits)
+            for (provider, model), quota in self._quotas.items():
+                limit = limits.get(f"{provider}/{model}") or limits.get(provider) or {}
+                for name in ('requests', 'tokens'):
+                    per_minute = limit.get(f'{name}_per_minute')
+                    if per_minute:
+                        quota.set_limit(name, per_minute)
+    
+    def _enqueue(self, key: Tuple[str, str], priority: int) -> Tuple[_Quota, Tuple[int, int, object]]:
+        quota = self._quota(key)
+        entry = (priority, next(self._sequence), object())
+        heapq.heappush(quota.waiters, entry)
+        return quota, entry
+    
+    def _try_grant(self, quota: _Quota, entry: Tuple[int, int, object], tokens: float) -> Optional[float]:
+        """
+        队首调用方在额度足够时获得许可
+        
+        Returns:
+            获得许可时返回None；在队首但额度不足时返回需等待的秒数；
+            不在队首时返回 ASYNC_POLL_INTERVAL
+        """
+        if quota.waiters[0] is not entry:
+            return self.ASYNC_POLL_INTERVAL
+        wait = quota.wait_time(tokens)
+        if wait > 0:
+            return wait
+        quota.consume(tokens)
+        heapq.heappop(quota.waiters)
+        self.granted += 1
+        self._cond.notify_all()
+        return None
+    
+    def _dequeue(self, quota: _Quota, entry: Tuple[int, int, object]):
+        if entry in quota.waiters:
+            quota.waiters.remove(entry)
+            heapq.heapify(quota.waiters)
+            self._cond.notify_all()
+    
+    def acquire(self, key: Tuple[str, str], tokens: float = 0, priority: int = 0):
+        """
+        阻塞直到获得一次调用的额度
+        
+        Args:
+            key: (提供者, 模型)
+            tokens: 本次调用预计消耗的token数
+            priority: 优先级，数值越小越优先
+        """
+        start = time.monotonic()
+        with self._cond:
+            quota, entry = self._enqueue(key, priority)
+            try:
+                while True:
+                    wait = self._try_grant(quota, entry, tokens)
+                    if wait is None:
+                        break
+                    # 不在队首时等待通知，在队首时等待额度恢复
+                    self._cond.wait(timeout=wait if quota.waiters[0] is entry else None)
+            except BaseException:
+                self._dequeue(quota, entry)
+                raise
+            self._record_wait(time.monotonic() - start)
+    
+    async def aacquire(self, key: Tuple[str, str], tokens: float = 0, priority: int = 0):
+        """acquire 的异步版本，等待期间不阻塞事件循环"""
+        start = time.monotonic()
+        with self._cond:
+            quota, entry = self._enqueue(key, priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_grant(quota, entry, tokens)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, self.ASYNC_POLL_INTERVAL))
+        except BaseException:
+            with self._cond:
+                self._dequeue(quota, entry)
+            raise
+        with self._cond:
+            self._record_wait(time.monotonic() - start)
+    
+    def _record_wait(self, waited: float):
+        if waited > 0.001:
+            self.queued += 1
+            self.total_wait += waited
+    
+    def update_from_headers(self, key: Tuple[str, str], headers: Optional[Mapping[str, str]]):
+        """
+        根据响应头更新额度
+        
+        读取 x-ratelimit-limit-requests/tokens 作为配额，x-ratelimit-remaining-requests/tokens
+        作为当前余额上限。
+        """
+        if not headers:
+            return
+        with self._cond:
+            quota = self._quota(key)
+            for name, suffix in (('requests', 'requests'), ('tokens', 'tokens')):
+                limit = headers.get(f'x-ratelimit-limit-{suffix}')
+                remaining = headers.get(f'x-ratelimit-remaining-{suffix}')
+                try:
+                    if limit is not None:
+                        quota.set_limit(name, float(limit))
+                    bucket = getattr(quota, name)
+                    if remaining is not None and bucket is not None:
+                        bucket.update(tokens=float(remaining) * self.headroom)
+                except ValueError:
+                    continue
+            quota.consecutive_limited = 0
+    
+    def record_rate_limited(self, key: Tuple[str, str],
+                            headers: Optional[Mapping[str, str]] = None) -> float:
+        """
+        记录一次429响应，在退避期间暂停该键的所有调用
+        
+        Returns:
+            float: 退避秒数
+        """
+        with self._cond:
+            quota = self._quota(key)
+            delay = backoff_delay(
+                quota.consecutive_limited,
+                base=self.backoff_base,
+                cap=self.backoff_cap,
+                retry_after=retry_after_from_headers(headers)
+            )
+            quota.consecutive_limited += 1
+            quota.blocked_until = max(quota.blocked_until, time.monotonic() + delay)
+            self.rate_limited += 1
+            self._cond.notify_all()
+            return delay
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计"""
+        with self._cond:
+            return {
+                'granted': self.granted,
+                'queued': self.queued,
+                'rate_limited': self.rate_limited,
+                'avg_wait': self.total_wait / self.queued if self.queued else 0.0,
+                'waiting': sum(len(q.waiters) for q in self._quotas.values()),
+                'limits': {
+                    f"{provider}/{model}": {
+                        'requests_per_minute': q.requests.rate * 60 / self.headroom if q.requests else None,
+                        'tokens_per_minute': q.tokens.rate * 60 / self.headroom if q.tokens else None
+                    }
+                    for (provider, model), q in self._quotas.items()
+                }
+            }
+
+_default_scheduler: Optional[RateLimitScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+def get_default_scheduler() -> RateLimitScheduler:
+    """获取进程内共享的限流调度器"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RateLimitScheduler()
+        return _default_scheduler
@@ -0,0 +1,314 @@
+"""
+语义缓存工具模块
+
+按提示词的向量相似度查找缓存，同一问题的不同问法（如“今天天气怎么样”与
+“今天天气如何”）可以命中同一条回复。
+"""
+
+import re
+import threading
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple
+import numpy as np
+
+class Embedder(ABC):
+    """文本向量化接口"""
+    
+    # 向量维度
+    dim: int
+    
+    @abstractmethod
+    def embed(self, text: str) -> np.ndarray:
+        """
+        将文本转换为L2归一化的float32向量
+        
+        Args:
+            text: 输入文本
+        
+        Returns:
+            np.ndarray: 形状为 (dim,) 的向量
+        """
+        pass
+
+class HashingEmbedder(Embedder):
+    """
+    本地离线的字符n-gram哈希向量化
+    
+    不依赖模型和网络。向量化前统一常见的疑问词同义表达并去掉句末语气词，
+    其余情况只能识别字面相近的问法，需要更强语义能力时可替换为其他 Embedder。
+    """
+    
+    # 常见同义表达，统一为同一写法后再向量化
+    DEFAULT_SYNONYMS = {
+        "如何": "怎么样",
+        "怎样": "怎么样",
+        "咋样": "怎么样",
+        "啥": "什么",
+        "能不能": "可以",
+        "能否": "可以",
+        "请问": "",
+    }
+    # 句末语气词
+    TRAILING_PARTICLES = "啊呀吧呢哦嘛啦哈"
+    
+    _STRIP_PATTERN = re.compile(r'[\s\W_]+')
+    
+    def __init__(self,
+                 dim: int = 128,
+                 ngram_range: Tuple[int, int] = (1, 3),
+                 synonyms: Optional[Dict[str, str]] = None):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.synonyms = self.DEFAULT_SYNONYMS if synonyms is None else synonyms
+    
+    def normalize(self, text: str) -> str:
+        """规范化文本：全角转半角、去除标点空白、统一同义词、去掉句末语气词"""
+        text = self._STRIP_PATTERN.sub('', unicodedata.normalize('NFKC', text).lower())
+        for source, target in self.synonyms.items():
+            text = text.replace(source, target)
+        return text.rstrip(self.TRAILING_PARTICLES) or text
+    
+    def embed(self, text: str) -> np.ndarray:
+        text = self.normalize(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            # 单字区分度低，权重减半
+            weight = 0.5 if n == 1 else 1.0
+            for i in range(len(text) - n + 1):
+                h = zlib.crc32(text[i:i + n].encode('utf-8'))
+                vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class OpenAIEmbedder(Embedder):
+    """使用OpenAI Embeddings接口的向量化"""
+    
+    def __init__(self, api_key: str, model: str = "text-embedding-ada-002", dim: int = 1536):
+        import openai
+        self.client = openai.OpenAI(api_key=api_key)
+        self.model = model
+        self.dim = dim
+    
+    def embed(self, text: str) -> np.ndarray:
+        response = self.client.embeddings.create(model=self.model, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class VectorIndex:
+    """
+    基于NumPy的最近邻索引
+    
+    向量存放在预分配的矩阵中，条目数不超过 exact_search_limit 时做精确的矩阵-向量
+    内积搜索；更大时用随机超平面LSH分桶，只对候选条目计算内积，使十万级条目的
+    查询仍保持在亚毫秒级。达到 max_entries 后覆盖最早写入的条目。
+    """
+    
+    def __init__(self,
+                 dim: int,
+                 max_entries: int = 100_000,
+                 exact_search_limit: int = 20_000,
+                 num_tables: int = 12,
+                 num_bits: int = 10,
+                 seed: int = 0):
+        self.dim = dim
+        self.max_entries = max_entries
+        self.exact_search_limit = exact_search_limit
+        self.vectors = np.zeros((min(1024, max_entries), dim), dtype=np.float32)
+        self.namespaces = np.zeros(len(self.vectors), dtype=np.int64)
+        self.size = 0
+        self._next = 0
+        
+        rng = np.random.default_rng(seed)
+        self.num_tables = num_tables
+        self._planes = rng.standard_normal((num_tables * num_bits, dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(num_bits, dtype=np.int64))
+        self._num_bits = num_bits
+        self._buckets: List[Dict[int, set]] = [dict() for _ in range(num_tables)]
+        self._signatures = np.zeros((len(self.vectors), num_tables), dtype=np.int64)
+    
+    def _signature(self, vector: np.ndarray) -> np.ndarray:
+        bits = (self._planes @ vector > 0).reshape(self.num_tables, self._num_bits)
+        return bits @ self._bit_weights
+    
+    def _grow(self):
+        capacity = min(len(self.vectors) * 2, self.max_entries)
+        for name in ('vectors', 'namespaces', '_signatures'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+    
+    def add(self, vector: np.ndarray, namespace: int = 0) -> int:
+        """
+        添加向量
+        
+        Returns:
+            int: 条目位置，覆盖旧条目时返回被覆盖的位置
+        """
+        slot = self._next
+        if slot >= len(self.vectors):
+            self._grow()
+        
+        if slot < self.size:
+            for table, sig in enumerate(self._signatures[slot]):
+                self._buckets[table].get(int(sig), set()).discard(slot)
+        
+        signature = self._signature(vector)
+        self.vectors[slot] = vector
+        self.namespaces[slot] = namespace
+        self._signatures[slot] = signature
+        for table, sig in enumerate(signature):
+            self._buckets[table].setdefault(int(sig), set()).add(slot)
+        
+        self._next = (slot + 1) % self.max_entries
+        self.size = min(self.size + 1, self.max_entries)
+        return slot
+    
+    def search(self, vector: np.ndarray, namespace: int = 0) -> Tuple[int, float]:
+        """
+        查找最相似的条目
+        
+        Returns:
+            (条目位置, 余弦相似度)，索引为空时返回 (-1, 0.0)
+        """
+        if self.size == 0:
+            return -1, 0.0
+        
+        if self.size <= self.exact_search_limit:
+            candidates = None
+            scores = self.vectors[:self.size] @ vector
+        else:
+            signature = self._signature(vector)
+            slots = set()
+            for table, sig in enumerate(signature):
+                slots.update(self._buckets[table].get(int(sig), ()))
+            if not slots:
+                return -1, 0.0
+            candidates = np.fromiter(slots, dtype=np.int64, count=len(slots))
+            scores = self.vectors[candidates] @ vector
+        
+        namespaces = self.namespaces[:self.size] if candidates is None else self.namespaces[candidates]
+        scores = np.where(namespaces == namespace, scores, -1.0)
+        best = int(np.argmax(scores))
+        slot = best if candidates is None else int(candidates[best])
+        return slot, float(scores[best])
+
+@dataclass
+class SemanticMatch:
+    """语义缓存命中结果"""
+    prompt: str
+    response: str
+    score: float
+
+class SemanticCache:
+    """
+    语义响应缓存
+    
+    字面相近的问题可能只差一个数字（如“二十五度”与“二十六度”），相似度仍高于阈值，
+    因此命中前还要求两者包含的数字完全一致。
+    
+    Args:
+        embedder: 向量化实现，默认使用本地 HashingEmbedder
+        threshold: 命中所需的最低余弦相似度
+        max_entries: 最大条目数
+        max_namespaces: 最多保留的命名空间数，超过后淘汰最久未使用的命名空间，
+            其条目不再能被命中，之后逐渐被新条目覆盖
+    """
+    
+    # 阿拉伯数字与中文数字
+    _NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?|[零〇一二两三四五六七八九十百千万亿]+')
+    
+    def __init__(self,
+                 embedder: Optional[Embedder] = None,
+                 threshold: float = 0.9,
+                 max_entries: int = 100_000,
+                 max_namespaces: int = 1024,
+                 **index_kwargs):
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.index = VectorIndex(self.embedder.dim, max_entries=max_entries, **index_kwargs)
+        self._entries: List[Optional[Tuple[str, str]]] = []
+        self.max_namespaces = max_namespaces
+        # 命名空间 -> 编号，按最近使用排列；编号只增不复用，被淘汰命名空间的旧条目不会误命中
+        self._namespaces: "OrderedDict[str, int]" = OrderedDict()
+        self._next_namespace = 1
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self._hit_score_total = 0.0
+    
+    def _namespace_id(self, namespace: str, create: bool = True) -> Optional[int]:
+        namespace_id = self._namespaces.get(namespace)
+        if namespace_id is not None:
+            self._namespaces.move_to_end(namespace)
+            return namespace_id
+        if not create:
+            return None
+        namespace_id = self._next_namespace
+        self._next_namespace += 1
+        self._namespaces[namespace] = namespace_id
+        while len(self._namespaces) > self.max_namespaces:
+            self._namespaces.popitem(last=False)
+        return namespace_id
+    
+    @classmethod
+    def numbers(cls, text: str) -> List[str]:
+        """提取文本中的数字（全角数字先转换为半角）"""
+        return cls._NUMBER_PATTERN.findall(unicodedata.normalize('NFKC', text))
+    
+    def lookup(self, prompt: str, namespace: str = "") -> Optional[SemanticMatch]:
+        """
+        查找语义相近的缓存回复
+        
+        Args:
+            prompt: 用户输入
+            namespace: 命名空间，只在相同命名空间（模型、系统提示词等）内匹配
+        
+        Returns:
+            SemanticMatch: 命中结果，未命中返回None
+        """
+        vector = self.embedder.embed(prompt)
+        with self._lock:
+            namespace_id = self._namespace_id(namespace, create=False)
+            slot, score = (-1, 0.0) if namespace_id is None else self.index.search(vector, namespace_id)
+            if slot < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+            cached_prompt, response = self._entries[slot]
+            if self.numbers(cached_prompt) != self.numbers(prompt):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._hit_score_total += score
+            return SemanticMatch(cached_prompt, response, score)
+    
+    def add(self, prompt: str, response: str, namespace: str = ""):
+        """添加缓存条目"""
+        vector = self.embedder.embed(prompt)
+        with self._lock:
+            slot = self.index.add(vector, self._namespace_id(namespace))
+            if slot == len(self._entries):
+                self._entries.append((prompt, response))
+            else:
+                self._entries[slot] = (prompt, response)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取命中率和平均相似度"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'avg_hit_score': self._hit_score_total / self.hits if self.hits else 0.0,
+                'entries': self.index.size,
+                'namespaces': len(self._namespaces),
+                'threshold': self.threshold
+            }
@@ -0,0 +1,107 @@
+"""
+文本切分工具模块
+"""
+
+from typing import List, Optional
+
+class SentenceSplitter:
+    """
+    流式文本的分句器
+    
+    逐段输入模型输出的增量，遇到句末标点即产出完整的句子，供语音合成边生成边朗读。
+    中文句末标点（。！？；…）和换行立即断句；西文的 . ! ? 后面跟空白才断句，
+    避免切开小数和缩写。紧随其后的重复标点和右引号、右括号归入同一句。
+    
+    Args:
+        min_chars: 句子的最少字符数，更短的片段与下一句合并，避免朗读过于零碎
+        max_chars: 没有句末标点时缓冲的最大字符数，超过后在逗号等处提前断开
+    """
+    
+    TERMINATORS = "。！？；…\n"
+    WESTERN_TERMINATORS = ".!?;"
+    CLOSERS = "”’」』）)】》"
+    SOFT_BREAKS = "，、：,:"
+    
+    def __init__(self, min_chars: int = 2, max_chars: int = 80):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+        # 缓冲中已检查过的位置，下次从这里继续
+        self._pos = 0
+    
+    def feed(self, delta: str) -> List[str]:
+        """
+        输入一段增量文本
+        
+        Args:
+            delta: 新生成的文本
+        
+        Returns:
+            List[str]: 已完整的句子（可能为空）
+        """
+        buffer = self._buffer + delta
+        sentences = []
+        start = 0
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if char in self.WESTERN_TERMINATORS:
+                # 需要看到下一个字符才能判断是否断句
+                if i + 1 == len(buffer):
+                    break
+                if not (buffer[i + 1].isspace() or buffer[i + 1] in self.TERMINATORS + self.CLOSERS):
+                    i += 1
+                    continue
+            elif char not in self.TERMINATORS:
+                i += 1
+                continue
+            
+            end = i + 1
+            while end < len(buffer) and buffer[end] in self.TERMINATORS + self.WESTERN_TERMINATORS + self.CLOSERS:
+                end += 1
+            if end == len(buffer):
+                # 后续增量可能还有标点或右引号
+                break
+            sentence = buffer[start:end].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = end
+            i = end
+        
+        self._buffer = buffer[start:]
+        self._pos = i - start
+        while len(self._buffer) > self.max_chars:
+            sentences.append(self._cut())
+        return sentences
+    
+    def _cut(self) -> str:
+        """在最后一个逗号等处断开过长的缓冲"""
+        window = self._buffer[:self.max_chars]
+        cut = max(window.rfind(mark) for mark in self.SOFT_BREAKS) + 1
+        if cut <= 0:
+            cut = self.max_chars
+        sentence, self._buffer = window[:cut].strip(), self._buffer[cut:]
+        self._pos = 0
+        return sentence
+    
+    def flush(self) -> Optional[str]:
+        """
+        结束输入，返回剩余的文本
+        
+        Returns:
+            Optional[str]: 剩余文本，没有时返回None
+        """
+        rest = self._buffer.strip()
+        self._buffer = ""
+        self._pos = 0
+        return rest or None
+    
+    @classmethod
+    def split(cls, text: str, **kwargs) -> List[str]:
+        """把完整文本切分为句子"""
+        splitter = cls(**kwargs)
+        sentences = splitter.feed(text)
+        rest = splitter.flush()
+        if rest:
+            sentences.append(rest)
+        return sentences
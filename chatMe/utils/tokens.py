@@ -0,0 +1,71 @@
+"""
+Token估算工具模块
+"""
+
+import re
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# CJK统一表意文字、假名、韩文及全角标点，通常每个字符约占一个token
+_CJK_PATTERN = re.compile(
+    r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]'
+)
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数
+    
+    CJK字符按每字1个token计算，其余字符按每4个字符1个token计算。
+    
+    Args:
+        text: 输入文本
+    
+    Returns:
+        int: 估算的token数
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+# 每条消息在对话格式中的额外开销（角色、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: Optional[str]):
+    """获取模型对应的tiktoken编码，不可用时返回None"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+    except KeyError:
+        return _get_encoding(None) if model else None
+    except Exception:
+        # 编码文件无法加载（如离线环境）时退回到估算
+        return None
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    计算文本的token数
+    
+    安装了 tiktoken 时精确计数，否则使用 estimate_tokens 估算。
+    
+    Args:
+        text: 输入文本
+        model: 模型名称，用于选择编码
+    
+    Returns:
+        int: token数
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text))
@@ -0,0 +1,551 @@
+"""
+语音活动检测模块
+
+按固定长度的帧处理音频：用向量化的短时能量和过零率判断每帧是否为语音，再由
+UtteranceSegmenter 根据连续的语音/静音帧确定一句话的起止。尾部静音达到设定
+时长的那一帧即产出结束事件，不必等待 speech_recognition 固定的 pause_threshold。
+
+帧来源可以是麦克风（MicrophoneFrameSource），也可以是WAV文件（WavFrameSource），
+后者用于测试和离线处理。
+"""
+
+import time
+import wave
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+import numpy as np
+import pyaudio
+from ..exceptions import AudioDeviceError
+
+def frame_features(frames: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算帧的短时能量和过零率
+    
+    Args:
+        frames: int16 采样，形状为 (帧数, 每帧采样数) 或单帧 (每帧采样数,)
+    
+    Returns:
+        (rms, zcr): 每帧的均方根能量和过零率（0~1）
+    """
+    frames = np.atleast_2d(frames)
+    samples = frames.astype(np.float32)
+    rms = np.sqrt(np.mean(samples * samples, axis=1))
+    signs = np.signbit(frames)
+    crossings = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1)
+    zcr = crossings / max(frames.shape[1] - 1, 1)
+    return rms, zcr
+
+class EnergyVAD:
+    """
+    基于能量和过零率的语音活动检测
+    
+    能量不低于 threshold 的帧判为语音；能量介于 threshold * weak_ratio 和
+    threshold 之间、过零率不低于 zcr_threshold 的帧（清辅音等弱起始音）也判为语音。
+    
+    Args:
+        threshold: 能量阈值，单位与 speech_recognition 的 energy_threshold 相同（16位采样的RMS）
+        zcr_threshold: 弱能量帧判为语音所需的过零率
+        weak_ratio: 弱能量帧的能量下限相对 threshold 的比例
+    """
+    
+    def __init__(self, threshold: float = 300.0, zcr_threshold: float = 0.25, weak_ratio: float = 0.5):
+        self.threshold = threshold
+        self.zcr_threshold = zcr_threshold
+        self.weak_ratio = weak_ratio
+    
+    def classify(self, frames: np.ndarray) -> np.ndarray:
+        """
+        判断每帧是否为语音
+        
+        Args:
+            frames: int16 采样，形状为 (帧数, 每帧采样数) 或单帧
+        
+        Returns:
+            np.ndarray: 每帧一个布尔值
+        """
+        rms, zcr = frame_features(frames)
+        weak = (rms >= self.threshold * self.weak_ratio) & (zcr >= self.zcr_threshold)
+        return (rms >= self.threshold) | weak
+    
+    def is_speech(self, frame: np.ndarray) -> bool:
+        """判断单帧是否为语音"""
+        return bool(self.classify(frame)[0])
+    
+    def calibrate(self, frames: np.ndarray, ratio: float = 3.0, minimum: float = 50.0) -> float:
+        """
+        根据环境噪音设置能量阈值
+        
+        Args:
+            frames: 只含环境噪音的帧
+            ratio: 阈值相对噪音能量的倍数
+            minimum: 阈值下限
+        
+        Returns:
+            float: 新的能量阈值
+        """
+        rms, _ = frame_features(frames)
+        self.threshold = max(float(np.percentile(rms, 90)) * ratio, minimum)
+        return self.threshold
+
+class NoiseFloorEstimator:
+    """
+    后台噪音基底估计
+    
+    作为 CaptureStream 的监听器在录音线程中逐帧更新，不占用监听路径：
+    VAD 判为非语音的帧按 EWMA 跟踪噪音能量，每帧把新阈值写入 vad.threshold。
+    另外保存最近 window_frames 帧的能量，每满一个窗口取其低分位数；若连窗口中
+    较安静的部分都不低于当前阈值（噪音突然变大，所有帧都被判为语音），
+    就把噪音基底直接提升到该分位数，避免阈值卡死。
+    
+    第一个窗口填满前不修改阈值，VAD 使用配置的初始阈值。
+    
+    Args:
+        vad: 接收阈值的 EnergyVAD
+        alpha: EWMA 平滑系数
+        ratio: 阈值相对噪音基底的倍数
+        minimum: 阈值下限
+        window_frames: 分位数统计的帧数
+        percentile: 分位数（0~100）
+    """
+    
+    def __init__(self, vad: Optional[EnergyVAD] = None, alpha: float = 0.05, ratio: float = 3.0,
+                 minimum: float = 50.0, window_frames: int = 100, percentile: float = 20.0):
+        self.vad = vad
+        self.alpha = alpha
+        self.ratio = ratio
+        self.minimum = minimum
+        self.percentile = percentile
+        self._history = np.zeros(window_frames, dtype=np.float32)
+        self._count = 0
+        self.noise_floor: Optional[float] = None
+        self.noise_frames = 0
+    
+    @property
+    def threshold(self) -> Optional[float]:
+        """当前估计的能量阈值，尚未估计时为None"""
+        if self.noise_floor is None:
+            return None
+        return max(self.noise_floor * self.ratio, self.minimum)
+    
+    def update(self, frame: np.ndarray) -> Optional[float]:
+        """
+        用一帧音频更新估计
+        
+        Args:
+            frame: 单帧 int16 采样
+        
+        Returns:
+            Optional[float]: 更新后的能量阈值
+        """
+        rms = float(frame_features(frame)[0][0])
+        window = len(self._history)
+        self._history[self._count % window] = rms
+        self._count += 1
+        
+        if self.noise_floor is not None and rms < self.threshold:
+            self.noise_floor += self.alpha * (rms - self.noise_floor)
+            self.noise_frames += 1
+        if self._count % window == 0:
+            low = float(np.percentile(self._history, self.percentile))
+            if self.noise_floor is None or low >= self.threshold:
+                self.noise_floor = low
+        
+        threshold = self.threshold
+        if threshold is not None and self.vad is not None:
+            self.vad.threshold = threshold
+        return threshold
+    
+    def seed(self, frames: np.ndarray) -> Optional[float]:
+        """
+        用一段环境音立即设置噪音基底
+        
+        Args:
+            frames: 形状为 (帧数, 每帧采样数) 的环境音
+        
+        Returns:
+            Optional[float]: 新的能量阈值，frames 为空时不修改并返回当前阈值
+        """
+        if len(frames):
+            rms, _ = frame_features(frames)
+            self.noise_floor = float(np.percentile(rms, self.percentile))
+            if self.vad is not None:
+                self.vad.threshold = self.threshold
+        return self.threshold
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取噪音估计统计"""
+        return {
+            'noise_floor': self.noise_floor,
+            'threshold': self.threshold,
+            'frames': self._count,
+            'noise_frames': self.noise_frames
+        }
+
+class PlaybackGate:
+    """
+    朗读期间的语音活动检测
+    
+    助手边朗读边录音时，麦克风会录到扬声器的声音。朗读期间（以及结束后的
+    hold_frames 帧回声余响内）只有能量同时达到 vad.threshold * barge_in_ratio
+    和回声电平 * echo_margin 的帧才判为语音，用户需要比朗读声更大声才能打断；
+    其余时间与 vad 的判断相同。回声电平按 EWMA 跟踪朗读期间各帧的能量。
+    
+    接口与 EnergyVAD 相同，可直接传给 UtteranceSegmenter。
+    
+    Args:
+        vad: 被包装的 EnergyVAD
+        is_playing: 返回当前是否正在朗读的函数
+        barge_in_ratio: 朗读期间阈值相对 vad.threshold 的倍数
+        echo_margin: 朗读期间阈值相对回声电平的倍数
+        alpha: 回声电平的 EWMA 平滑系数
+        hold_frames: 朗读结束后继续提高阈值的帧数
+    """
+    
+    def __init__(self, vad: EnergyVAD, is_playing: Callable[[], bool], barge_in_ratio: float = 3.0,
+                 echo_margin: float = 2.0, alpha: float = 0.1, hold_frames: int = 10):
+        self.vad = vad
+        self.is_playing = is_playing
+        self.barge_in_ratio = barge_in_ratio
+        self.echo_margin = echo_margin
+        self.alpha = alpha
+        self.hold_frames = hold_frames
+        self.echo_level: Optional[float] = None
+        self._since_playback = hold_frames
+    
+    @property
+    def threshold(self) -> float:
+        return self.vad.threshold
+    
+    @property
+    def barge_in_threshold(self) -> float:
+        """朗读期间判为语音所需的能量"""
+        threshold = self.vad.threshold * self.barge_in_ratio
+        if self.echo_level is not None:
+            threshold = max(threshold, self.echo_level * self.echo_margin)
+        return threshold
+    
+    def classify(self, frames: np.ndarray) -> np.ndarray:
+        """
+        判断每帧是否为语音
+        
+        Args:
+            frames: int16 采样，形状为 (帧数, 每帧采样数) 或单帧
+        
+        Returns:
+            np.ndarray: 每帧一个布尔值
+        """
+        if self.is_playing():
+            self._since_playback = 0
+            rms, _ = frame_features(frames)
+            if self.echo_level is None:
+                self.echo_level = float(rms[0])
+            # 阈值取更新回声电平之前的值，用户开口的帧不计入回声电平
+            speech = rms >= self.barge_in_threshold
+            for level in rms[~speech]:
+                self.echo_level += self.alpha * (float(level) - self.echo_level)
+            return speech
+        if self._since_playback < self.hold_frames:
+            self._since_playback += len(np.atleast_2d(frames))
+            rms, _ = frame_features(frames)
+            return rms >= self.barge_in_threshold
+        return self.vad.classify(frames)
+    
+    def is_speech(self, frame: np.ndarray) -> bool:
+        """判断单帧是否为语音"""
+        return bool(self.classify(frame)[0])
+
+class VADEventType(Enum):
+    """分句事件类型"""
+    START = "start"
+    SPEECH = "speech"
+    END = "end"
+
+@dataclass
+class Utterance:
+    """检测到的一句话，start_frame/end_frame 为分句器计数的帧序号（含预录音）"""
+    audio: np.ndarray
+    sample_rate: int
+    start: float
+    end: float
+    start_frame: int = 0
+    end_frame: int = 0
+    
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+@dataclass
+class VADEvent:
+    """
+    分句事件
+    
+    START 的 audio 为预录音加起始帧，SPEECH 为说话期间的每一帧，END 为整句音频，
+    同时带有 utterance。分句器不保留音频时，START 和 END 的 audio 为None。
+    time 为事件对应的音频时间（秒）。
+    """
+    type: VADEventType
+    audio: Optional[np.ndarray]
+    time: float
+    utterance: Optional[Utterance] = None
+
+class UtteranceSegmenter:
+    """
+    按帧确定一句话的起止
+    
+    连续 start_ms 的语音帧判定为开始说话，连续 end_silence_ms 的静音帧判定为说完。
+    开始前 pre_roll_ms 的音频会并入这句话，避免截掉起始的弱音。
+    
+    Args:
+        vad: 语音活动检测器
+        sample_rate: 采样率
+        frame_samples: 每帧采样数
+        start_ms: 判定开始说话所需的连续语音时长（毫秒）
+        end_silence_ms: 判定说完所需的连续静音时长（毫秒）
+        pre_roll_ms: 并入句首的预录音时长（毫秒）
+        max_utterance_ms: 一句话的最长时长（毫秒），超过后强制结束，None表示不限
+        keep_audio: 是否保留帧并拼接出整句音频；帧来自 RingBuffer 时可以设为False，
+            由调用方根据帧序号直接取环形缓冲区的视图
+    """
+    
+    def __init__(self,
+                 vad: EnergyVAD,
+                 sample_rate: int = 16000,
+                 frame_samples: int = 320,
+                 start_ms: float = 60,
+                 end_silence_ms: float = 300,
+                 pre_roll_ms: float = 200,
+                 max_utterance_ms: Optional[float] = None,
+                 keep_audio: bool = True):
+        self.vad = vad
+        self.keep_audio = keep_audio
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+        self.frame_duration = frame_samples / sample_rate
+        frame_ms = self.frame_duration * 1000
+        self.start_frames = max(1, round(start_ms / frame_ms))
+        self.end_frames = max(1, round(end_silence_ms / frame_ms))
+        self.max_frames = round(max_utterance_ms / frame_ms) if max_utterance_ms else None
+        self.pending_frames = round(pre_roll_ms / frame_ms) + self.start_frames
+        self._pending: deque = deque(maxlen=self.pending_frames)
+        self.reset()
+    
+    def reset(self):
+        """丢弃当前状态，重新开始检测"""
+        self._pending.clear()
+        self._pending_count = 0
+        self._frames: List[np.ndarray] = []
+        self._speech_run = 0
+        self._silence_run = 0
+        self._frame_index = 0
+        self._start_index = 0
+        self.in_speech = False
+    
+    def feed(self, frame: np.ndarray) -> List[VADEvent]:
+        """
+        处理一帧音频
+        
+        Args:
+            frame: int16 采样
+        
+        Returns:
+            List[VADEvent]: 本帧产生的事件（可能为空）
+        """
+        speech = self.vad.is_speech(frame)
+        self._frame_index += 1
+        now = self._frame_index * self.frame_duration
+        
+        if not self.in_speech:
+            if self.keep_audio:
+                self._pending.append(frame)
+            self._pending_count = min(self._pending_count + 1, self.pending_frames)
+            self._speech_run = self._speech_run + 1 if speech else 0
+            if self._speech_run < self.start_frames:
+                return []
+            self.in_speech = True
+            self._start_index = self._frame_index - self._pending_count
+            self._pending_count = 0
+            self._silence_run = 0
+            audio = None
+            if self.keep_audio:
+                self._frames = list(self._pending)
+                self._pending.clear()
+                audio = np.concatenate(self._frames)
+            return [VADEvent(VADEventType.START, audio, now)]
+        
+        if self.keep_audio:
+            self._frames.append(frame)
+        events = [VADEvent(VADEventType.SPEECH, frame, now)]
+        self._silence_run = 0 if speech else self._silence_run + 1
+        if self._silence_run >= self.end_frames or (
+                self.max_frames is not None and self._frame_index - self._start_index >= self.max_frames):
+            events.append(self._finish())
+        return events
+    
+    def _finish(self) -> VADEvent:
+        """结束当前这句话"""
+        audio = np.concatenate(self._frames) if self.keep_audio else None
+        now = self._frame_index * self.frame_duration
+        utterance = Utterance(audio, self.sample_rate, self._start_index * self.frame_duration, now,
+                              self._start_index, self._frame_index)
+        self._frames = []
+        self._speech_run = 0
+        self._silence_run = 0
+        self.in_speech = False
+        return VADEvent(VADEventType.END, audio, now, utterance)
+    
+    @property
+    def utterance_frames(self) -> int:
+        """当前这句话已有的帧数（含预录音），不在说话时为0"""
+        return self._frame_index - self._start_index if self.in_speech else 0
+    
+    def flush(self) -> Optional[Utterance]:
+        """音频结束时结束未完成的句子"""
+        if not self.in_speech:
+            return None
+        return self._finish().utterance
+    
+    def events(self, frames: Iterable[np.ndarray], timeout: Optional[float] = None) -> Iterator[VADEvent]:
+        """
+        逐帧产出事件，直到下一句话结束
+        
+        Args:
+            frames: 帧迭代器
+            timeout: 等待开始说话的最长时间（秒），None表示一直等待
+        
+        Yields:
+            VADEvent: START、SPEECH 事件，最后是 END；超时或帧流结束前没有开始说话时
+            不产出任何事件，说话中帧流结束时以 END 结束未完成的句子
+        """
+        waited = 0.0
+        for frame in frames:
+            for event in self.feed(frame):
+                yield event
+                if event.type is VADEventType.END:
+                    return
+            if not self.in_speech:
+                waited += self.frame_duration
+                if timeout is not None and waited >= timeout:
+                    return
+        if self.in_speech:
+            yield self._finish()
+    
+    def next_utterance(self, frames: Iterable[np.ndarray], timeout: Optional[float] = None) -> Optional[Utterance]:
+        """
+        从帧流中读取下一句话
+        
+        Args:
+            frames: 帧迭代器
+            timeout: 等待开始说话的最长时间（秒），None表示一直等待
+        
+        Returns:
+            Optional[Utterance]: 下一句话，超时或帧流结束时返回None
+        """
+        for event in self.events(frames, timeout):
+            if event.type is VADEventType.END:
+                return event.utterance
+        return None
+    
+    def segment(self, frames: Iterable[np.ndarray]) -> Iterator[Utterance]:
+        """把帧流切分为句子"""
+        for frame in frames:
+            for event in self.feed(frame):
+                if event.type is VADEventType.END:
+                    yield event.utterance
+        utterance = self.flush()
+        if utterance is not None:
+            yield utterance
+
+class WavFrameSource:
+    """
+    从WAV文件读取音频帧，可代替麦克风
+    
+    Args:
+        path: 16位PCM的WAV文件，多声道时取第一个声道
+        frame_ms: 帧长（毫秒）
+        realtime: 是否按实际时长放慢读取速度
+    """
+    
+    def __init__(self, path: str, frame_ms: int = 20, realtime: bool = False):
+        self.path = path
+        self.realtime = realtime
+        with wave.open(path, 'rb') as wf:
+            if wf.getsampwidth() != 2:
+                raise AudioDeviceError(f"只支持16位PCM的WAV文件: {path}")
+            self.sample_rate = wf.getframerate()
+            self.channels = wf.getnchannels()
+        self.frame_samples = self.sample_rate * frame_ms // 1000
+    
+    def __enter__(self) -> "WavFrameSource":
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+    
+    def __iter__(self) -> Iterator[np.ndarray]:
+        frame_duration = self.frame_samples / self.sample_rate
+        with wave.open(self.path, 'rb') as wf:
+            while True:
+                data = wf.readframes(self.frame_samples)
+                if not data:
+                    return
+                frame = np.frombuffer(data, dtype=np.int16)[::self.channels]
+                if len(frame) < self.frame_samples:
+                    frame = np.pad(frame, (0, self.frame_samples - len(frame)))
+                if self.realtime:
+                    time.sleep(frame_duration)
+                yield frame
+
+class MicrophoneFrameSource:
+    """
+    从麦克风读取音频帧
+    
+    作为上下文管理器使用，进入时打开输入流，退出时关闭。
+    
+    Args:
+        sample_rate: 采样率
+        frame_ms: 帧长（毫秒）
+        device_index: 输入设备序号，None表示默认设备
+    """
+    
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 20, device_index: Optional[int] = None):
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.device_index = device_index
+        self.logger = logging.getLogger(__name__)
+        self._pyaudio = None
+        self._stream = None
+    
+    def __enter__(self) -> "MicrophoneFrameSource":
+        try:
+            self._pyaudio = pyaudio.PyAudio()
+            self._stream = self._pyaudio.open(
+                format=pyaudio.paInt16,
+                channels=1,
+                rate=self.sample_rate,
+                input=True,
+                frames_per_buffer=self.frame_samples,
+                input_device_index=self.device_index
+            )
+        except Exception as e:
+            self.__exit__(None, None, None)
+            raise AudioDeviceError(f"打开麦克风失败: {str(e)}")
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pyaudio is not None:
+            self._pyaudio.terminate()
+            self._pyaudio = None
+    
+    def __iter__(self) -> Iterator[np.ndarray]:
+        if self._stream is None:
+            raise AudioDeviceError("麦克风未打开")
+        while self._stream is not None:
+            data = self._stream.read(self.frame_samples, exception_on_overflow=False)
+            yield np.frombuffer(data, dtype=np.int16)
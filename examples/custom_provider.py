@@ -16,6 +16,7 @@ class CustomProvider(AIProvider):
         response = self.model.generate(prompt)
         return response
         
-    def validate_config(self, config: Dict[str, Any]) -> bool:
+    @classmethod
+    def validate_config(cls, config: Dict[str, Any]) -> bool:
         settings = config.get('settings', {})
         return 'model_path' in settings 
\ No newline at end of file
@@ -0,0 +1,316 @@
+"""
+响应缓存测试
+"""
+
+import fnmatch
+import os
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from chatMe.core.caching import CachedProvider, SemanticCachedProvider
+from chatMe.core.providers import AIProvider
+from chatMe.utils.cache import ResponseCache, MemoryBackend, RedisBackend
+from chatMe.utils.disk_cache import DiskCache
+from chatMe.utils.semantic_cache import SemanticCache
+
+class CountingProvider(AIProvider):
+    def __init__(self, model: str = "test-model", **kwargs):
+        self.model = model
+        self.kwargs = kwargs
+        self.calls = 0
+    
+    def generate_response(self, prompt: str, **kwargs):
+        self.calls += 1
+        return f"reply {self.calls}: {prompt}"
+    
+    @classmethod
+    def validate_config(cls, config):
+        return True
+
+def test_response_cache_promotion():
+    """测试短期缓存晋升到长期缓存"""
+    cache = ResponseCache(promote_after=2)
+    cache.set("k", "v")
+    
+    assert cache.get("k") == "v"
+    assert "k" in cache.short_term
+    assert cache.get("k") == "v"
+    assert "k" in cache.long_term and "k" not in cache.short_term
+    
+    stats = cache.get_stats()
+    assert stats['hits'] == 2
+    assert stats['promotions'] == 1
+
+def test_response_cache_eviction_counter():
+    """测试淘汰计数"""
+    cache = ResponseCache(short_term_size=2)
+    for i in range(5):
+        cache.set(str(i), "v")
+    
+    assert cache.get("0") is None
+    assert cache.get_stats()['evictions'] == 3
+    assert cache.get_stats()['misses'] == 1
+
+def test_cached_provider_hits():
+    """测试重复请求不再调用上游"""
+    upstream = CountingProvider()
+    provider = CachedProvider(upstream)
+    
+    first = provider.generate_response("你好")
+    assert provider.generate_response("你好") == first
+    assert list(provider.stream_response("你好")) == [first]
+    assert upstream.calls == 1
+    
+    provider.generate_response("再见")
+    stats = provider.get_stats()
+    assert (stats['hits'], stats['misses']) == (2, 2)
+
+@pytest.mark.parametrize("kwargs", [
+    {"temperature": 0.1},
+    {"system_prompt": "你是一个翻译"},
+    {"history": [{"role": "user", "content": "上一句"}]},
+])
+def test_cached_provider_key_dimensions(kwargs):
+    """测试缓存键区分温度、系统提示词和历史"""
+    upstream = CountingProvider(temperature=0.7)
+    provider = CachedProvider(upstream)
+    
+    provider.generate_response("你好")
+    provider.generate_response("你好", **kwargs)
+    assert upstream.calls == 2
+
+def test_cached_provider_model_dimension():
+    """测试不同模型不共享缓存"""
+    cache = ResponseCache()
+    CachedProvider(CountingProvider(model="a"), cache).generate_response("你好")
+    other = CountingProvider(model="b")
+    CachedProvider(other, cache).generate_response("你好")
+    assert other.calls == 1
+
+def test_disk_cache_survives_restart(temp_dir):
+    """测试磁盘缓存在重新打开后仍可命中"""
+    cache = DiskCache(temp_dir)
+    cache.set("greeting", "你好！")
+    cache.close()
+    
+    reopened = DiskCache(temp_dir)
+    assert reopened.get("greeting") == "你好！"
+    assert reopened.get("missing") is None
+
+def test_disk_cache_rebuilds_index(temp_dir):
+    """测试索引丢失或日志尾部损坏时的恢复"""
+    cache = DiskCache(temp_dir)
+    for i in range(100):
+        cache.set(f"k{i}", f"v{i}")
+    cache.close()
+    
+    os.unlink(os.path.join(temp_dir, "index.bin"))
+    with open(os.path.join(temp_dir, "values.log"), 'ab') as f:
+        f.write(b"\x00torn")
+    
+    reopened = DiskCache(temp_dir)
+    assert len(reopened) == 100
+    assert reopened.get("k42") == "v42"
+
+def test_disk_cache_size_bound(temp_dir):
+    """测试超过容量上限后压缩并淘汰最旧的记录"""
+    cache = DiskCache(temp_dir, max_bytes=20_000)
+    for i in range(1000):
+        cache.set(f"k{i}", "x" * 50)
+    
+    stats = cache.get_stats()
+    assert stats['size_bytes'] <= 20_000
+    assert stats['compactions'] > 0
+    assert cache.get("k999") is not None
+    assert cache.get("k0") is None
+
+def test_disk_cache_shared_between_instances(temp_dir):
+    """测试两个实例（模拟两个进程）共用目录时压缩和扩容互不覆盖"""
+    first = DiskCache(temp_dir, initial_capacity=8)
+    second = DiskCache(temp_dir, initial_capacity=8)
+    first.set("a", "1")
+    second.set("b", "2")
+    first.compact()
+    # 另一实例压缩后仍能读到并继续写入
+    assert second.get("a") == "1"
+    for i in range(20):
+        second.set(f"k{i}", str(i))
+    second.compact()
+    
+    assert first.get("b") == "2" and first.get("k19") == "19"
+    first.set("c", "3")
+    assert second.get("c") == "3"
+    assert len(first) == len(second) == 23
+    
+    second.clear()
+    assert first.get("a") is None
+
+def test_response_cache_backend_tier(temp_dir):
+    """测试重启后从持久化后端命中"""
+    ResponseCache(backend=DiskCache(temp_dir)).set("k", "v")
+    
+    cache = ResponseCache(backend=DiskCache(temp_dir))
+    assert cache.get("k") == "v"
+    assert cache.get_stats()['backend_hits'] == 1
+
+class FakeRedis:
+    """最小化的Redis客户端替身，覆盖RedisBackend用到的命令"""
+    
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+    
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value if isinstance(value, bytes) else value.encode()
+            return True
+    
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+    
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+    
+    def eval(self, script, numkeys, key, token):
+        with self.lock:
+            if self.data.get(key) == token.encode():
+                del self.data[key]
+                return 1
+            return 0
+    
+    def pipeline(self, transaction=True):
+        client = self
+        
+        class Pipeline:
+            def __init__(self):
+                self.ops = []
+            
+            def get(self, key):
+                self.ops.append(lambda: client.get(key))
+            
+            def set(self, key, value, px=None):
+                self.ops.append(lambda: client.set(key, value, px=px))
+            
+            def execute(self):
+                return [op() for op in self.ops]
+        
+        return Pipeline()
+
+def test_redis_backend_pipeline_and_compression():
+    """测试批量读写与压缩"""
+    client = FakeRedis()
+    backend = RedisBackend(client=client, compress_threshold=64)
+    backend.set_many({"short": "hi", "long": "很长的回复" * 50})
+    
+    assert client.data["chatme:short"].startswith(b"r")
+    assert client.data["chatme:long"].startswith(b"z")
+    assert backend.get_many(["short", "long", "missing"]) == ["hi", "很长的回复" * 50, None]
+
+def test_redis_backend_single_flight():
+    """测试多个节点同时请求同一个键时只调用一次上游"""
+    client = FakeRedis()
+    nodes = [RedisBackend(client=client, poll_interval=0.01) for _ in range(4)]
+    calls = []
+    
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return "早上好！"
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(nodes[i % 4].single_flight, "k", compute) for i in range(8)]
+        results = [f.result() for f in futures]
+    
+    assert results == ["早上好！"] * 8
+    assert len(calls) == 1
+    assert not any(key.startswith("chatme:lock:") for key in client.data)
+
+def test_cached_provider_with_shared_backend():
+    """测试多个进程内缓存共享同一个后端"""
+    backend = MemoryBackend()
+    upstream = CountingProvider()
+    first = CachedProvider(upstream, ResponseCache(backend=backend))
+    second = CachedProvider(upstream, ResponseCache(backend=backend))
+    
+    assert first.generate_response("你好") == second.generate_response("你好")
+    assert upstream.calls == 1
+
+def test_semantic_cache_paraphrase():
+    """测试同一问题的不同问法命中语义缓存"""
+    upstream = CountingProvider()
+    provider = SemanticCachedProvider(upstream)
+    
+    answer = provider.generate_response("今天天气怎么样")
+    assert provider.generate_response("今天天气如何？") == answer
+    assert upstream.calls == 1
+    
+    provider.generate_response("今天天气怎么样", system_prompt="你是一个翻译")
+    assert upstream.calls == 2
+    
+    stats = provider.get_stats()
+    assert stats['hits'] == 1
+    assert stats['avg_hit_score'] >= stats['threshold']
+
+def test_semantic_cache_namespaces_follow_recent_context_and_are_bounded():
+    """测试命名空间只区分上一轮问答，依赖上文的追问不会命中其他对话，命名空间数量有上限"""
+    upstream = CountingProvider()
+    cache = SemanticCache(max_namespaces=2)
+    provider = SemanticCachedProvider(upstream, cache)
+    
+    beijing = [{"role": "user", "content": "北京天气怎么样"}, {"role": "assistant", "content": "晴"}]
+    answer = provider.generate_response("那明天呢", history=beijing)
+    # 更早的历史不同，上一轮问答相同时仍然命中
+    earlier = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好！"}]
+    assert provider.generate_response("那明天呢？", history=earlier + beijing) == answer
+    assert upstream.calls == 1
+    
+    shanghai = [{"role": "user", "content": "上海天气怎么样"}, {"role": "assistant", "content": "雨"}]
+    provider.generate_response("那明天呢", history=shanghai)
+    assert upstream.calls == 2
+    
+    for prompt in ["甲", "乙"]:
+        provider.generate_response("今天天气怎么样", system_prompt=prompt)
+    assert cache.get_stats()['namespaces'] == 2
+    # 最早的命名空间已被淘汰
+    provider.generate_response("那明天呢", history=beijing)
+    assert upstream.calls == 5
+
+def test_semantic_cache_threshold():
+    """测试相似度低于阈值时不命中"""
+    cache = SemanticCache(threshold=0.9)
+    cache.add("今天天气怎么样", "晴天")
+    
+    assert cache.lookup("明天天气怎么样") is None
+    match = cache.lookup("今天天气怎样呢")
+    assert match.response == "晴天"
+    assert match.score > 0.9
+
+def test_semantic_cache_requires_same_numbers():
+    """测试只差数字的问题不命中"""
+    cache = SemanticCache(threshold=0.9)
+    cache.add("今天气温二十六度吗", "是的")
+    cache.add("明天3点开会吗", "是的")
+    
+    assert cache.lookup("今天气温二十五度吗") is None
+    assert cache.lookup("明天4点开会吗") is None
+    assert cache.lookup("明天３点开会吗？").response == "是的"
+
+def test_semantic_cache_lsh_and_eviction():
+    """测试LSH分桶查询与容量淘汰"""
+    cache = SemanticCache(max_entries=200, exact_search_limit=50)
+    for i in range(300):
+        cache.add(f"第{i}个问题是什么", f"回答{i}")
+    
+    assert cache.index.size == 200
+    assert cache.lookup("第250个问题是什么").response == "回答250"
+    match = cache.lookup("第50个问题是什么")
+    assert match is None or match.response != "回答50"
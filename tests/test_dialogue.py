@@ -22,4 +22,266 @@ def test_add_message():
 def test_invalid_session():
     manager = DialogueManager()
     with pytest.raises(ValueError):
-        manager.get_context("invalid_session") 
\ No newline at end of file
+        manager.get_context("invalid_session") 
+    
+def test_build_context_token_budget():
+    manager = DialogueManager(token_counter=len)
+    session_id = manager.create_session("user123")
+    for i in range(10):
+        manager.add_message(session_id, "user", "x" * 10 + str(i))
+    
+    # 每条消息 11 + 4 个token，系统提示词 6 + 4 个token
+    context = manager.build_context(session_id, max_tokens=55, system_prompt="system")
+    
+    assert context[0] == {"role": "system", "content": "system"}
+    assert [m["content"][-1] for m in context[1:]] == ["7", "8", "9"]
+    
+def test_build_context_counts_each_message_once():
+    calls = []
+    def counter(text):
+        calls.append(text)
+        return len(text)
+    
+    manager = DialogueManager(token_counter=counter)
+    session_id = manager.create_session("user123")
+    for i in range(100):
+        manager.add_message(session_id, "user", f"message {i}")
+        manager.build_context(session_id, max_tokens=200, system_prompt="system")
+    
+    assert len(calls) == 101
+    assert manager.build_context(session_id, max_tokens=0) == []
+    
+class SummaryProvider:
+    def __init__(self):
+        self.prompts = []
+    
+    def generate_response(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return f"summary{len(self.prompts)}"
+    
+def test_rolling_summary_bounds_context():
+    from chatMe.core.summarizer import DialogueSummarizer
+    provider = SummaryProvider()
+    summarizer = DialogueSummarizer(provider, keep_recent=4, trigger_tokens=60)
+    manager = DialogueManager(token_counter=len, summarizer=summarizer)
+    session_id = manager.create_session("user123")
+    
+    sizes = []
+    for i in range(40):
+        manager.add_message(session_id, "user" if i % 2 == 0 else "assistant", f"turn {i:02d}")
+        summarizer.join()
+        sizes.append(len(manager.build_context(session_id, max_tokens=10_000, system_prompt="system")))
+    
+    context = manager.get_context(session_id)
+    assert context.summary == f"summary{len(provider.prompts)}"
+    assert len(provider.prompts) > 1
+    # 后续摘要在已有摘要的基础上滚动合并
+    assert "已有摘要：summary1" in provider.prompts[1]
+    assert max(sizes[20:]) <= 2 + 4 + 6
+    assert len(manager.get_history(session_id)) == 40
+    summarizer.close()
+    
+def test_sqlite_store_resume(temp_dir):
+    from chatMe.core.session_store import SQLiteSessionStore
+    path = f"{temp_dir}/sessions.db"
+    manager = DialogueManager(store=SQLiteSessionStore(path, flush_interval=0))
+    session_id = manager.create_session("user123")
+    for i in range(5):
+        manager.add_message(session_id, "user", f"m{i}")
+    manager.set_summary(session_id, "摘要", 0, 2)
+    manager.close()
+    
+    # 新的工作进程从同一个数据库恢复会话
+    resumed = DialogueManager(store=SQLiteSessionStore(path, flush_interval=0))
+    assert [m["content"] for m in resumed.get_history(session_id, limit=2)] == ["m3", "m4"]
+    assert session_id not in resumed.contexts
+    
+    resumed.add_message(session_id, "assistant", "m5")
+    context = resumed.get_context(session_id)
+    assert context.summary == "摘要"
+    assert [m["content"] for m in resumed.build_context(session_id, max_tokens=1000)][-4:] == ["m2", "m3", "m4", "m5"]
+    resumed.close()
+    
+def test_sqlite_store_batches_appends(temp_dir):
+    import sqlite3
+    from chatMe.core.session_store import SQLiteSessionStore, SessionRecord
+    path = f"{temp_dir}/sessions.db"
+    store = SQLiteSessionStore(path, batch_size=3, flush_interval=0)
+    store.create_session(SessionRecord("s1", "u1", 0.0))
+    reader = sqlite3.connect(path)
+    count = lambda: reader.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    
+    store.append_messages("s1", [{"role": "user", "content": "a"}, {"role": "user", "content": "b"}])
+    assert count() == 0
+    store.append_messages("s1", [{"role": "user", "content": "c"}])
+    assert count() == 3
+    store.close()
+    
+def test_session_store_ttl_eviction(temp_dir):
+    import time
+    from chatMe.core.session_store import MemorySessionStore, SQLiteSessionStore, SessionRecord
+    for store in (MemorySessionStore(ttl=0.05), SQLiteSessionStore(f"{temp_dir}/s.db", ttl=0.05, flush_interval=0)):
+        store.create_session(SessionRecord("old", "u1", 0.0))
+        time.sleep(0.1)
+        store.create_session(SessionRecord("new", "u1", 0.0))
+        
+        assert store.evict_expired() == 1
+        assert store.load_session("old") is None
+        assert store.load_session("new") is not None
+        store.close()
+    
+def test_sqlite_store_workers_append_to_same_session(temp_dir):
+    from chatMe.core.session_store import SQLiteSessionStore, SessionRecord
+    path = f"{temp_dir}/sessions.db"
+    first = SQLiteSessionStore(path, flush_interval=0)
+    second = SQLiteSessionStore(path, flush_interval=0)
+    first.create_session(SessionRecord("s1", "u1", 0.0))
+    
+    # 两个工作进程交替向同一会话追加消息，序号在写入时分配，不会互相覆盖
+    first.append_messages("s1", [{"role": "user", "content": "a"}])
+    second.append_messages("s1", [{"role": "user", "content": "b"}])
+    second.flush()
+    first.flush()
+    first.append_messages("s1", [{"role": "user", "content": "c"}])
+    first.flush()
+    
+    assert [m["content"] for m in second.get_messages("s1")] == ["b", "a", "c"]
+    first.close()
+    second.close()
+    
+def test_sqlite_store_keeps_pending_when_database_locked(temp_dir):
+    import sqlite3
+    from chatMe.exceptions import DialogueError
+    from chatMe.core.session_store import SQLiteSessionStore, SessionRecord
+    path = f"{temp_dir}/sessions.db"
+    store = SQLiteSessionStore(path, flush_interval=0, busy_timeout=0)
+    store.create_session(SessionRecord("s1", "u1", 0.0))
+    store.append_messages("s1", [{"role": "user", "content": "a"}])
+    
+    # 另一个进程持有写锁时 BEGIN IMMEDIATE 失败，缓冲的消息必须保留
+    blocker = sqlite3.connect(path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    with pytest.raises(DialogueError):
+        store.flush()
+    with pytest.raises(DialogueError):
+        store.delete_session("s1")
+    blocker.execute("ROLLBACK")
+    blocker.close()
+    
+    assert [m["content"] for m in store.get_messages("s1")] == ["a"]
+    store.delete_session("s1")
+    assert store.load_session("s1") is None
+    store.close()
+    
+def test_expired_sessions_in_memory_not_evicted():
+    import time
+    from chatMe.core.session_store import MemorySessionStore
+    store = MemorySessionStore(ttl=0.05)
+    manager = DialogueManager(store=store)
+    session_id = manager.create_session("user123")
+    time.sleep(0.1)
+    
+    assert manager.evict_idle(max_idle=60) == 0
+    assert store.evict_expired(store.held_sessions()) == 0
+    manager.add_message(session_id, "user", "Hello")
+    assert len(store.get_messages(session_id)) == 1
+    
+def test_evict_idle_keeps_recently_used_sessions():
+    import time
+    from chatMe.core.session_store import MemorySessionStore
+    manager = DialogueManager(store=MemorySessionStore())
+    idle = manager.create_session("user123")
+    manager.add_message(idle, "user", "Hello")
+    time.sleep(0.05)
+    active = manager.create_session("user456")
+    
+    assert manager.evict_idle(max_idle=0.03) == 1
+    assert set(manager.contexts) == {active}
+    # 移出的会话下次访问时从存储恢复
+    assert [m["content"] for m in manager.build_context(idle, max_tokens=1000)] == ["Hello"]
+    
+def test_cold_messages_compressed():
+    manager = DialogueManager(token_counter=len, hot_messages=2)
+    session_id = manager.create_session("user123")
+    long_text = "今天的天气很好，" * 100
+    for i in range(4):
+        manager.add_message(session_id, "user", f"{i}{long_text}")
+    
+    messages = manager.get_context(session_id).messages
+    assert [m.compressed for m in messages] == [True, True, False, False]
+    history = manager.get_history(session_id)
+    assert history[0]["content"] == f"0{long_text}"
+    assert history.to_dicts()[1]["role"] == "user"
+    assert [m["content"][0] for m in manager.get_history(session_id, limit=3)] == ["1", "2", "3"]
+    
+def test_session_ids_unique_and_indexed():
+    manager = DialogueManager()
+    sessions = [manager.create_session("user123") for _ in range(100)]
+    other = manager.create_session("user456")
+    
+    assert len(set(sessions)) == 100
+    assert manager.list_sessions("user123") == sessions
+    assert manager.latest_session("user123") == sessions[-1]
+    assert manager.latest_session("user456") == other
+    assert manager.latest_session("nobody") is None
+    
+    manager.clear_session(sessions[-1])
+    assert manager.latest_session("user123") == sessions[-2]
+    manager.clear_session(other)
+    assert manager.list_sessions("user456") == []
+    
+def test_session_index_loaded_from_store(temp_dir):
+    from chatMe.core.session_store import SQLiteSessionStore
+    path = f"{temp_dir}/sessions.db"
+    manager = DialogueManager(store=SQLiteSessionStore(path, flush_interval=0))
+    first = manager.create_session("user123")
+    second = manager.create_session("user123")
+    manager.close()
+    
+    resumed = DialogueManager(store=SQLiteSessionStore(path, flush_interval=0))
+    assert resumed.latest_session("user123") == second
+    third = resumed.create_session("user123")
+    assert resumed.list_sessions("user123") == [first, second, third]
+    resumed.close()
+    
+def test_concurrent_add_and_read_keeps_order():
+    import threading
+    from chatMe.core.session_store import MemorySessionStore
+    manager = DialogueManager(token_counter=len, store=MemorySessionStore(), shards=4)
+    sessions = [manager.create_session(f"user{i}") for i in range(8)]
+    writers, per_writer = 8, 200
+    errors = []
+    done = threading.Event()
+    
+    def write(writer):
+        for i in range(per_writer):
+            for session_id in sessions:
+                manager.add_message(session_id, "user", f"{writer}:{i}")
+    
+    def read():
+        while not done.is_set():
+            for session_id in sessions:
+                seen = {}
+                for message in manager.get_history(session_id):
+                    writer, i = map(int, message["content"].split(":"))
+                    if i != seen.get(writer, -1) + 1:
+                        errors.append((session_id, writer, i))
+                    seen[writer] = i
+    
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(writers)]
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for t in threads + readers:
+        t.start()
+    for t in threads:
+        t.join()
+    done.set()
+    for t in readers:
+        t.join()
+    
+    assert errors == []
+    for session_id in sessions:
+        context = manager.get_context(session_id)
+        assert len(context.messages) == writers * per_writer
+        assert len(context.token_prefix) == len(context.messages) + 1
+        assert context.token_prefix[-1] == sum(len(m.content) + 4 for m in context.messages)
+        assert [m["content"] for m in manager.store.get_messages(session_id)] == [m.content for m in context.messages]
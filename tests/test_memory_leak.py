@@ -1,3 +1,7 @@
+import tracemalloc
+from datetime import datetime
+from chatMe.core.dialogue import DialogueManager
+
 def test_memory_usage():
     initial_memory = psutil.Process().memory_info().rss
     
@@ -6,4 +10,37 @@ def test_memory_usage():
             assistant.get_ai_response("测试")
     
     final_memory = psutil.Process().memory_info().rss
-    assert (final_memory - initial_memory) < 10 * 1024 * 1024  # 允许10MB增长
\ No newline at end of file
+    assert (final_memory - initial_memory) < 10 * 1024 * 1024  # 允许10MB增长
+
+def _traced_size(build):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        data = build()
+        return tracemalloc.get_traced_memory()[0] - before, data
+    finally:
+        tracemalloc.stop()
+
+def test_message_memory_benchmark():
+    """对比原先的 dict 消息与紧凑 Message 的内存占用"""
+    turns = [("user" if i % 2 == 0 else "assistant", f"第{i}轮：" + "内容" * (i % 50)) for i in range(20_000)]
+    
+    def build_dicts():
+        return [
+            {"role": role, "content": content, "timestamp": datetime.now().isoformat()}
+            for role, content in turns
+        ]
+    
+    def build_messages():
+        manager = DialogueManager(token_counter=len, hot_messages=None)
+        session_id = manager.create_session("bench")
+        for role, content in turns:
+            manager.add_message(session_id, role, content)
+        return manager
+    
+    # 内容字符串两种布局共享，只比较每条消息的额外开销
+    dict_size, _ = _traced_size(build_dicts)
+    message_size, manager = _traced_size(build_messages)
+    print(f"dict: {dict_size / len(turns):.0f} B/条, Message: {message_size / len(turns):.0f} B/条")
+    
+    assert message_size < dict_size * 0.6
@@ -0,0 +1,564 @@
+"""
+AI提供者测试
+"""
+
+import asyncio
+import os
+import threading
+import time
+import pytest
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock, AsyncMock
+from chatMe import ChatMe
+from chatMe.main import VoiceAssistant
+from chatMe.core.coalescing import CoalescingProvider
+from chatMe.core.routing import RouterProvider, HedgedProvider
+from chatMe.core.scheduling import RateLimitedProvider
+from chatMe.core.providers import (
+    AIProvider,
+    AsyncAIProvider,
+    ChatCompletionProvider,
+    PROVIDER_REGISTRY
+)
+from chatMe.utils.ratelimit import RateLimitScheduler, parse_duration
+
+class EchoProvider(AIProvider):
+    def generate_response(self, prompt: str, **kwargs):
+        return f"echo: {prompt}"
+    
+    @classmethod
+    def validate_config(cls, config):
+        return True
+
+class FakeChatProvider(ChatCompletionProvider):
+    @classmethod
+    def validate_config(cls, config):
+        return True
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+def test_default_stream_response():
+    """测试未覆盖流式接口的提供者"""
+    provider = EchoProvider()
+    assert list(provider.stream_response("你好")) == ["echo: 你好"]
+
+def test_chat_completion_stream_response():
+    """测试流式增量解析"""
+    client = MagicMock()
+    client.chat.completions.create.return_value = iter([
+        _chunk("你"), _chunk(None), _chunk("好"), SimpleNamespace(choices=[])
+    ])
+    provider = FakeChatProvider(client, "gpt-3.5-turbo", temperature=0.5)
+    
+    assert list(provider.stream_response("hi")) == ["你", "好"]
+    kwargs = client.chat.completions.create.call_args.kwargs
+    assert kwargs["stream"] is True
+    assert kwargs["temperature"] == 0.5
+
+class BrokenStreamProvider(EchoProvider):
+    """先产出 deltas 再抛出异常的流式提供者"""
+    def __init__(self, deltas):
+        self.deltas = deltas
+    
+    def stream_response(self, prompt: str, **kwargs):
+        yield from self.deltas
+        raise RuntimeError("connection reset")
+
+@pytest.mark.parametrize("deltas, expected", [
+    ([], ["抱歉，我现在无法回答"]),
+    (["今天", "天气"], ["今天", "天气"]),
+])
+def test_voice_stream_fallback_only_before_output(deltas, expected):
+    """测试流式回复中途出错时不在已朗读的内容后接上道歉"""
+    assistant = VoiceAssistant.__new__(VoiceAssistant)
+    assistant.provider = BrokenStreamProvider(deltas)
+    assistant._build_history = lambda user_input: []
+    assistant._record_turn = MagicMock()
+    
+    assert list(assistant.stream_ai_response("天气")) == expected
+    assistant._record_turn.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_default_astream_response():
+    """测试异步流式接口的默认实现"""
+    provider = EchoProvider()
+    deltas = [delta async for delta in provider.astream_response("hi")]
+    assert deltas == ["echo: hi"]
+
+class AsyncEchoProvider(EchoProvider, AsyncAIProvider):
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+    
+    async def agenerate_response(self, prompt: str, **kwargs):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return f"echo: {prompt}"
+    
+    async def astream_response(self, prompt: str, **kwargs):
+        yield await self.agenerate_response(prompt, **kwargs)
+
+@pytest.fixture
+def chat_client(temp_dir, monkeypatch):
+    """使用测试提供者的ChatMe实例"""
+    monkeypatch.setitem(PROVIDER_REGISTRY, 'echo', AsyncEchoProvider)
+    config_path = os.path.join(temp_dir, "config.yaml")
+    with open(config_path, 'w') as f:
+        yaml.dump({"default_provider": "echo", "providers": {"echo": {}}}, f)
+    return ChatMe(config_path=config_path)
+
+@pytest.mark.asyncio
+async def test_chat_completion_agenerate_response():
+    """测试异步客户端调用"""
+    client = MagicMock()
+    async_client = MagicMock()
+    async_client.chat.completions.create = AsyncMock(return_value=SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="你好"))]
+    ))
+    provider = FakeChatProvider(client, "gpt-3.5-turbo", async_client=async_client)
+    
+    assert await provider.agenerate_response("hi") == "你好"
+    client.chat.completions.create.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_achat_concurrent(chat_client):
+    """测试单个事件循环内的并发会话"""
+    replies = await asyncio.gather(*(chat_client.achat(f"m{i}") for i in range(50)))
+    
+    assert replies == [f"echo: m{i}" for i in range(50)]
+    assert chat_client.provider.peak == 50
+
+class FlakyProvider(EchoProvider):
+    def generate_response(self, prompt: str, **kwargs):
+        if prompt == "bad":
+            raise RuntimeError("upstream error")
+        time.sleep(0.01)
+        return f"echo: {prompt}"
+
+def test_generate_batch_order_and_errors():
+    """测试批量生成保持顺序并隔离错误"""
+    prompts = [f"m{i}" for i in range(20)] + ["bad"]
+    results = FlakyProvider().generate_batch(prompts, max_concurrency=10)
+    
+    assert [r.index for r in results] == list(range(21))
+    assert all(r.ok and r.response == f"echo: m{i}" for i, r in enumerate(results[:20]))
+    assert not results[-1].ok
+    assert isinstance(results[-1].error, RuntimeError)
+
+def test_generate_batch_requests_per_second():
+    """测试批量生成遵守每秒请求数限制"""
+    start = time.monotonic()
+    results = EchoProvider().generate_batch(
+        [str(i) for i in range(30)],
+        max_concurrency=30,
+        requests_per_second=20
+    )
+    # 桶初始容量为20，其余10个请求需按20/s补充令牌
+    assert all(r.ok for r in results)
+    assert time.monotonic() - start >= 0.4
+
+class SlowProvider(EchoProvider):
+    def __init__(self):
+        self.calls = 0
+    
+    def generate_response(self, prompt: str, **kwargs):
+        self.calls += 1
+        time.sleep(0.05)
+        return f"echo: {prompt}"
+    
+    def stream_response(self, prompt: str, **kwargs):
+        self.calls += 1
+        for delta in ["早", "上", "好"]:
+            time.sleep(0.02)
+            yield delta
+
+def test_coalescing_concurrent_requests():
+    """测试相同的并发请求只调用一次上游"""
+    upstream = SlowProvider()
+    provider = CoalescingProvider(upstream)
+    
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda _: provider.generate_response("早上好"), range(10)))
+    
+    assert results == ["echo: 早上好"] * 10
+    assert upstream.calls == 1
+    assert provider.get_stats()['coalesced_calls'] == 9
+
+def test_coalescing_stream_late_joiner():
+    """测试晚加入的流式订阅者收到完整的增量序列"""
+    upstream = SlowProvider()
+    provider = CoalescingProvider(upstream)
+    
+    first = provider.stream_response("早上好")
+    assert next(first) == "早"
+    late = provider.stream_response("早上好")
+    
+    assert list(late) == ["早", "上", "好"]
+    assert list(first) == ["上", "好"]
+    assert upstream.calls == 1
+
+@pytest.mark.asyncio
+async def test_coalescing_async_requests():
+    """测试相同的异步并发请求共享一次上游调用"""
+    upstream = AsyncEchoProvider()
+    provider = CoalescingProvider(upstream)
+    
+    results = await asyncio.gather(*(provider.agenerate_response("早上好") for _ in range(20)))
+    
+    assert results == ["echo: 早上好"] * 20
+    assert upstream.peak == 1
+    assert provider.get_stats()['upstream_calls'] == 1
+
+class EndlessProvider(AsyncEchoProvider):
+    """不断输出增量，记录上游流是否被关闭"""
+    def __init__(self):
+        super().__init__()
+        self.produced = 0
+        self.closed = threading.Event()
+    
+    def stream_response(self, prompt: str, **kwargs):
+        try:
+            while True:
+                time.sleep(0.005)
+                self.produced += 1
+                yield "字"
+        finally:
+            self.closed.set()
+    
+    async def astream_response(self, prompt: str, **kwargs):
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                self.produced += 1
+                yield "字"
+        finally:
+            self.closed.set()
+
+def test_coalescing_stream_closes_upstream_when_abandoned():
+    """测试所有订阅者停止读取后关闭上游流，之后的相同请求重新发起"""
+    upstream = EndlessProvider()
+    provider = CoalescingProvider(upstream)
+    
+    first = provider.stream_response("早上好")
+    second = provider.stream_response("早上好")
+    assert next(first) == next(second) == "字"
+    first.close()
+    assert not upstream.closed.wait(0.05)
+    second.close()
+    
+    assert upstream.closed.wait(1)
+    produced = upstream.produced
+    time.sleep(0.05)
+    assert upstream.produced == produced
+    
+    upstream.closed.clear()
+    third = provider.stream_response("早上好")
+    assert next(third) == "字"
+    assert provider.get_stats()['upstream_calls'] == 2
+    third.close()
+    assert upstream.closed.wait(1)
+
+@pytest.mark.asyncio
+async def test_coalescing_async_stream_closes_upstream_when_abandoned():
+    """测试异步流式订阅者全部离开后取消生产者并关闭上游流"""
+    upstream = EndlessProvider()
+    provider = CoalescingProvider(upstream)
+    
+    stream = provider.astream_response("早上好")
+    assert await stream.__anext__() == "字"
+    await stream.aclose()
+    await asyncio.sleep(0.02)
+    
+    assert upstream.closed.is_set()
+    produced = upstream.produced
+    await asyncio.sleep(0.03)
+    assert upstream.produced == produced
+
+class DownProvider(EchoProvider):
+    def generate_response(self, prompt: str, **kwargs):
+        raise RuntimeError("backend down")
+
+@pytest.fixture
+def router_registry(monkeypatch):
+    monkeypatch.setitem(PROVIDER_REGISTRY, 'echo', EchoProvider)
+    monkeypatch.setitem(PROVIDER_REGISTRY, 'down', DownProvider)
+    monkeypatch.setitem(PROVIDER_REGISTRY, 'slow', SlowProvider)
+
+def test_router_weighted_round_robin(router_registry):
+    """测试加权轮询按权重分配请求"""
+    router = RouterProvider([
+        {"type": "echo", "name": "a", "weight": 2},
+        {"type": "echo", "name": "b", "weight": 1}
+    ])
+    for i in range(9):
+        assert router.generate_response(str(i)) == f"echo: {i}"
+    
+    stats = router.get_stats()
+    assert stats['a']['requests'] == 6
+    assert stats['b']['requests'] == 3
+
+def test_router_failover_and_circuit_breaker(router_registry):
+    """测试失败时切换到健康后端，并在连续失败后熔断"""
+    router = RouterProvider([
+        {"type": "down", "name": "down"},
+        {"type": "echo", "name": "up"}
+    ], failure_threshold=2, recovery_timeout=60)
+    
+    results = [router.generate_response("hi") for _ in range(10)]
+    
+    assert results == ["echo: hi"] * 10
+    stats = router.get_stats()
+    assert stats['down']['state'] == "open"
+    assert stats['down']['requests'] == 2
+    assert stats['up']['requests'] == 10
+
+def test_router_ewma_prefers_fast_backend(router_registry):
+    """测试EWMA策略把流量导向延迟更低的后端"""
+    router = RouterProvider([
+        {"type": "slow", "name": "slow"},
+        {"type": "echo", "name": "fast"}
+    ], strategy="ewma")
+    for _ in range(10):
+        router.generate_response("hi")
+    
+    stats = router.get_stats()
+    assert stats['slow']['requests'] == 1
+    assert stats['fast']['requests'] == 9
+
+def test_router_stream_closed_early_releases_backend(router_registry):
+    """测试调用方提前关闭流时归还在途计数和半开状态的探测名额"""
+    router = RouterProvider([{"type": "slow", "name": "slow"}], recovery_timeout=0)
+    backend = router.backends[0]
+    backend.breaker.state = backend.breaker.OPEN
+    
+    stream = router.stream_response("hi")
+    assert next(stream) == "早"
+    assert backend.get_stats()['outstanding'] == 1
+    stream.close()
+    
+    stats = backend.get_stats()
+    assert stats['outstanding'] == 0
+    assert stats['state'] == "closed"
+    assert backend.breaker.is_available()
+
+def test_router_from_config(router_registry, temp_dir):
+    """测试在配置文件中以名称引用路由后端"""
+    config_path = os.path.join(temp_dir, "config.yaml")
+    with open(config_path, 'w') as f:
+        yaml.dump({
+            "default_provider": "router",
+            "providers": {
+                "primary": {"type": "down"},
+                "backup": {"type": "echo"},
+                "router": {
+                    "type": "router",
+                    "backends": [{"provider": "primary"}, {"provider": "backup", "weight": 2}]
+                }
+            },
+            "cache": {"enabled": False},
+            "coalescing": {"enabled": False},
+            "rate_limit": {"enabled": False}
+        }, f)
+    client = ChatMe(config_path=config_path)
+    
+    assert client.chat("你好") == "echo: 你好"
+    assert set(client.provider.get_stats()) == {"primary", "backup"}
+
+def test_router_from_template(router_registry, temp_dir):
+    """测试按模板复制的路由配置可以直接使用"""
+    template_path = os.path.join(os.path.dirname(__file__), "..", "config_templates", "providers.yaml")
+    with open(template_path) as f:
+        template = yaml.safe_load(f)
+    config_path = os.path.join(temp_dir, "config.yaml")
+    with open(config_path, 'w') as f:
+        yaml.dump({
+            "default_provider": "router",
+            "providers": {
+                "router": template["router_example"],
+                "openai": {"type": "echo"},
+                "azure": {"type": "echo"}
+            },
+            "cache": {"enabled": False},
+            "coalescing": {"enabled": False},
+            "rate_limit": {"enabled": False}
+        }, f)
+    client = ChatMe(config_path=config_path)
+    
+    assert client.chat("你好") == "echo: 你好"
+    stats = client.provider.get_stats()
+    assert {name: backend['weight'] for name, backend in stats.items()} == {"openai": 2, "azure": 1}
+
+class TailLatencyProvider(EchoProvider, AsyncAIProvider):
+    """每第 n 次调用出现一次长尾延迟"""
+    def __init__(self, every: int = 10, slow: float = 0.5):
+        self.every = every
+        self.slow = slow
+        self.calls = 0
+        self._lock = threading.Lock()
+    
+    def generate_response(self, prompt: str, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(self.slow if call % self.every == 0 else 0.01)
+        return f"echo: {prompt}"
+    
+    async def agenerate_response(self, prompt: str, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        await asyncio.sleep(self.slow if call % self.every == 0 else 0.01)
+        return f"echo: {prompt}"
+
+def test_hedged_request_cuts_tail_latency():
+    """测试慢请求触发对冲并采用先返回的结果"""
+    provider = HedgedProvider(TailLatencyProvider(), min_samples=5, max_hedge_ratio=0.2)
+    for i in range(9):
+        provider.generate_response(str(i))
+    
+    start = time.monotonic()
+    assert provider.generate_response("tail") == "echo: tail"
+    assert time.monotonic() - start < 0.2
+    
+    stats = provider.get_stats()
+    assert stats['hedged_requests'] == 1
+    assert stats['hedge_wins'] == 1
+    # 落败的同步请求已在执行，无法取消
+    assert stats['cancelled_requests'] == 0
+
+def test_hedged_records_losing_primary_latency():
+    """测试对冲胜出后仍记录落败主请求的真实延迟"""
+    provider = HedgedProvider(TailLatencyProvider(), min_samples=5, max_hedge_ratio=0.2)
+    for i in range(10):
+        provider.generate_response(str(i))
+    assert provider.get_stats()['hedge_wins'] == 1
+    
+    # 落败的主请求完成后，样本中出现它的长尾延迟，而不是对冲请求的耗时
+    deadline = time.monotonic() + 2
+    while len(provider._latencies) < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(provider._latencies) == 10
+    assert max(provider._latencies) >= 0.5
+
+def test_hedged_budget_limits_overhead():
+    """测试对冲请求数不超过预算"""
+    provider = HedgedProvider(TailLatencyProvider(every=2, slow=0.05), min_samples=5, max_hedge_ratio=0.1)
+    for i in range(40):
+        provider.generate_response(str(i))
+    
+    stats = provider.get_stats()
+    assert stats['hedged_requests'] <= 4
+    assert stats['hedge_rate'] <= 0.1
+
+@pytest.mark.asyncio
+async def test_hedged_async_cancels_loser():
+    """测试异步对冲取消落败的请求"""
+    upstream = TailLatencyProvider()
+    provider = HedgedProvider(upstream, min_samples=5, max_hedge_ratio=0.2)
+    for i in range(9):
+        await provider.agenerate_response(str(i))
+    
+    start = time.monotonic()
+    assert await provider.agenerate_response("tail") == "echo: tail"
+    assert time.monotonic() - start < 0.2
+    assert provider.get_stats()['cancelled_requests'] == 1
+
+def test_parse_rate_limit_durations():
+    """测试限流响应头的时间格式"""
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("250ms") == 0.25
+    assert parse_duration("1.5") == 1.5
+    assert parse_duration("soon") is None
+
+def test_scheduler_priority_order():
+    """测试额度不足时高优先级调用方先获得额度"""
+    scheduler = RateLimitScheduler({"echo": {"requests_per_minute": 1200}}, headroom=1.0)
+    key = ("echo", "")
+    for _ in range(20):
+        scheduler.acquire(key)
+    
+    order = []
+    def worker(name, priority):
+        scheduler.acquire(key, priority=priority)
+        order.append(name)
+    
+    threads = [threading.Thread(target=worker, args=(f"low{i}", 5)) for i in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.01)
+    high = threading.Thread(target=worker, args=("high", 0))
+    high.start()
+    for t in threads + [high]:
+        t.join()
+    
+    assert order[0] == "high"
+    assert scheduler.get_stats()['granted'] == 24
+
+def test_scheduler_learns_limits_from_headers():
+    """测试从响应头同步剩余额度"""
+    scheduler = RateLimitScheduler()
+    key = ("openai", "gpt-3.5-turbo")
+    scheduler.update_from_headers(key, {
+        "x-ratelimit-limit-requests": "600",
+        "x-ratelimit-remaining-requests": "0"
+    })
+    
+    start = time.monotonic()
+    scheduler.acquire(key)
+    assert time.monotonic() - start >= 0.09
+    assert scheduler.get_stats()['limits']["openai/gpt-3.5-turbo"]['requests_per_minute'] == 600
+
+class RateLimitError(Exception):
+    status_code = 429
+    
+    def __init__(self):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers={"retry-after-ms": "50"})
+
+class ThrottledProvider(EchoProvider):
+    def __init__(self, failures: int):
+        self.failures = failures
+    
+    def generate_response(self, prompt: str, **kwargs):
+        assert 'priority' not in kwargs
+        if self.failures:
+            self.failures -= 1
+            raise RateLimitError()
+        return f"echo: {prompt}"
+
+def test_rate_limited_provider_disables_sdk_retries():
+    """测试由调度器负责重试时，每次调度只向API发出一次请求"""
+    import httpx
+    import openai
+    attempts = []
+    
+    def handler(request):
+        attempts.append(request)
+        return httpx.Response(429, headers={"retry-after-ms": "10"}, json={"error": {"message": "rate limited"}})
+    
+    client = openai.OpenAI(api_key="test", http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+    scheduler = RateLimitScheduler(backoff_base=0.01)
+    provider = RateLimitedProvider(FakeChatProvider(client, "gpt-3.5-turbo"), scheduler, max_retries=1)
+    
+    with pytest.raises(openai.RateLimitError):
+        provider.generate_response("hi")
+    assert len(attempts) == 2
+    assert provider.get_stats()['rate_limited'] == 1
+
+def test_rate_limited_provider_retries_after_429():
+    """测试429后按 Retry-After 退避并重试"""
+    scheduler = RateLimitScheduler(backoff_base=0.01)
+    provider = RateLimitedProvider(ThrottledProvider(failures=1), scheduler)
+    
+    start = time.monotonic()
+    assert provider.generate_response("hi", priority=1) == "echo: hi"
+    assert time.monotonic() - start >= 0.05
+    assert provider.get_stats()['rate_limited'] == 1
+    
+    with pytest.raises(RateLimitError):
+        RateLimitedProvider(ThrottledProvider(failures=5), scheduler, max_retries=1).generate_response("hi")
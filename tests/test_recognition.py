@@ -0,0 +1,70 @@
+"""
+语音识别后端测试
+"""
+
+import numpy as np
+import pytest
+import speech_recognition as sr
+from chatMe.config import AIConfig
+from chatMe.core.recognition_backends import (
+    RecognitionBackend, GoogleBackend, ScriptedBackend, VoskBackend
+)
+from chatMe.exceptions import ConfigError, RecognitionError
+
+AUDIO = np.zeros(1600, np.int16)
+
+def test_from_config_uses_registry_and_custom_classes():
+    backend = RecognitionBackend.from_config({'type': 'scripted', 'settings': {'responses': ["一", None]}})
+    assert isinstance(backend, ScriptedBackend)
+    assert backend.recognize(AUDIO, 16000, "zh-CN") == "一"
+    assert backend.recognize(AUDIO, 16000, "zh-CN") is None
+    assert backend.calls == [0.1, 0.1]
+    
+    custom = RecognitionBackend.from_config({
+        'type': 'echo',
+        'module_path': 'chatMe.core.recognition_backends',
+        'class_name': 'ScriptedBackend',
+        'settings': {'default': "好"}
+    })
+    assert custom.recognize(AUDIO, 16000, "zh-CN") == "好"
+    
+    with pytest.raises(ConfigError):
+        RecognitionBackend.from_config({'type': 'unknown'})
+    with pytest.raises(ConfigError):
+        RecognitionBackend.from_config({'type': 'vosk', 'settings': {}})
+
+def test_recognition_spec_from_yaml(temp_dir):
+    config = AIConfig(f"{temp_dir}/config.yaml")
+    assert config.build_recognition_spec() == {'type': 'google', 'settings': {}}
+    config.config['recognition'] = {'type': 'vosk', 'model_path': '/models/cn'}
+    assert config.build_recognition_spec() == {'type': 'vosk', 'settings': {'model_path': '/models/cn'}}
+
+def test_google_backend_maps_errors(monkeypatch):
+    backend = GoogleBackend()
+    
+    def unknown(audio, **kwargs):
+        raise sr.UnknownValueError()
+    
+    monkeypatch.setattr(backend.recognizer, "recognize_google", unknown)
+    assert backend.recognize(AUDIO, 16000, "zh-CN") is None
+    
+    def offline(audio, **kwargs):
+        raise sr.RequestError("no network")
+    
+    monkeypatch.setattr(backend.recognizer, "recognize_google", offline)
+    with pytest.raises(RecognitionError):
+        backend.recognize(AUDIO, 16000, "zh-CN")
+
+def test_vosk_backend_cleans_chinese_output():
+    assert VoskBackend._clean("你 好 世界", "zh-CN") == "你好世界"
+    assert VoskBackend._clean("hello world", "en-US") == "hello world"
+    assert VoskBackend._clean(" ", "zh-CN") is None
+
+def test_default_stream_recognizes_whole_utterance_on_finish():
+    class Batch(RecognitionBackend):
+        def recognize(self, audio, sample_rate, language):
+            return f"{len(audio)}"
+    
+    session = Batch().start_stream(16000, "zh-CN")
+    assert session.accept(AUDIO) is None
+    assert session.finish(np.zeros(3200, np.int16)) == "3200"
@@ -0,0 +1,194 @@
+"""
+语音合成测试
+"""
+
+import threading
+import time
+import wave
+import pytest
+from chatMe.exceptions import SynthesisError
+from chatMe.utils.text import SentenceSplitter
+from chatMe.core.synthesis import SpeechPipeline, TTSWorker
+from chatMe.utils.audio_cache import AudioCache
+
+def write_wav(filename, frames=1600):
+    with wave.open(filename, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b"\x00\x01" * frames)
+
+class FakeEngine:
+    """记录朗读内容的假语音引擎，gate 未打开时 runAndWait 阻塞"""
+    def __init__(self):
+        self.spoken = []
+        self.threads = set()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+        self.stopped = threading.Event()
+        self.stop_threads = set()
+        self.rendered = []
+        self.callbacks = []
+        self._text = None
+    
+    def connect(self, topic, callback):
+        assert topic == 'started-word'
+        self.callbacks.append(callback)
+    
+    def getProperty(self, name):
+        return {"voice": "zh", "rate": 150, "volume": 0.8}[name]
+    
+    def save_to_file(self, text, filename):
+        self.rendered.append(text)
+        write_wav(filename)
+        self._text = None
+    
+    def say(self, text):
+        if text == "坏句子。":
+            raise RuntimeError("engine failure")
+        self._text = text
+    
+    def runAndWait(self):
+        self.threads.add(threading.get_ident())
+        self.started.set()
+        # 朗读期间逐词触发回调，与 pyttsx3 一样在引擎线程中调用
+        deadline = time.monotonic() + 1
+        while not self.gate.wait(0.01) and time.monotonic() < deadline:
+            for callback in self.callbacks:
+                callback(self._text, 0, 1)
+        if self._text is not None:
+            self.spoken.append(self._text)
+            self._text = None
+    
+    def stop(self):
+        self.stop_threads.add(threading.get_ident())
+        self.stopped.set()
+        self.gate.set()
+
+def test_sentence_splitter_punctuation():
+    assert SentenceSplitter.split("你好！今天天气很好。温度是3.5度, right? 好的……真的吗？」是的") == [
+        "你好！", "今天天气很好。", "温度是3.5度, right?", "好的……", "真的吗？」", "是的"
+    ]
+
+def test_sentence_splitter_streaming():
+    splitter = SentenceSplitter()
+    sentences = []
+    for char in "第一句。“第二句！”Pi is 3.14. Done":
+        sentences.extend(splitter.feed(char))
+    assert sentences == ["第一句。", "“第二句！”", "Pi is 3.14."]
+    assert splitter.flush() == "Done"
+    assert splitter.flush() is None
+
+def test_sentence_splitter_max_chars():
+    sentences = SentenceSplitter.split("这是一个，没有句号的长句子，" * 4, max_chars=20)
+    assert all(len(s) <= 20 for s in sentences)
+    assert "".join(sentences) == "这是一个，没有句号的长句子，" * 4
+
+def test_pipeline_speaks_before_generation_ends():
+    engine = FakeEngine()
+    worker = TTSWorker(lambda: engine)
+    
+    def generate():
+        yield "你好，"
+        yield "我是助手。今天"
+        # 第一句应在生成结束前开始朗读
+        assert engine.started.wait(1)
+        yield "天气很好。再见"
+    
+    text = SpeechPipeline(worker).speak_stream(generate())
+    assert text == "你好，我是助手。今天天气很好。再见"
+    assert engine.spoken == ["你好，我是助手。", "今天天气很好。", "再见"]
+    # 引擎只在合成线程中使用
+    assert engine.threads == {worker._thread.ident}
+    worker.close()
+
+def test_tts_worker_priority_and_errors():
+    engine = FakeEngine()
+    engine.gate.clear()
+    worker = TTSWorker(lambda: engine)
+    worker.enqueue("第一句回复。")
+    assert engine.started.wait(1)
+    worker.enqueue("第二句回复。")
+    bad = worker.enqueue("坏句子。")
+    worker.enqueue("声音太小", TTSWorker.PRIORITY_SYSTEM)
+    engine.gate.set()
+    
+    assert worker.flush(1)
+    assert engine.spoken == ["第一句回复。", "声音太小", "第二句回复。"]
+    with pytest.raises(SynthesisError):
+        bad.result()
+    worker.close()
+
+def test_tts_worker_interrupt():
+    engine = FakeEngine()
+    engine.gate.clear()
+    worker = TTSWorker(lambda: engine)
+    worker.enqueue("正在朗读。")
+    assert engine.started.wait(1)
+    queued = [worker.enqueue(f"排队{i}。") for i in range(3)]
+    
+    assert worker.interrupt() == 3
+    assert all(f.cancelled() for f in queued)
+    assert worker.flush(1)
+    # stop() 由引擎线程中的回调调用，不来自调用 interrupt() 的线程
+    assert engine.stopped.is_set()
+    assert engine.stop_threads == engine.threads == {worker._thread.ident}
+    assert engine.spoken == ["正在朗读。"]
+    worker.close()
+
+def test_tts_worker_reports_playback():
+    engine = FakeEngine()
+    engine.gate.clear()
+    worker = TTSWorker(lambda: engine)
+    states = []
+    worker.add_listener(states.append)
+    worker.enqueue("第一句。")
+    assert engine.started.wait(1)
+    assert worker.playing and states == [True]
+    
+    engine.gate.set()
+    worker.enqueue("第二句。")
+    assert worker.flush(1)
+    assert not worker.playing
+    assert states == [True, False, True, False]
+    worker.close()
+
+def test_tts_worker_init_failure():
+    def broken():
+        raise RuntimeError("no driver")
+    with pytest.raises(SynthesisError):
+        TTSWorker(broken)
+
+def test_audio_cache_lru(temp_dir):
+    cache = AudioCache(temp_dir, max_bytes=2 * 3300)
+    for key in ("a", "b"):
+        assert cache.put(key, write_wav) is not None
+    assert cache.get("a") is not None
+    cache.put("c", write_wav)
+    
+    # b 最久未使用，被淘汰
+    assert "b" not in cache and cache.get("b") is None
+    assert cache.get_stats()['evictions'] == 1
+    assert cache.put("bad", lambda filename: open(filename, 'wb').close()) is None
+    
+    reopened = AudioCache(temp_dir, max_bytes=2 * 3300)
+    assert sorted(reopened._entries) == ["a", "c"]
+
+def test_tts_worker_plays_cached_audio(temp_dir):
+    engine = FakeEngine()
+    played = []
+    worker = TTSWorker(lambda: engine, AudioCache(temp_dir), lambda filename, stop: played.append(filename))
+    
+    for future in worker.prewarm(["再见！"]):
+        future.result(1)
+    worker.enqueue("你好，我是助手", cache=True)
+    worker.enqueue("你好，我是助手", cache=True)
+    worker.enqueue("再见！")
+    worker.enqueue("普通回复")
+    assert worker.flush(1)
+    
+    assert engine.rendered == ["再见！", "你好，我是助手"]
+    assert len(played) == 3 and played[0] == played[1]
+    assert engine.spoken == ["普通回复"]
+    worker.close()
@@ -0,0 +1,221 @@
+"""
+语音活动检测测试
+"""
+
+import wave
+import numpy as np
+import pytest
+from chatMe.utils.vad import (
+    EnergyVAD, NoiseFloorEstimator, PlaybackGate, UtteranceSegmenter, VADEventType, WavFrameSource,
+    frame_features
+)
+from chatMe.core.recognition import SpeechRecognizer
+from chatMe.core.recognition_backends import ScriptedBackend
+
+RATE = 16000
+
+def make_wav(path, segments, seed=0):
+    """segments: [(秒数, 是否为语音)]，语音用440Hz正弦波，静音用弱噪音"""
+    rng = np.random.default_rng(seed)
+    parts = []
+    for seconds, speech in segments:
+        n = int(seconds * RATE)
+        if speech:
+            parts.append(3000 * np.sin(2 * np.pi * 440 * np.arange(n) / RATE))
+        else:
+            parts.append(rng.normal(0, 20, n))
+    audio = np.concatenate(parts).astype(np.int16)
+    with wave.open(str(path), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(audio.tobytes())
+    return str(path)
+
+def test_frame_features_vectorised():
+    t = np.arange(320) / RATE
+    frames = np.stack([
+        np.zeros(320, np.int16),
+        (1000 * np.sin(2 * np.pi * 100 * t)).astype(np.int16),
+        (1000 * np.sin(2 * np.pi * 4000 * t)).astype(np.int16),
+    ])
+    rms, zcr = frame_features(frames)
+    assert rms[0] == 0 and rms[1] == pytest.approx(707, rel=0.02)
+    assert zcr[1] < 0.05 < 0.4 < zcr[2]
+    
+    vad = EnergyVAD(threshold=1200)
+    # 能量不足阈值的低频帧不是语音，同样能量的高过零率帧视为清音
+    assert vad.classify(frames).tolist() == [False, False, True]
+
+def test_segmenter_finds_utterance_boundaries(temp_dir):
+    path = make_wav(f"{temp_dir}/two.wav", [(0.5, False), (1.0, True), (0.5, False), (0.6, True), (0.5, False)])
+    source = WavFrameSource(path)
+    segmenter = UtteranceSegmenter(EnergyVAD(300), source.sample_rate, source.frame_samples, end_silence_ms=200)
+    utterances = list(segmenter.segment(source))
+    
+    assert len(utterances) == 2
+    first, second = utterances
+    # 起点包含预录音，终点在尾部静音满200ms时给出
+    assert first.start == pytest.approx(0.3, abs=0.03)
+    assert first.end == pytest.approx(1.7, abs=0.03)
+    assert second.end == pytest.approx(2.8, abs=0.03)
+    assert len(first.audio) == round(first.duration * RATE)
+
+def test_segmenter_events_and_max_length():
+    vad = EnergyVAD(300)
+    segmenter = UtteranceSegmenter(vad, RATE, 320, start_ms=40, max_utterance_ms=200)
+    loud = np.full(320, 2000, np.int16)
+    events = [event for _ in range(20) for event in segmenter.feed(loud)]
+    types = [event.type for event in events]
+    
+    assert types[0] is VADEventType.START
+    assert types.count(VADEventType.END) == 2
+    assert all(len(e.utterance.audio) == 10 * 320 for e in events if e.type is VADEventType.END)
+
+def test_recognizer_listens_from_wav(temp_dir):
+    path = make_wav(f"{temp_dir}/hello.wav", [(0.3, False), (0.8, True), (1.0, False)])
+    backend = ScriptedBackend(["你好"])
+    recognizer = SpeechRecognizer(frame_source=WavFrameSource(path), backend=backend)
+    
+    assert recognizer.listen() == "你好"
+    assert 0.8 < backend.calls[0] < 1.5
+
+def test_ring_buffer_views_wrap_without_copy():
+    from chatMe.utils.audio import RingBuffer
+    ring = RingBuffer(8)
+    ring.write(np.arange(6, dtype=np.int16))
+    ring.write(np.arange(6, 12, dtype=np.int16).tobytes())
+    
+    # 跨越绕回点的区间仍是连续视图
+    view = ring.view(5, 6)
+    assert view.tolist() == [5, 6, 7, 8, 9, 10]
+    assert np.shares_memory(view, ring._buffer) and not view.flags.writeable
+    assert ring.latest(3).tolist() == [9, 10, 11]
+    with pytest.raises(ValueError):
+        ring.view(2, 4)
+
+def test_capture_stream_keeps_device_open_across_turns(temp_dir, monkeypatch):
+    path = make_wav(f"{temp_dir}/turns.wav", [(0.3, False), (0.6, True), (0.5, False), (0.6, True), (0.5, False)])
+    recognizer = SpeechRecognizer(frame_source=WavFrameSource(path), backend=ScriptedBackend())
+    entered = []
+    monkeypatch.setattr(WavFrameSource, "__enter__", lambda self: entered.append(1) or self)
+    
+    first = recognizer.capture()
+    # 文件读完后录音线程退出，下一次监听不会重新打开
+    recognizer.stream._thread.join()
+    second = recognizer.capture()
+    recognizer.close()
+    
+    assert len(entered) == 1
+    # 第二句从第一句结束处继续读取，音频是环形缓冲区的视图
+    assert first.end < 1.4 < second.start + 0.3
+    assert np.shares_memory(second.audio, recognizer.stream.ring._buffer)
+    assert len(second.audio) == round(second.duration * RATE)
+
+def test_noise_floor_tracks_noise_and_ignores_speech():
+    rng = np.random.default_rng(1)
+    vad = EnergyVAD(1000)
+    estimator = NoiseFloorEstimator(vad, window_frames=50)
+    noise = lambda sigma: rng.normal(0, sigma, 320).astype(np.int16)
+    speech = (3000 * np.sin(np.arange(320) / 5)).astype(np.int16)
+    
+    for _ in range(49):
+        estimator.update(noise(20))
+    # 第一个窗口填满前保持配置的阈值
+    assert vad.threshold == 1000
+    estimator.update(noise(20))
+    assert estimator.noise_floor == pytest.approx(20, rel=0.2)
+    
+    # 说话不会抬高噪音基底
+    for _ in range(30):
+        estimator.update(speech)
+    assert estimator.noise_floor == pytest.approx(20, rel=0.2)
+    
+    # 噪音持续变大时阈值随之上升
+    for _ in range(100):
+        estimator.update(noise(200))
+    assert estimator.noise_floor == pytest.approx(200, rel=0.3)
+    assert vad.threshold == estimator.threshold == pytest.approx(estimator.noise_floor * 3)
+    assert estimator.get_stats()['frames'] == 180
+
+def test_playback_gate_ignores_echo_but_allows_barge_in():
+    tone = lambda amplitude: (amplitude * np.sin(np.arange(320) / 5)).astype(np.int16)
+    vad = EnergyVAD(300)
+    playing = [True]
+    gate = PlaybackGate(vad, lambda: playing[0], barge_in_ratio=3.0, hold_frames=5)
+    segmenter = UtteranceSegmenter(vad=gate, sample_rate=RATE, frame_samples=320)
+    
+    # 扬声器的声音远高于 VAD 阈值，但朗读期间不算开始说话
+    for _ in range(50):
+        assert segmenter.feed(tone(1500)) == []
+    assert gate.echo_level == pytest.approx(1500 * np.sqrt(0.5), rel=0.05)
+    assert gate.barge_in_threshold == pytest.approx(2 * gate.echo_level)
+    
+    # 比朗读声大得多的声音可以打断
+    events = [e for _ in range(3) for e in segmenter.feed(tone(6000))]
+    assert [e.type for e in events] == [VADEventType.START]
+    segmenter.reset()
+    
+    # 朗读结束后的余响仍用提高的阈值，之后恢复 VAD 的判断
+    playing[0] = False
+    assert [gate.is_speech(tone(1500)) for _ in range(6)] == [False] * 5 + [True]
+    assert not gate.is_speech(tone(100))
+
+def test_recognizer_skips_audio_recorded_during_playback(temp_dir):
+    path = make_wav(f"{temp_dir}/echo.wav", [(0.5, False), (1.0, True), (0.5, False), (0.6, True), (0.5, False)])
+    recognizer = SpeechRecognizer(frame_source=WavFrameSource(path), backend=ScriptedBackend())
+    stream = recognizer.stream
+    frames = []
+    
+    def playback(frame):
+        # 前 1.6 秒是扬声器的朗读声，此时还没有人监听
+        frames.append(frame)
+        if len(frames) in (1, 80):
+            stream.set_playback(len(frames) == 1)
+    
+    stream.add_listener(playback)
+    stream.start()
+    stream._thread.join()
+    
+    utterance = recognizer.capture()
+    recognizer.close()
+    assert stream.playback_end == 80 * stream.frame_samples
+    assert utterance is not None and 1.6 < utterance.start < 2.0 < 2.6 < utterance.end
+
+def test_listen_stream_emits_partials_then_final(temp_dir):
+    path = make_wav(f"{temp_dir}/stream.wav", [(0.3, False), (1.0, True), (0.6, False)])
+    backend = ScriptedBackend(["今天天气"], chunks_per_char=10)
+    recognizer = SpeechRecognizer(frame_source=WavFrameSource(path), backend=backend)
+    
+    results = list(recognizer.listen_stream())
+    recognizer.close()
+    
+    partials = [result.text for result in results if not result.final]
+    # 部分结果在说话过程中逐字增长，最后是一条最终结果
+    assert partials[:4] == ["今", "今天", "今天天", "今天天气"]
+    assert results[-1].final and results[-1].text == "今天天气"
+    assert results[-1].utterance.duration == pytest.approx(backend.calls[0])
+
+def test_listen_stream_closes_session_when_abandoned(temp_dir):
+    path = make_wav(f"{temp_dir}/abandon.wav", [(0.3, False), (1.0, True), (0.6, False)])
+    backend = ScriptedBackend(["今天天气"], chunks_per_char=10)
+    recognizer = SpeechRecognizer(frame_source=WavFrameSource(path), backend=backend)
+    
+    # 拿到第一条部分结果就停止迭代
+    results = recognizer.listen_stream()
+    assert next(results).text == "今"
+    results.close()
+    recognizer.close()
+    
+    assert len(backend.streams) == 1 and backend.streams[0].closed
+    assert backend.calls == []
+
+def test_listen_stream_closes_session_when_too_quiet(temp_dir):
+    path = make_wav(f"{temp_dir}/quiet.wav", [(0.3, False), (1.0, True), (0.6, False)])
+    backend = ScriptedBackend(["今天天气"])
+    recognizer = SpeechRecognizer(frame_source=WavFrameSource(path), backend=backend)
+    recognizer.config.MINIMUM_VOLUME = 10000
+    
+    assert recognizer.listen() is None
+    recognizer.close()
+    assert len(backend.streams) == 1 and backend.streams[0].closed